@@ -0,0 +1,2 @@
+echo "--- Compacting checkpoint database ---"
+cd src/ && python agent/checkpoint/checkpointer.py compact "$@"
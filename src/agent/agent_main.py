@@ -9,18 +9,31 @@ load_dotenv()
 
 import logging
 from typing import Literal
+from functools import cache
 from uuid import uuid4
 from pydantic import BaseModel, Field
-from langgraph.checkpoint.memory import MemorySaver
 from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, START, END
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 
 
 from agent.objects.objects import AgentState
+from agent.checkpoint.checkpointer import get_checkpointer
+from agent.tools.utils.history import summarize_history, window_messages
+from agent.routing.fast_router import fast_router, last_user_text
+from agent.retrieval.brochures import brochure_index
+from agent.tools.utils.semantic_cache import (
+    SEMANTIC_CACHE_GENERAL,
+    SEMANTIC_CACHE_ROUTER,
+    SemanticCache,
+    stateless_text,
+)
 from agent.agent_members.cruise_agent import build_cruise_agent
 
-from agent.prompts.agent_main_prompt import agent_main_routing_prompt
+from agent.prompts.agent_main_prompt import (
+    agent_main_routing_prompt,
+    brochure_answer_prompt,
+)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -29,6 +42,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# turns of history each node sends to the model
+ROUTER_HISTORY_TURNS = 2
+GENERAL_HISTORY_TURNS = 4
+
 
 class Route(BaseModel):
     step: Literal["cruise_node", "general_node"] = Field(
@@ -38,15 +55,34 @@ class Route(BaseModel):
 
 llm = ChatOpenAI(model="gpt-4o-mini")
 router = llm.with_structured_output(Route)
+router_cache = SemanticCache("router", enabled=SEMANTIC_CACHE_ROUTER)
+general_cache = SemanticCache("general_node", enabled=SEMANTIC_CACHE_GENERAL)
 
 
-def supervisor_node(state: AgentState, config: dict):
+async def supervisor_node(state: AgentState, config: dict):
     logger.info(f"Supervisor node called with state: {state}")
 
-    routing_agent = router.invoke(
-        [SystemMessage(content=agent_main_routing_prompt)] + state.messages
-    )
-    return {"agent_routing": routing_agent.step}
+    messages = window_messages(state, ROUTER_HISTORY_TURNS)
+    fast_route = await fast_router.aroute(messages)
+    if fast_route is not None:
+        return {
+            "agent_routing": (
+                "general_node" if fast_route.step == "general_node" else "cruise_node"
+            ),
+            "fast_route": fast_route.step,
+        }
+
+    async def route():
+        routing_agent = await router.ainvoke(
+            [SystemMessage(content=agent_main_routing_prompt)] + messages
+        )
+        # cruise_node decisions are recorded with their final step by the cruise supervisor
+        if routing_agent.step == "general_node":
+            await fast_router.arecord(messages, "general_node")
+        return routing_agent.step
+
+    step = await router_cache.acached(stateless_text(messages), route)
+    return {"agent_routing": step, "fast_route": None}
 
 
 def routing(state: AgentState, config: dict):
@@ -57,23 +93,39 @@ def routing(state: AgentState, config: dict):
     return "general_node"
 
 
-def general_node(state: AgentState, config: dict) -> AgentState:
+async def general_node(state: AgentState, config: dict) -> AgentState:
     logger.info(f"General infor node called with state: {state}")
     prompt = "You are a general information agent. You are responsible for providing general information to the user. However, it's under development, so respond with suggestion that clarify query related to cruise agent."
 
-    return {
-        "messages": [llm.invoke([SystemMessage(content=prompt)] + state.messages)],
-    }
+    messages = window_messages(state, GENERAL_HISTORY_TURNS)
+
+    async def answer():
+        excerpts = await brochure_index.asearch(last_user_text(state.messages))
+        system_prompt = prompt
+        if excerpts:
+            system_prompt = brochure_answer_prompt.format(
+                excerpts="\n\n".join(
+                    f"[{excerpt['source']}] {excerpt['text']}" for excerpt in excerpts
+                )
+            )
+        return (
+            await llm.ainvoke([SystemMessage(content=system_prompt)] + messages)
+        ).content
+
+    content = await general_cache.acached(stateless_text(messages), answer)
+    return {"messages": [AIMessage(content=content)]}
 
 
 def create_agent():
     agent = StateGraph(AgentState)
 
+    agent.add_node("summarize_history", summarize_history)
     agent.add_node("supervisor", supervisor_node)
     agent.add_node("cruise_node", build_cruise_agent())
     agent.add_node("general_node", general_node)
 
-    agent.add_edge(START, "supervisor")
+    agent.add_edge(START, "summarize_history")
+    agent.add_edge("summarize_history", "supervisor")
     agent.add_conditional_edges(
         "supervisor",
         routing,
@@ -85,23 +137,33 @@ def create_agent():
     agent.add_edge("cruise_node", END)
     agent.add_edge("general_node", END)
 
-    return agent.compile(checkpointer=MemorySaver())
+    return agent.compile(checkpointer=get_checkpointer())
+
 
+@cache
+def get_agent_main():
+    """The compiled main graph, built once on first use (the server builds it
+    while starting up, see agent_server.warm_up)."""
+    return create_agent()
 
-agent_main = create_agent()
 
 if __name__ == "__main__":
+    import asyncio
+
+    agent_main = get_agent_main()
 
     configurable = {"thread_id": 1}
     run_id = uuid4()
     config = {"configurable": configurable}
 
-    messages = agent_main.invoke(
-        input={
-            "messages": [HumanMessage("Do you have any cruises to Lisbon?")],
-            "current_cruise": {"id": "6787671e9eced029e8747030"},
-        },
-        config=config,
+    messages = asyncio.run(
+        agent_main.ainvoke(
+            input={
+                "messages": [HumanMessage("Do you have any cruises to Lisbon?")],
+                "current_cruise": {"id": "6787671e9eced029e8747030"},
+            },
+            config=config,
+        )
     )
     for m in messages["messages"]:
         m.pretty_print()
@@ -1,5 +1,6 @@
 import sys
 import os
+import re
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 from langchain_openai import ChatOpenAI
@@ -14,12 +15,21 @@ from langgraph.graph import StateGraph, START, END
 from langchain_openai import ChatOpenAI
 import logging
 from typing import Literal, TypedDict
+from functools import cache
 from agent.tools.utils.utils import wrap_model
+from agent.tools.utils.history import window_messages
+from agent.routing.fast_router import fast_router
+from agent.tools.utils.semantic_cache import (
+    SEMANTIC_CACHE_NODE_ROUTER,
+    SemanticCache,
+    stateless_text,
+)
+from agent.tools.utils.cache import TTLCache
+from agent.tools.utils.search_parser import SEARCH_PRE_PARSER, aget_search_parser
+from agent.checkpoint.checkpointer import get_checkpointer
 from exceptions import NotFound
 from pydantic import BaseModel, Field
-from langgraph.checkpoint.memory import MemorySaver
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, ToolMessage
-from langchain.prompts import ChatPromptTemplate
 from agent.tools.db.db import DBTool, CabinItem
 from agent.tools.db.schema.order_item import OrderIn
 from typing import Annotated
@@ -27,6 +37,8 @@ from langgraph.prebuilt import InjectedState
 from langchain_core.runnables.config import RunnableConfig
 
 from langgraph.types import Command, interrupt
+from langgraph.config import get_stream_writer
+from langgraph.constants import TAG_NOSTREAM
 from langgraph.graph import START, StateGraph
 from langchain_core.tools.base import InjectedToolCallId
 from langgraph.prebuilt import tools_condition, ToolNode
@@ -37,12 +49,24 @@ from agent.prompts.cruise_agent_prompt import (
     payment_infor_extract_prompt,
 )
 
-db_tool = DBTool()
+
+@cache
+def get_db_tool() -> DBTool:
+    """The DBTool of the graph nodes, created on first use rather than at import."""
+    return DBTool()
+
+
 llm = ChatOpenAI(model="gpt-4o", temperature=0.5)
 
+# turns of history each node sends to the model
+ROUTER_HISTORY_TURNS = 2
+SEARCH_HISTORY_TURNS = 4
+ASSISTANT_HISTORY_TURNS = 6
+PASSENGER_INFO_HISTORY_TURNS = 3
+
 
 @tool
-def provide_cruise_detail(
+async def provide_cruise_detail(
     cruise_id: str | None,
     currency: str,
     tool_call_id: Annotated[str, InjectedToolCallId],
@@ -67,7 +91,7 @@ def provide_cruise_detail(
                 "action": "",
             }
         )
-    cruise_detail = db_tool.get_cruise_infor(cruise_id, currency)
+    cruise_detail = await get_db_tool().aget_cruise_infor(cruise_id, currency)
 
     return Command(
         update={
@@ -79,7 +103,7 @@ def provide_cruise_detail(
 
 
 @tool
-def add_cabin_to_cart(
+async def add_cabin_to_cart(
     state: Annotated[AgentState, InjectedState],
     config: RunnableConfig,
     tool_call_id: Annotated[str, InjectedToolCallId],
@@ -94,15 +118,17 @@ def add_cabin_to_cart(
     try:
         user_id = config.get("configurable", {}).get("user_id")
         list_cabins = []
-        db_list_cabins = db_tool.get_list_cabin(state.current_cruise_id, state.currency)
+        db_list_cabins = await get_db_tool().aget_list_cabin(
+            state.current_cruise_id, state.currency
+        )
         list_descriptions = [cabin["description"] for cabin in db_list_cabins]
         if state.current_cabin not in list_descriptions:
             raise NotFound(f"Cabin {state.current_cabin} not found in the cruise")
-        cruise_info = db_tool.get_cruise_infor(
+        cruise_info = await get_db_tool().aget_cruise_infor(
             state.current_cruise_id, state.currency
         )
         if user_id is not None:
-            added_cabin = db_tool.save_cabin_to_cart(
+            added_cabin = await get_db_tool().asave_cabin_to_cart(
                 user_id=config.get("configurable", {}).get("user_id"),
                 cabin_item=cabin_item,
             )
@@ -121,6 +147,7 @@ def add_cabin_to_cart(
         added_cabin["sailEndDate"] = cruise_info.get("sailEndDate", None)
         added_cabin["sailStartDate"] = cruise_info.get("sailStartDate", None)
         list_cabins += [added_cabin]
+        get_stream_writer()({"list_cabins": list_cabins})
 
     except NotFound as e:
         message = e
@@ -142,7 +169,7 @@ def add_cabin_to_cart(
 
 
 @tool
-def cancel_cabin_from_cart(
+async def cancel_cabin_from_cart(
     tool_call_id: Annotated[str, InjectedToolCallId],
 ):
     """Cancel a cabin from the cart."""
@@ -161,7 +188,7 @@ def cancel_cabin_from_cart(
 
 
 @tool
-def get_list_cabin_in_cruise(
+async def get_list_cabin_in_cruise(
     cruise_id: str | None,
     currency: str,
     tool_call_id: Annotated[str, InjectedToolCallId],
@@ -186,7 +213,8 @@ def get_list_cabin_in_cruise(
                 "action": "",
             }
         )
-    list_cabins = db_tool.get_list_cabin(cruise_id, currency)
+    list_cabins = await get_db_tool().aget_list_cabin(cruise_id, currency)
+    get_stream_writer()({"list_cabins": list_cabins})
 
     return Command(
         update={
@@ -203,8 +231,42 @@ def get_list_cabin_in_cruise(
     )
 
 
+# replies to a payment confirmation classified by the LLM, reused only for the
+# same reply up to case and punctuation; 0 disables
+PAYMENT_CONFIRM_CACHE_SIZE = int(os.getenv("PAYMENT_CONFIRM_CACHE_SIZE", "2000"))
+
+# exact lookups only: "yes, continue" and "no, don't continue" embed too close
+# for a similarity cache to decide a payment
+payment_cache = TTLCache(PAYMENT_CONFIRM_CACHE_SIZE, name="payment_confirm")
+
+
+def normalize_confirmation(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", text.casefold()).split())
+
+
+async def should_continue_payment(user_confirm: str) -> bool:
+    """Whether the user's reply to a payment confirmation is a yes."""
+
+    key = normalize_confirmation(user_confirm)
+    answer = payment_cache.get(key)
+    if answer is None:
+        answer = (
+            await llm.ainvoke(
+                [
+                    SystemMessage(
+                        content="Based on user's reponse, determine if the payment should be continued. Respond with exactly yes or no, do not add any additional information."
+                    ),
+                    HumanMessage(content=user_confirm),
+                ]
+            )
+        ).content
+        if answer in ("yes", "no"):
+            payment_cache.set(key, answer)
+    return answer == "yes"
+
+
 @tool
-def payment(
+async def payment(
     state: Annotated[AgentState, InjectedState],
     tool_call_id: Annotated[str, InjectedToolCallId],
 ):
@@ -219,27 +281,20 @@ def payment(
     Instructions:
         - All necessary information is already provided via the state graph; do not ask for additional details.
     """
-    confirm_message = llm.invoke(
+    confirm_message = await llm.ainvoke(
         "Politely ask the user to confirm to continue with the payment."
     )
     user_confirm = interrupt(confirm_message.content)
-    do_continue = llm.invoke(
-        [
-            SystemMessage(
-                content="Based on user's reponse, determine if the payment should be continued. Respond with exactly yes or no, do not add any additional information."
-            ),
-            HumanMessage(content=user_confirm),
-        ]
-    )
+    do_continue = await should_continue_payment(user_confirm)
     return Command(
         update={
             "messages": [
                 ToolMessage(content=confirm_message.content, tool_call_id=tool_call_id),
                 HumanMessage(content=user_confirm),
             ],
-            "action": ("show_user_form" if do_continue.content == "yes" else ""),
+            "action": ("show_user_form" if do_continue else ""),
             "func_routing": (
-                "passenger_info" if do_continue.content == "yes" else "cruise_assistant"
+                "passenger_info" if do_continue else "cruise_assistant"
             ),
         },
     )
@@ -260,26 +315,51 @@ class NodeRoute(BaseModel):
 
 
 node_router = llm.with_structured_output(NodeRoute)
+node_router_cache = SemanticCache("node_router", enabled=SEMANTIC_CACHE_NODE_ROUTER)
 
 
-def supervisor_node(state: AgentState, config: dict):
-    routing_node = node_router.invoke(
-        [SystemMessage(content=cruise_router_prompt)] + state.messages
-    )
-    return {"func_routing": routing_node.step}
+async def supervisor_node(state: AgentState, config: dict):
+    if state.fast_route in ("cruise_search", "cruise_assistant"):
+        return {"func_routing": state.fast_route}
+
+    messages = window_messages(state, ROUTER_HISTORY_TURNS)
+
+    async def route():
+        routing_node = await node_router.ainvoke(
+            [SystemMessage(content=cruise_router_prompt)] + messages
+        )
+        await fast_router.arecord(messages, routing_node.step)
+        return routing_node.step
+
+    step = await node_router_cache.acached(stateless_text(messages), route)
+    return {"func_routing": step}
 
 
-def cruise_search_node(state: AgentState, config: dict) -> AgentState:
-    model_with_structured_output = llm.with_structured_output(CruiseSearchInfo)
+async def cruise_search_node(state: AgentState, config: dict) -> AgentState:
+    # the extraction is internal, only the summary below is streamed to the client
+    model_with_structured_output = llm.with_structured_output(
+        CruiseSearchInfo
+    ).with_config(tags=[TAG_NOSTREAM])
     wrapped_model = wrap_model(
         model=model_with_structured_output,
         system_prompt=extract_infor_promt(state.cruise_search_info),
+        history_turns=SEARCH_HISTORY_TURNS,
     )
-    user_preferences = wrapped_model.invoke(state, config)
-    list_cruises = db_tool.get_cruises(user_preferences.model_dump())
-    total_number_of_cruises = len(list_cruises)
-    list_cruises = list_cruises[:5]  ## Only take 5
-    response = llm.invoke(
+    user_preferences = None
+    # the rules only see the message, so earlier turns whose criteria the
+    # LLM would carry over send it to the LLM
+    text = stateless_text(window_messages(state, SEARCH_HISTORY_TURNS))
+    if SEARCH_PRE_PARSER and text and state.cruise_search_info is None:
+        parser = await aget_search_parser(get_db_tool().async_collection)
+        user_preferences = parser.parse(text)
+    if user_preferences is None:
+        user_preferences = await wrapped_model.ainvoke(state, config)
+    page = await get_db_tool().aget_cruises(user_preferences.model_dump())
+    total_number_of_cruises = page["total"]
+    list_cruises = page["cruises"]
+    # push the cards before the summary call so the client can render them early
+    get_stream_writer()({"list_cruises": list_cruises})
+    response = await llm.ainvoke(
         [
             SystemMessage(content=cruise_search_prompt),
             AIMessage(
@@ -295,7 +375,7 @@ def cruise_search_node(state: AgentState, config: dict) -> AgentState:
     }
 
 
-def assistant(state: AgentState):
+async def assistant(state: AgentState):
     cruise_assistant_prompt_with_current_cruise_id = cruise_assistant_prompt.format(
         current_cruise_id=state.current_cruise_id,
         current_cabin=state.current_cabin,
@@ -303,9 +383,9 @@ def assistant(state: AgentState):
     llm_with_tools = llm.bind_tools([*tools, payment], parallel_tool_calls=False)
     return {
         "messages": [
-            llm_with_tools.invoke(
+            await llm_with_tools.ainvoke(
                 [SystemMessage(content=cruise_assistant_prompt_with_current_cruise_id)]
-                + state.messages
+                + window_messages(state, ASSISTANT_HISTORY_TURNS)
             )
         ]
     }
@@ -322,15 +402,15 @@ def assistant_route_tools(state: AgentState, config: dict):
     return "tools"
 
 
-def passenger_info_node(state: AgentState, config: dict):
-    confirm_message = llm.invoke(
+async def passenger_info_node(state: AgentState, config: dict):
+    confirm_message = await llm.ainvoke(
         [SystemMessage("Politely ask the user about their passenger information.")]
-        + state.messages
+        + window_messages(state, PASSENGER_INFO_HISTORY_TURNS)
     )
     passenger_info = interrupt(confirm_message.content)
 
     infor_extractor = llm.with_structured_output(OrderIn)
-    order: OrderIn = infor_extractor.invoke(
+    order: OrderIn = await infor_extractor.ainvoke(
         [
             SystemMessage(payment_infor_extract_prompt),
             HumanMessage(content=passenger_info),
@@ -339,7 +419,7 @@ def passenger_info_node(state: AgentState, config: dict):
     order.userId = config.get("configurable", {}).get("user_id")
 
     try:
-        db_tool.save_order(order)
+        await get_db_tool().asave_order(order)
         message = "Order saved successfully"
 
         return Command(
@@ -366,8 +446,8 @@ def passenger_info_node(state: AgentState, config: dict):
         )
 
 
-def payment_failed(state: AgentState, config: dict):
-    confirm_message = llm.invoke(
+async def payment_failed(state: AgentState, config: dict):
+    confirm_message = await llm.ainvoke(
         # [
         [
             SystemMessage(
@@ -377,23 +457,16 @@ def payment_failed(state: AgentState, config: dict):
         + state.messages[-2:]
     )
     user_confirm = interrupt(confirm_message.content)
-    do_continue = llm.invoke(
-        [
-            SystemMessage(
-                content="Based on user's reponse, determine if the payment should be continued. Respond with exactly yes or no, do not add any additional information."
-            ),
-            HumanMessage(content=user_confirm),
-        ]
-    )
+    do_continue = await should_continue_payment(user_confirm)
     return Command(
         update={
             "messages": [
                 AIMessage(content=confirm_message.content),
                 HumanMessage(content=user_confirm),
             ],
-            "action": ("show_user_form" if do_continue.content == "yes" else ""),
+            "action": ("show_user_form" if do_continue else ""),
             "func_routing": (
-                "passenger_info" if do_continue.content == "yes" else "cruise_assistant"
+                "passenger_info" if do_continue else "cruise_assistant"
             ),
         },
     )
@@ -438,11 +511,11 @@ def build_cruise_agent():
 
     cruise_agent.set_entry_point("cruise_supervisor")
 
-    cruise_agent = cruise_agent.compile(checkpointer=MemorySaver())
+    cruise_agent = cruise_agent.compile(checkpointer=get_checkpointer())
     return cruise_agent
 
 
-def test(cruise_agent):
+async def test(cruise_agent):
     config = {"configurable": {"thread_id": 1, "user_id": "67bc43923f9f1b182eb81908"}}
     messages = [
         # "any cruise to Europe?",
@@ -456,7 +529,7 @@ def test(cruise_agent):
     for message in messages:
         message = HumanMessage(content=message)
         message.pretty_print()
-        messages = cruise_agent.invoke(
+        messages = await cruise_agent.ainvoke(
             input={
                 "messages": [message],
                 "current_cruise_id": "678767209eced029e874703d",
@@ -464,38 +537,17 @@ def test(cruise_agent):
             },
             config=config,
         )
-        snapshot = cruise_agent.get_state(config)
-        while snapshot.next:
-            ai_message = snapshot.tasks[0].interrupts[0].value
+        while "__interrupt__" in messages:
+            ai_message = messages["__interrupt__"][0].value
             value_from_human = "yes"
-            messages = cruise_agent.invoke(
+            messages = await cruise_agent.ainvoke(
                 Command(resume=value_from_human), config=config
             )
-            snapshot = cruise_agent.get_state(config)
         # messages["messages"][-1].pretty_print()
         print(messages["messages"])
 
 
-cruise_agent = build_cruise_agent()
-if __name__ == "__main__":
-    # main()
-    # import time
-
-    # config = {"configurable": {"thread_id": 1, "user_id": "67bc43923f9f1b182eb81908"}}
-    # messages = cruise_agent.invoke(
-    #     input={
-    #         "messages": ["add current cabin to cart"],
-    #         "current_cruise_id": "678767209eced029e874703d",
-    #         "current_cabin": "Classic Veranda Suite",
-    #     },
-    #     config=config,
-    # )
-    # print(messages)
-
-    # start_time = time.time()
-    # test(cruise_agent)
-    # end_time = time.time()
-    # print(f"Total Time taken: {end_time - start_time} seconds")
+async def main(cruise_agent):
     config = {"configurable": {"thread_id": 1, "user_id": "67bc43923f9f1b182eb81908"}}
     while True:
         try:
@@ -507,7 +559,7 @@ if __name__ == "__main__":
         if user_input.strip().lower() in ["exit", "quit", "q"]:
             print("👋 Goodbye!")
             break
-        messages = cruise_agent.invoke(
+        messages = await cruise_agent.ainvoke(
             input={
                 "messages": [HumanMessage(content=user_input)],
                 "current_cruise_id": "678767209eced029e874703d",
@@ -517,13 +569,24 @@ if __name__ == "__main__":
             },
             config=config,
         )
-        snapshot = cruise_agent.get_state(config)
-        while snapshot.next:
-            print(snapshot.values)
-            ai_message = snapshot.tasks[0].interrupts[0].value
+        while "__interrupt__" in messages:
+            ai_message = messages["__interrupt__"][0].value
             value_from_human = input(f"{ai_message}:\n")
-            messages = cruise_agent.invoke(
+            messages = await cruise_agent.ainvoke(
                 Command(resume=value_from_human), config=config
             )
-            snapshot = cruise_agent.get_state(config)
         messages["messages"][-1].pretty_print()
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    cruise_agent = build_cruise_agent()
+
+    # import time
+
+    # start_time = time.time()
+    # asyncio.run(test(cruise_agent))
+    # end_time = time.time()
+    # print(f"Total Time taken: {end_time - start_time} seconds")
+    asyncio.run(main(cruise_agent))
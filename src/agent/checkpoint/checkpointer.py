@@ -0,0 +1,67 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from dotenv import load_dotenv
+from langgraph.checkpoint.memory import MemorySaver
+
+from agent.checkpoint.sqlite_saver import SqliteSaver
+
+load_dotenv()
+
+_checkpointer = None
+
+
+def get_checkpointer():
+    """Return the process-wide checkpointer selected by the environment.
+
+    CHECKPOINTER: "sqlite" (default) or "memory"
+    CHECKPOINT_DB_PATH: SQLite file used by the sqlite checkpointer
+    CHECKPOINT_TTL_SECONDS: idle time after which a thread is deleted
+    CHECKPOINT_SWEEP_INTERVAL_SECONDS: how often expired threads are swept
+    CHECKPOINT_SNAPSHOT_EVERY: message list deltas between two full snapshots
+    """
+    global _checkpointer
+    if _checkpointer is not None:
+        return _checkpointer
+
+    backend = os.getenv("CHECKPOINTER", "sqlite").lower()
+    if backend == "memory":
+        _checkpointer = MemorySaver()
+    elif backend == "sqlite":
+        ttl_seconds = os.getenv("CHECKPOINT_TTL_SECONDS", "86400")
+        _checkpointer = SqliteSaver(
+            os.getenv("CHECKPOINT_DB_PATH", "checkpoints.sqlite"),
+            ttl_seconds=float(ttl_seconds) if ttl_seconds else None,
+            sweep_interval_seconds=float(
+                os.getenv("CHECKPOINT_SWEEP_INTERVAL_SECONDS", "600")
+            ),
+            snapshot_every=int(os.getenv("CHECKPOINT_SNAPSHOT_EVERY", "32")),
+        )
+    else:
+        raise ValueError(f"Unknown CHECKPOINTER backend: {backend}")
+    return _checkpointer
+
+
+if __name__ == "__main__":
+    import argparse
+    import logging
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Maintain the checkpoint database")
+    parser.add_argument("command", choices=["compact", "expire"])
+    parser.add_argument(
+        "--keep-last",
+        type=int,
+        default=1,
+        help="checkpoints to keep per thread when compacting",
+    )
+    args = parser.parse_args()
+
+    checkpointer = get_checkpointer()
+    if not isinstance(checkpointer, SqliteSaver):
+        parser.error("CHECKPOINTER is not set to sqlite")
+    if args.command == "compact":
+        print(checkpointer.compact(keep_last=args.keep_last))
+    else:
+        print({"expired_threads": checkpointer.expire()})
@@ -0,0 +1,757 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Iterator, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from pydantic import BaseModel
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_serializable_checkpoint_metadata,
+)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+CREATE TABLE IF NOT EXISTS channel_values (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    channel TEXT NOT NULL,
+    version TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    ref TEXT,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    PRIMARY KEY (thread_id, digest)
+);
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS threads_updated_at ON threads (updated_at);
+"""
+
+# channels holding an append-mostly list of messages, stored as message list deltas
+MESSAGE_CHANNELS = {"messages"}
+
+
+class SqliteSaver(BaseCheckpointSaver):
+    """Checkpointer persisting graph state in a local SQLite file.
+
+    Every put touches the thread's `updated_at`; threads idle for longer than
+    `ttl_seconds` are deleted by `expire`, which also runs opportunistically from
+    `put` at most once per `sweep_interval_seconds`. Threads paused at an
+    `interrupt()` (e.g. waiting for a payment confirmation) are idle threads like
+    any other and expire the same way. `compact` drops superseded checkpoints and
+    reclaims the file space.
+
+    Checkpoints are delta-encoded: a put only stores the channels listed in
+    `new_versions`, channel values are content-addressed per thread (so the cruise
+    subgraph's copy of the parent state costs nothing), and the messages channel
+    is stored as the list of newly appended messages on top of the previous list,
+    with a full list every `snapshot_every` steps to bound the read chain.
+    `take_bytes_written` reports how many bytes a thread wrote since the last call.
+
+    The async methods run the SQLite calls in a worker thread so they never block
+    the event loop.
+
+    One serving process per file is supported: SQLite serializes the writers,
+    but concurrent writers wait on each other's locks. The `compact` CLI may run
+    next to the server, the cached base of a message delta is checked against
+    the thread's stored `messages_ref` before it is used.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl_seconds: Optional[float] = None,
+        sweep_interval_seconds: float = 600,
+        snapshot_every: int = 32,
+        serde=None,
+    ):
+        super().__init__(serde=serde)
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self.snapshot_every = snapshot_every
+        self.bytes_written = defaultdict(int)
+        # thread_id -> (record digest, message digests, depth) of the last list put,
+        # only used while it is still the thread's messages_ref in the file
+        self._message_lists = OrderedDict()
+        self._last_sweep = time.time()
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        thread_columns = [row[1] for row in self.conn.execute("PRAGMA table_info(threads)")]
+        if "messages_ref" not in thread_columns:
+            self.conn.execute("ALTER TABLE threads ADD COLUMN messages_ref TEXT")
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock, self.conn:
+            yield self.conn
+
+    def _row_to_tuple(self, conn, row) -> CheckpointTuple:
+        (
+            thread_id,
+            checkpoint_ns,
+            checkpoint_id,
+            parent_checkpoint_id,
+            type_,
+            checkpoint,
+            metadata_type,
+            metadata,
+        ) = row
+        writes = conn.execute(
+            "SELECT task_id, channel, type, value FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? "
+            "ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        checkpoint = self.serde.loads_typed((type_, checkpoint))
+        # rows written before delta encoding still carry their channel values inline
+        checkpoint["channel_values"] = {
+            **checkpoint.get("channel_values", {}),
+            **self._load_channel_values(
+                conn, thread_id, checkpoint_ns, checkpoint["channel_versions"]
+            ),
+        }
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+            checkpoint=checkpoint,
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": parent_checkpoint_id,
+                    }
+                }
+                if parent_checkpoint_id
+                else None
+            ),
+            pending_writes=[
+                (task_id, channel, self._load_write(conn, thread_id, w_type, value))
+                for task_id, channel, w_type, value in writes
+            ],
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        query = (
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+            "type, checkpoint, metadata_type, metadata FROM checkpoints "
+            "WHERE thread_id = ? AND checkpoint_ns = ?"
+        )
+        params = [thread_id, checkpoint_ns]
+        if checkpoint_id := get_checkpoint_id(config):
+            query += " AND checkpoint_id = ?"
+            params.append(checkpoint_id)
+        else:
+            query += " ORDER BY checkpoint_id DESC LIMIT 1"
+        with self._transaction() as conn:
+            row = conn.execute(query, params).fetchone()
+            if row is None:
+                return None
+            return self._row_to_tuple(conn, row)
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        conditions, params = [], []
+        if config is not None:
+            conditions.append("thread_id = ?")
+            params.append(str(config["configurable"]["thread_id"]))
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                conditions.append("checkpoint_ns = ?")
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                conditions.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before is not None:
+            conditions.append("checkpoint_id < ?")
+            params.append(get_checkpoint_id(before))
+        query = (
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+            "type, checkpoint, metadata_type, metadata FROM checkpoints"
+        )
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY checkpoint_id DESC"
+        if limit is not None and not filter:
+            query += f" LIMIT {int(limit)}"
+
+        with self._transaction() as conn:
+            checkpoint_tuples = []
+            for row in conn.execute(query, params).fetchall():
+                checkpoint_tuple = self._row_to_tuple(conn, row)
+                if filter and any(
+                    checkpoint_tuple.metadata.get(key) != value
+                    for key, value in filter.items()
+                ):
+                    continue
+                checkpoint_tuples.append(checkpoint_tuple)
+                if limit is not None and len(checkpoint_tuples) >= limit:
+                    break
+        yield from checkpoint_tuples
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint = checkpoint.copy()
+        values = checkpoint.pop("channel_values")
+        checkpoint["channel_values"] = {}
+        type_, serialized_checkpoint = self.serde.dumps_typed(checkpoint)
+        metadata_type, serialized_metadata = self.serde.dumps_typed(
+            get_serializable_checkpoint_metadata(config, metadata)
+        )
+        with self._transaction() as conn:
+            self._touch(conn, thread_id)
+            written = len(serialized_checkpoint) + len(serialized_metadata)
+            for channel, version in new_versions.items():
+                if channel not in values:
+                    kind, ref = "empty", None
+                else:
+                    kind, ref, size = self._put_value(
+                        conn, thread_id, channel, values[channel]
+                    )
+                    written += size
+                conn.execute(
+                    "INSERT OR REPLACE INTO channel_values (thread_id, checkpoint_ns, "
+                    "channel, version, kind, ref) VALUES (?, ?, ?, ?, ?, ?)",
+                    (thread_id, checkpoint_ns, channel, str(version), kind, ref),
+                )
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, "
+                "checkpoint_id, parent_checkpoint_id, type, checkpoint, "
+                "metadata_type, metadata) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    thread_id,
+                    checkpoint_ns,
+                    checkpoint["id"],
+                    config["configurable"].get("checkpoint_id"),
+                    type_,
+                    serialized_checkpoint,
+                    metadata_type,
+                    serialized_metadata,
+                ),
+            )
+            self.bytes_written[thread_id] += written
+        self._maybe_sweep()
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        # special writes (errors, interrupts, ...) replace the previous value,
+        # regular writes are only stored once per task and index
+        verb = (
+            "INSERT OR REPLACE"
+            if all(channel in WRITES_IDX_MAP for channel, _ in writes)
+            else "INSERT OR IGNORE"
+        )
+        with self._transaction() as conn:
+            self._touch(conn, thread_id)
+            # write values go through the same content-addressed store as the
+            # channels, e.g. the cruise subgraph's output repeats the whole state
+            rows, written = [], 0
+            for idx, (channel, value) in enumerate(writes):
+                kind, ref, size = self._put_value(
+                    conn, thread_id, channel, value, remember=False
+                )
+                written += size + len(ref)
+                rows.append(
+                    (
+                        thread_id,
+                        checkpoint_ns,
+                        checkpoint_id,
+                        task_id,
+                        WRITES_IDX_MAP.get(channel, idx),
+                        channel,
+                        f"ref:{kind}",
+                        ref.encode(),
+                        task_path,
+                    )
+                )
+            conn.executemany(
+                f"{verb} INTO writes (thread_id, checkpoint_ns, checkpoint_id, "
+                "task_id, idx, channel, type, value, task_path) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.bytes_written[thread_id] += written
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._transaction() as conn:
+            self._delete_threads(conn, [str(thread_id)])
+
+    def take_bytes_written(self, thread_id: str) -> int:
+        """Return the bytes written for `thread_id` since the previous call."""
+        with self._lock:
+            return self.bytes_written.pop(str(thread_id), 0)
+
+    def _touch(self, conn, thread_id: str):
+        conn.execute(
+            "INSERT INTO threads (thread_id, updated_at) VALUES (?, ?) "
+            "ON CONFLICT (thread_id) DO UPDATE SET updated_at = excluded.updated_at",
+            (thread_id, time.time()),
+        )
+
+    def _delete_threads(self, conn, thread_ids: Sequence[str]):
+        for table in ("checkpoints", "writes", "channel_values", "blobs", "threads"):
+            conn.executemany(
+                f"DELETE FROM {table} WHERE thread_id = ?",
+                [(thread_id,) for thread_id in thread_ids],
+            )
+        for thread_id in thread_ids:
+            self._message_lists.pop(thread_id, None)
+            self.bytes_written.pop(thread_id, None)
+
+    def _put_blob(self, conn, thread_id: str, type_: str, value: bytes):
+        """Store a value once per thread, keyed by its digest.
+
+        Returns the digest and the number of bytes actually written.
+        """
+        digest = hashlib.sha1(type_.encode() + b"\0" + value).hexdigest()
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO blobs (thread_id, digest, type, value) "
+            "VALUES (?, ?, ?, ?)",
+            (thread_id, digest, type_, value),
+        )
+        return digest, (len(value) if cursor.rowcount > 0 else 0)
+
+    def _get_blobs(self, conn, thread_id: str, digests) -> dict:
+        digests = list(set(digests))
+        blobs = {}
+        for start in range(0, len(digests), 500):
+            chunk = digests[start : start + 500]
+            rows = conn.execute(
+                "SELECT digest, type, value FROM blobs WHERE thread_id = ? "
+                f"AND digest IN ({', '.join('?' * len(chunk))})",
+                [thread_id, *chunk],
+            ).fetchall()
+            for digest, type_, value in rows:
+                blobs[digest] = (type_, value)
+        return blobs
+
+    def _put_value(
+        self, conn, thread_id: str, channel: str, value: Any, remember: bool = True
+    ):
+        """Store a channel or write value, returning `(kind, ref, bytes written)`."""
+        if channel in MESSAGE_CHANNELS and isinstance(value, list):
+            ref, size = self._put_messages(conn, thread_id, value, remember)
+            return "messages", ref, size
+        # whole states (graph and subgraph inputs) are split per field so their
+        # messages become deltas and unchanged lists (e.g. list_cruises) dedupe
+        if isinstance(value, (dict, BaseModel)):
+            if isinstance(value, BaseModel):
+                fields = {key: getattr(value, key) for key in type(value).model_fields}
+            else:
+                fields = value
+            if any(isinstance(fields.get(key), list) for key in MESSAGE_CHANNELS):
+                record = {"messages": {}, "fields": {}}
+                empty, written = {}, 0
+                for key, field_value in fields.items():
+                    if key in MESSAGE_CHANNELS and isinstance(field_value, list):
+                        record["messages"][key], size = self._put_messages(
+                            conn, thread_id, field_value, remember=False
+                        )
+                    elif isinstance(field_value, (list, dict)):
+                        record["fields"][key], size = self._put_blob(
+                            conn, thread_id, *self.serde.dumps_typed(field_value)
+                        )
+                    else:
+                        continue
+                    empty[key] = [] if isinstance(field_value, list) else {}
+                    written += size
+                if isinstance(value, BaseModel):
+                    rest = value.model_copy(update=empty)
+                else:
+                    rest = {**value, **empty}
+                record["rest"], size = self._put_blob(
+                    conn, thread_id, *self.serde.dumps_typed(rest)
+                )
+                written += size
+                ref, size = self._put_blob(
+                    conn, thread_id, "json", json.dumps(record).encode()
+                )
+                return "state", ref, written + size
+        ref, size = self._put_blob(conn, thread_id, *self.serde.dumps_typed(value))
+        return "blob", ref, size
+
+    def _load_value(self, conn, thread_id: str, kind: str, ref: str):
+        if kind == "messages":
+            records = self._message_records(conn, thread_id, ref)
+            digests = [
+                digest for record in reversed(records) for digest in record["append"]
+            ]
+            blobs = self._get_blobs(conn, thread_id, digests)
+            return [self.serde.loads_typed(blobs[digest]) for digest in digests]
+        if kind == "state":
+            record = json.loads(self._get_blobs(conn, thread_id, [ref])[ref][1])
+            rest = self._load_value(conn, thread_id, "blob", record["rest"])
+            fields = {
+                key: self._load_value(conn, thread_id, "blob", field_ref)
+                for key, field_ref in record["fields"].items()
+            }
+            for key, message_ref in record["messages"].items():
+                fields[key] = self._load_value(conn, thread_id, "messages", message_ref)
+            if isinstance(rest, BaseModel):
+                return rest.model_copy(update=fields)
+            return {**rest, **fields}
+        return self.serde.loads_typed(self._get_blobs(conn, thread_id, [ref])[ref])
+
+    def _load_write(self, conn, thread_id: str, type_: str, value: bytes):
+        # writes stored before delta encoding hold the serialized value inline
+        if type_.startswith("ref:"):
+            return self._load_value(conn, thread_id, type_[4:], value.decode())
+        return self.serde.loads_typed((type_, value))
+
+    def _put_messages(
+        self, conn, thread_id: str, messages: list, remember: bool = True
+    ):
+        """Store a message list as a delta on top of the thread's last list.
+
+        Every message body is a content-addressed blob; the list itself is a small
+        JSON record `{"base": <record>, "append": [digests], "depth": n}`. Unless
+        `remember` is set, the list only becomes the base of later deltas when it
+        extends the current one (a node's write usually holds just its new messages).
+        """
+        written = 0
+        digests = []
+        for message in messages:
+            digest, size = self._put_blob(
+                conn, thread_id, *self.serde.dumps_typed(message)
+            )
+            digests.append(digest)
+            written += size
+
+        last = self._last_message_list(conn, thread_id)
+        if last is not None and last[1] == digests:
+            return last[0], written
+        extends_last = last is not None and digests[: len(last[1])] == last[1]
+        if extends_last and last[2] < self.snapshot_every:
+            record = {
+                "base": last[0],
+                "append": digests[len(last[1]) :],
+                "depth": last[2] + 1,
+            }
+        else:
+            record = {"base": None, "append": digests, "depth": 0}
+        ref, size = self._put_blob(
+            conn, thread_id, "json", json.dumps(record).encode()
+        )
+        written += size
+        if remember or extends_last:
+            conn.execute(
+                "UPDATE threads SET messages_ref = ? WHERE thread_id = ?",
+                (ref, thread_id),
+            )
+            self._remember_message_list(thread_id, (ref, digests, record["depth"]))
+        return ref, written
+
+    def _remember_message_list(self, thread_id: str, message_list: tuple):
+        self._message_lists[thread_id] = message_list
+        self._message_lists.move_to_end(thread_id)
+        while len(self._message_lists) > 1024:
+            self._message_lists.popitem(last=False)
+
+    def _last_message_list(self, conn, thread_id: str):
+        row = conn.execute(
+            "SELECT messages_ref FROM threads WHERE thread_id = ?", (thread_id,)
+        ).fetchone()
+        if row is None or row[0] is None:
+            # expired or deleted by another connection since it was cached
+            self._message_lists.pop(thread_id, None)
+            return None
+        cached = self._message_lists.get(thread_id)
+        if cached is not None and cached[0] == row[0]:
+            return cached
+        records = self._message_records(conn, thread_id, row[0])
+        if not records:
+            return None
+        message_list = (
+            row[0],
+            [digest for record in reversed(records) for digest in record["append"]],
+            records[0]["depth"],
+        )
+        self._remember_message_list(thread_id, message_list)
+        return message_list
+
+    def _message_records(self, conn, thread_id: str, ref: str) -> list:
+        """Follow a message list record back to its full snapshot, newest first."""
+        records = []
+        while ref is not None:
+            blob = self._get_blobs(conn, thread_id, [ref]).get(ref)
+            if blob is None:
+                break
+            record = json.loads(blob[1])
+            records.append(record)
+            ref = record["base"]
+        return records
+
+    def _load_channel_values(
+        self, conn, thread_id: str, checkpoint_ns: str, channel_versions: dict
+    ) -> dict:
+        values = {}
+        for channel, version in channel_versions.items():
+            row = conn.execute(
+                "SELECT kind, ref FROM channel_values WHERE thread_id = ? "
+                "AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                (thread_id, checkpoint_ns, channel, str(version)),
+            ).fetchone()
+            if row is None or row[0] == "empty":
+                continue
+            values[channel] = self._load_value(conn, thread_id, *row)
+        return values
+
+    def _maybe_sweep(self):
+        if self.ttl_seconds is None:
+            return
+        if time.time() - self._last_sweep < self.sweep_interval_seconds:
+            return
+        self._last_sweep = time.time()
+        self.expire()
+
+    def expire(self, ttl_seconds: Optional[float] = None) -> int:
+        """Delete every thread idle for longer than `ttl_seconds`.
+
+        Returns the number of deleted threads.
+        """
+        ttl_seconds = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        if ttl_seconds is None:
+            return 0
+        cutoff = time.time() - ttl_seconds
+        with self._transaction() as conn:
+            thread_ids = [
+                thread_id
+                for (thread_id,) in conn.execute(
+                    "SELECT thread_id FROM threads WHERE updated_at < ?", (cutoff,)
+                ).fetchall()
+            ]
+            self._delete_threads(conn, thread_ids)
+        if thread_ids:
+            logger.info(f"Expired {len(thread_ids)} idle checkpoint threads")
+        return len(thread_ids)
+
+    def compact(self, keep_last: int = 1) -> dict:
+        """Expire idle threads, keep only the newest `keep_last` checkpoints of
+        every thread/namespace, and vacuum the database file.
+        """
+        expired = self.expire()
+        with self._transaction() as conn:
+            deleted = conn.execute(
+                "DELETE FROM checkpoints WHERE rowid IN ("
+                " SELECT rowid FROM ("
+                "  SELECT rowid, ROW_NUMBER() OVER ("
+                "   PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC"
+                "  ) AS rank FROM checkpoints"
+                " ) WHERE rank > ?"
+                ")",
+                (keep_last,),
+            ).rowcount
+            conn.execute(
+                "DELETE FROM writes WHERE NOT EXISTS ("
+                " SELECT 1 FROM checkpoints c WHERE c.thread_id = writes.thread_id"
+                " AND c.checkpoint_ns = writes.checkpoint_ns"
+                " AND c.checkpoint_id = writes.checkpoint_id"
+                ")"
+            )
+            thread_ids = [
+                thread_id
+                for (thread_id,) in conn.execute("SELECT thread_id FROM threads")
+            ]
+            for thread_id in thread_ids:
+                self._collect_garbage(conn, thread_id)
+        with self._lock:
+            self.conn.execute("VACUUM")
+        stats = {"expired_threads": expired, "deleted_checkpoints": deleted}
+        logger.info(f"Compacted checkpoints: {stats}")
+        return stats
+
+    def _collect_garbage(self, conn, thread_id: str):
+        """Drop channel values and blobs no remaining checkpoint refers to."""
+        live_values = set()
+        for checkpoint_ns, type_, checkpoint in conn.execute(
+            "SELECT checkpoint_ns, type, checkpoint FROM checkpoints WHERE thread_id = ?",
+            (thread_id,),
+        ).fetchall():
+            channel_versions = self.serde.loads_typed((type_, checkpoint))[
+                "channel_versions"
+            ]
+            for channel, version in channel_versions.items():
+                live_values.add((checkpoint_ns, channel, str(version)))
+
+        live_refs = []
+        for checkpoint_ns, channel, version, kind, ref in conn.execute(
+            "SELECT checkpoint_ns, channel, version, kind, ref FROM channel_values "
+            "WHERE thread_id = ?",
+            (thread_id,),
+        ).fetchall():
+            if (checkpoint_ns, channel, version) not in live_values:
+                conn.execute(
+                    "DELETE FROM channel_values WHERE thread_id = ? "
+                    "AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                    (thread_id, checkpoint_ns, channel, version),
+                )
+            elif kind != "empty":
+                live_refs.append((kind, ref))
+        for type_, value in conn.execute(
+            "SELECT type, value FROM writes WHERE thread_id = ? AND type LIKE 'ref:%'",
+            (thread_id,),
+        ).fetchall():
+            live_refs.append((type_[4:], value.decode()))
+        # the thread's last message list is the base of the next put
+        (messages_ref,) = conn.execute(
+            "SELECT messages_ref FROM threads WHERE thread_id = ?", (thread_id,)
+        ).fetchone()
+        if messages_ref is not None:
+            live_refs.append(("messages", messages_ref))
+
+        live_blobs = set()
+        while live_refs:
+            kind, ref = live_refs.pop()
+            if ref in live_blobs:
+                continue
+            live_blobs.add(ref)
+            if kind == "blob":
+                continue
+            blob = self._get_blobs(conn, thread_id, [ref]).get(ref)
+            if blob is None:
+                continue
+            record = json.loads(blob[1])
+            if kind == "state":
+                live_refs.append(("blob", record["rest"]))
+                live_refs.extend(("blob", field_ref) for field_ref in record["fields"].values())
+                live_refs.extend(
+                    ("messages", message_ref)
+                    for message_ref in record["messages"].values()
+                )
+            else:
+                live_blobs.update(record["append"])
+                if record["base"] is not None:
+                    live_refs.append(("messages", record["base"]))
+
+        for (digest,) in conn.execute(
+            "SELECT digest FROM blobs WHERE thread_id = ?", (thread_id,)
+        ).fetchall():
+            if digest not in live_blobs:
+                conn.execute(
+                    "DELETE FROM blobs WHERE thread_id = ? AND digest = ?",
+                    (thread_id, digest),
+                )
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        checkpoint_tuples = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for checkpoint_tuple in checkpoint_tuples:
+            yield checkpoint_tuple
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(
+            self.put, config, checkpoint, metadata, new_versions
+        )
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
@@ -92,6 +92,8 @@ class CruiseSearchInfo(BaseModel):
     round_trip: Optional[bool] = None
     price_discount: Optional[bool] = None
     ignore_destinations: Optional[List[str]] = None
+    # free-text themes ranked against the cruise descriptions, see cruise_vibes.py
+    vibe: Optional[str] = None
     # message: Optional[str] = None
 
 
@@ -100,6 +102,9 @@ class AgentState(BaseModel):
 
     messages: Annotated[list[AnyMessage], add_messages]
     chat_history: str | None = None
+    # rolling summary of messages[:summarized_until], see agent.tools.utils.history
+    summary: str | None = None
+    summarized_until: int = 0
     currency: str = "USD"
     action: str = ""
     cruise_search_info: CruiseSearchInfo | None = None
@@ -110,3 +115,5 @@ class AgentState(BaseModel):
 
     agent_routing: str | None = None
     func_routing: str | None = None
+    # step chosen by the fast router this turn, lets the cruise supervisor skip its LLM
+    fast_route: str | None = None
@@ -30,6 +30,7 @@ def extract_infor_promt(cruise_search_infor):
             "round_trip": boolean //true if the user want to cruise round trip, false otherwise
             "price_discount": boolean //true if the user want discount on the price of cruise, false otherwise
             "ignore_destinations": string[] //list of destinations to ignore
+            "vibe": string|null //the mood or themes the user wants that are not places, dates, durations or prices (e.g., "relaxing, food and wine"), null otherwise
             "message": string //natural response message
 
         Guidelines:
@@ -46,6 +47,7 @@ def extract_infor_promt(cruise_search_infor):
         - If user ask about round trip, or want the starting and ending port are the same, give the round_trip: true
         - If user ask about the discounted prices of cruises, give the price_discount: true
         - If user ask about the ignore destination, give the ignore_destinations
+        - If user describe the kind of trip they want (e.g., relaxing, food-focused, adventurous, romantic), give these words as the vibe, keep the places in the other fields
         - Notice with information related to compare: If less, before: return the previous date or previous number. If on and before: return the same date or number. If after: return the next date or next number. If between: return the range of date or number. If not between: return the date or number that is not in the range.
         - Use null for unspecified values, don't omit fields
         - Always return valid JSON - no trailing commas, proper quotes
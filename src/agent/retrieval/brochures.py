@@ -0,0 +1,164 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import re
+import json
+import asyncio
+import logging
+import threading
+
+import faiss
+
+from agent.tools.utils.embeddings import embed
+
+logger = logging.getLogger(__name__)
+
+# brochure text files, a directory or a single file
+BROCHURES_PATH = os.getenv(
+    "BROCHURES_PATH",
+    os.path.abspath(
+        os.path.join(os.path.dirname(__file__), "../../../static_data/brochures")
+    ),
+)
+BROCHURE_INDEX_DIR = os.getenv("BROCHURE_INDEX_DIR", "brochure_index")
+BROCHURE_RETRIEVAL = os.getenv("BROCHURE_RETRIEVAL", "true").lower() == "true"
+BROCHURE_TOP_K = int(os.getenv("BROCHURE_TOP_K", "4"))
+BROCHURE_MIN_SIMILARITY = float(os.getenv("BROCHURE_MIN_SIMILARITY", "0.3"))
+BROCHURE_CHUNK_WORDS = int(os.getenv("BROCHURE_CHUNK_WORDS", "200"))
+BROCHURE_CHUNK_OVERLAP = int(os.getenv("BROCHURE_CHUNK_OVERLAP", "40"))
+BROCHURE_EXTENSIONS = (".txt", ".md", ".markdown")
+
+INDEX_FILE = "brochures.faiss"
+CHUNKS_FILE = "chunks.jsonl"
+
+
+def brochure_files(path: str) -> list[str]:
+    if os.path.isfile(path):
+        return [path]
+    return sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(path)
+        for name in names
+        if name.lower().endswith(BROCHURE_EXTENSIONS)
+    )
+
+
+def chunk_text(
+    text: str, words: int = BROCHURE_CHUNK_WORDS, overlap: int = BROCHURE_CHUNK_OVERLAP
+) -> list[str]:
+    """Chunks of at most `words` words made of whole paragraphs; paragraphs
+    longer than that are cut into windows overlapping by `overlap` words."""
+    chunks, current, carried = [], [], 0
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph_words = paragraph.split()
+        if len(current) > carried and len(current) + len(paragraph_words) > words:
+            chunks.append(" ".join(current))
+            current, carried = [], 0
+        current += paragraph_words
+        while len(current) > words:
+            chunks.append(" ".join(current[:words]))
+            current = current[words - overlap :]
+            carried = overlap
+    # words already in the previous chunk
+    if len(current) > carried:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def ingest_brochures(
+    source: str = BROCHURES_PATH, index_dir: str = BROCHURE_INDEX_DIR, batch_size: int = 64
+) -> int:
+    """Chunk and embed every brochure under `source` into a FAISS index in
+    `index_dir`, replacing the previous one. Returns the number of chunks."""
+    chunks = []
+    for path in brochure_files(source):
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            text = f.read()
+        name = os.path.basename(path) if path == source else os.path.relpath(path, source)
+        for number, chunk in enumerate(chunk_text(text)):
+            chunks.append({"source": name, "chunk": number, "text": chunk})
+
+    dimension = embed(["dimension"]).shape[1]
+    index = faiss.IndexFlatIP(dimension)
+    for start in range(0, len(chunks), batch_size):
+        index.add(embed([chunk["text"] for chunk in chunks[start : start + batch_size]]))
+
+    os.makedirs(index_dir, exist_ok=True)
+    # written aside then renamed, a running server keeps its mapped copy
+    faiss.write_index(index, os.path.join(index_dir, INDEX_FILE + ".tmp"))
+    with open(os.path.join(index_dir, CHUNKS_FILE + ".tmp"), "w") as f:
+        for chunk in chunks:
+            f.write(json.dumps(chunk) + "\n")
+    os.replace(os.path.join(index_dir, CHUNKS_FILE + ".tmp"), os.path.join(index_dir, CHUNKS_FILE))
+    os.replace(os.path.join(index_dir, INDEX_FILE + ".tmp"), os.path.join(index_dir, INDEX_FILE))
+    logger.info(f"Indexed {len(chunks)} chunks of {len(brochure_files(source))} brochures")
+    return len(chunks)
+
+
+class BrochureIndex:
+    """Top-k retrieval over the brochure chunks written by ingest_brochures.
+    The FAISS index is memory-mapped, queries are embedded locally."""
+
+    def __init__(self, index_dir: str = BROCHURE_INDEX_DIR):
+        self.index_dir = index_dir
+        self.index = None
+        self.chunks: list[dict] = []
+        self.lock = threading.Lock()
+
+    def load(self) -> bool:
+        with self.lock:
+            if self.index is not None:
+                return True
+            path = os.path.join(self.index_dir, INDEX_FILE)
+            if not os.path.exists(path):
+                return False
+            index = faiss.read_index(path, faiss.IO_FLAG_MMAP)
+            with open(os.path.join(self.index_dir, CHUNKS_FILE)) as f:
+                self.chunks = [json.loads(line) for line in f]
+            self.index = index
+            logger.info(f"Loaded brochure index with {index.ntotal} chunks")
+            return True
+
+    def search(
+        self, text: str, k: int = BROCHURE_TOP_K, min_similarity: float = BROCHURE_MIN_SIMILARITY
+    ) -> list[dict]:
+        if not text or not self.load() or not self.index.ntotal:
+            return []
+        similarities, ids = self.index.search(embed([text]), k)
+        return [
+            {**self.chunks[i], "score": float(similarity)}
+            for similarity, i in zip(similarities[0], ids[0])
+            if i >= 0 and similarity >= min_similarity
+        ]
+
+    async def asearch(self, text: str, k: int = BROCHURE_TOP_K) -> list[dict]:
+        if not BROCHURE_RETRIEVAL:
+            return []
+        return await asyncio.to_thread(self.search, text, k)
+
+
+brochure_index = BrochureIndex()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build or query the brochure index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ingest = subparsers.add_parser("ingest")
+    ingest.add_argument("--source", default=BROCHURES_PATH)
+    query = subparsers.add_parser("search")
+    query.add_argument("text")
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        print({"chunks": ingest_brochures(args.source)})
+    else:
+        for result in brochure_index.search(args.text):
+            print(f"{result['score']:.3f} {result['source']}#{result['chunk']}: {result['text'][:160]}")
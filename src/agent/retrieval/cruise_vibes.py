@@ -0,0 +1,220 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+
+import faiss
+import numpy as np
+
+from agent.tools.utils.embeddings import embed
+
+logger = logging.getLogger(__name__)
+
+VIBE_INDEX_DIR = os.getenv("VIBE_INDEX_DIR", "vibe_index")
+# nearest cruises fetched from the index before the structured filters apply
+VIBE_CANDIDATES = int(os.getenv("VIBE_CANDIDATES", "200"))
+# up to this many cruises matching the filters, all of them are ranked instead
+VIBE_RERANK_LIMIT = int(os.getenv("VIBE_RERANK_LIMIT", "2000"))
+
+VIBE_PROJECTION = {
+    "title": 1,
+    "destination": 1,
+    "itinerary.portName": 1,
+    "itinerary.description": 1,
+}
+INDEX_FILE = "vibes.faiss"
+META_FILE = "vibes.json"
+
+
+def cruise_passages(cruise: dict) -> list[str]:
+    """Title and destination, then one passage per described port of call."""
+    header = ". ".join(part for part in (cruise.get("title"), cruise.get("destination")) if part)
+    return [header] + [
+        f"{stop.get('portName', '')}: {stop['description']}"
+        for stop in cruise.get("itinerary", [])
+        if stop.get("description")
+    ]
+
+
+def passages_hash(passages: list[str]) -> str:
+    return hashlib.sha1(json.dumps(passages).encode()).hexdigest()
+
+
+def cruise_vectors(cruises_passages: list[list[str]]) -> np.ndarray:
+    """One unit vector per cruise, the mean of its passage embeddings, so a
+    long itinerary is not cut at the model's sequence length."""
+    flat = [passage for passages in cruises_passages for passage in passages]
+    vectors = embed(flat)
+    means, start = [], 0
+    for passages in cruises_passages:
+        mean = vectors[start : start + len(passages)].mean(axis=0)
+        means.append(mean / np.linalg.norm(mean))
+        start += len(passages)
+    return np.array(means, dtype=np.float32)
+
+
+class VibeIndex:
+    """FAISS index of one embedding per cruise, keyed by an int64 id mapped to
+    the cruise _id. Written offline as versioned directories with a CURRENT
+    pointer; readers memory-map the current version and follow updates."""
+
+    def __init__(self, index_dir: str = VIBE_INDEX_DIR):
+        self.index_dir = index_dir
+        self.index = None
+        self.meta = {"next_id": 0, "ids": {}, "hashes": {}}
+        self.cruise_ids: dict[int, str] = {}
+        self.version = None
+        self.lock = threading.Lock()
+
+    def _current_version(self) -> str | None:
+        current = os.path.join(self.index_dir, "CURRENT")
+        if not os.path.exists(current):
+            return None
+        with open(current) as f:
+            return f.read().strip()
+
+    def load(self) -> bool:
+        """(Re)load the current version if it changed since the last call."""
+        version = self._current_version()
+        if version is None:
+            return False
+        with self.lock:
+            if version != self.version:
+                path = os.path.join(self.index_dir, version)
+                index = faiss.read_index(os.path.join(path, INDEX_FILE), faiss.IO_FLAG_MMAP)
+                with open(os.path.join(path, META_FILE)) as f:
+                    meta = json.load(f)
+                self.index, self.meta, self.version = index, meta, version
+                self.cruise_ids = {int_id: cruise_id for cruise_id, int_id in meta["ids"].items()}
+                logger.info(f"Loaded vibe index {version} with {index.ntotal} cruises")
+        return True
+
+    def rank(
+        self, text: str, cruise_ids: list[str] | None = None, k: int = VIBE_CANDIDATES
+    ) -> list[tuple[str, float]]:
+        """(cruise_id, similarity) best first: of the given cruises, which are
+        all scored, or of the k nearest cruises in the index."""
+        if not self.load() or not self.index.ntotal:
+            return []
+        query = embed([text])
+        with self.lock:
+            if cruise_ids is None:
+                similarities, ids = self.index.search(query, k)
+                return [
+                    (self.cruise_ids[int(i)], float(similarity))
+                    for similarity, i in zip(similarities[0], ids[0])
+                    if i >= 0
+                ]
+            known = [cruise_id for cruise_id in cruise_ids if cruise_id in self.meta["ids"]]
+            if not known:
+                return []
+            vectors = self.index.reconstruct_batch(
+                np.array([self.meta["ids"][cruise_id] for cruise_id in known], dtype=np.int64)
+            )
+        similarities = vectors @ query[0]
+        order = np.argsort(-similarities, kind="stable")
+        return [(known[i], float(similarities[i])) for i in order]
+
+    def update(self, collection, full: bool = False, batch_size: int = 64) -> dict:
+        """Embed the cruises that are new or whose passages changed since the
+        current version, drop the deleted ones and write a new version."""
+        index, meta = None, {"next_id": 0, "ids": {}, "hashes": {}}
+        version = self._current_version()
+        if not full and version is not None:
+            # a writable copy of the current version
+            path = os.path.join(self.index_dir, version)
+            index = faiss.read_index(os.path.join(path, INDEX_FILE))
+            with open(os.path.join(path, META_FILE)) as f:
+                meta = json.load(f)
+        counts = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+        seen, pending = set(), []
+
+        def flush():
+            nonlocal index
+            vectors = cruise_vectors([passages for _, passages, _ in pending])
+            if index is None:
+                index = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+            int_ids = []
+            for cruise_id, _, digest in pending:
+                if cruise_id in meta["ids"]:
+                    index.remove_ids(np.array([meta["ids"][cruise_id]], dtype=np.int64))
+                meta["ids"][cruise_id] = meta["next_id"]
+                meta["hashes"][cruise_id] = digest
+                int_ids.append(meta["next_id"])
+                meta["next_id"] += 1
+            index.add_with_ids(vectors, np.array(int_ids, dtype=np.int64))
+            pending.clear()
+
+        for cruise in collection.find({}, VIBE_PROJECTION):
+            cruise_id = str(cruise["_id"])
+            seen.add(cruise_id)
+            passages = cruise_passages(cruise)
+            digest = passages_hash(passages)
+            if meta["hashes"].get(cruise_id) == digest:
+                counts["unchanged"] += 1
+                continue
+            counts["updated" if cruise_id in meta["ids"] else "added"] += 1
+            pending.append((cruise_id, passages, digest))
+            if len(pending) >= batch_size:
+                flush()
+        if pending:
+            flush()
+        for cruise_id in [cruise_id for cruise_id in meta["ids"] if cruise_id not in seen]:
+            index.remove_ids(np.array([meta["ids"].pop(cruise_id)], dtype=np.int64))
+            meta["hashes"].pop(cruise_id, None)
+            counts["removed"] += 1
+
+        if index is not None and (full or any(counts[key] for key in ("added", "updated", "removed"))):
+            self._save(index, meta)
+        logger.info(f"Vibe index update: {counts}")
+        return counts
+
+    def _save(self, index, meta):
+        os.makedirs(self.index_dir, exist_ok=True)
+        version = f"{int(time.time() * 1000)}"
+        tmp_path = os.path.join(self.index_dir, f"tmp-{version}")
+        os.makedirs(tmp_path, exist_ok=True)
+        faiss.write_index(index, os.path.join(tmp_path, INDEX_FILE))
+        with open(os.path.join(tmp_path, META_FILE), "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(self.index_dir, version))
+        with open(os.path.join(self.index_dir, "CURRENT.tmp"), "w") as f:
+            f.write(version)
+        os.replace(os.path.join(self.index_dir, "CURRENT.tmp"), os.path.join(self.index_dir, "CURRENT"))
+        # keep the previous version for processes that still map it
+        versions = sorted(name for name in os.listdir(self.index_dir) if name.isdigit())
+        for old in versions[:-2]:
+            shutil.rmtree(os.path.join(self.index_dir, old), ignore_errors=True)
+
+
+vibe_index = VibeIndex()
+
+
+if __name__ == "__main__":
+    import argparse
+    from agent.tools.db.db import DBTool
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build or query the cruise vibe index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="embed new and changed cruises")
+    build.add_argument("--full", action="store_true", help="re-embed every cruise")
+    query = subparsers.add_parser("search")
+    query.add_argument("text")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        print(vibe_index.update(DBTool().collection, full=args.full))
+    else:
+        for cruise_id, similarity in vibe_index.rank(args.text, k=10):
+            print(f"{similarity:.3f} {cruise_id}")
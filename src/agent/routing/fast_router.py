@@ -0,0 +1,319 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import re
+import json
+import time
+import base64
+import hashlib
+import asyncio
+import logging
+import threading
+from collections import Counter, OrderedDict
+from typing import Literal, get_args
+
+import numpy as np
+from pydantic import BaseModel
+from langchain_core.messages import AnyMessage, HumanMessage
+
+from agent.tools.utils.embeddings import EMBEDDING_MODEL, embed
+from agent.tools.utils.semantic_cache import stateless_text
+
+logger = logging.getLogger(__name__)
+
+FAST_ROUTER_ENABLED = os.getenv("FAST_ROUTER_ENABLED", "true").lower() == "true"
+# every decision taken by the LLM routers is appended here and used as training
+# data: the embedding of the user message, not its text
+ROUTING_LOG_PATH = os.getenv("ROUTING_LOG_PATH", "routing_decisions.jsonl")
+# the latest decisions kept per step; the file is rewritten with only these
+# at startup and once it holds twice as many lines
+ROUTING_LOG_MAX_PER_STEP = int(os.getenv("ROUTING_LOG_MAX_PER_STEP", "2000"))
+# "true" also logs the user message, e.g. to review the decisions
+ROUTING_LOG_TEXT = os.getenv("ROUTING_LOG_TEXT", "false").lower() == "true"
+FAST_ROUTER_MIN_CONFIDENCE = float(os.getenv("FAST_ROUTER_MIN_CONFIDENCE", "0.8"))
+FAST_ROUTER_MIN_SIMILARITY = float(os.getenv("FAST_ROUTER_MIN_SIMILARITY", "0.75"))
+FAST_ROUTER_MIN_EXAMPLES = int(os.getenv("FAST_ROUTER_MIN_EXAMPLES", "50"))
+FAST_ROUTER_MAX_EXAMPLES = int(os.getenv("FAST_ROUTER_MAX_EXAMPLES", "5000"))
+FAST_ROUTER_K = int(os.getenv("FAST_ROUTER_K", "5"))
+
+Step = Literal["cruise_search", "cruise_assistant", "general_node"]
+STEPS = get_args(Step)
+
+# a rule decides only when the patterns of exactly one step match
+RULES: dict[str, list[re.Pattern]] = {
+    "cruise_assistant": [
+        re.compile(p)
+        for p in [
+            r"\bcabins?\b",
+            r"\bsuites?\b",
+            r"\bcart\b",
+            r"\bpay(ment)?\b",
+            r"\bcheck ?out\b",
+            r"\bcancel\b",
+            r"\breserve\b",
+            r"\border\b",
+            r"\b(this|that|current|the same) (cruise|trip|ship|one)\b",
+        ]
+    ],
+    "cruise_search": [
+        re.compile(p)
+        for p in [
+            r"\bcruises? (to|in|from|around|departing|leaving|visiting|through)\b",
+            r"\b(find|search|looking for|show me|any|list|recommend)\b.*\bcruises?\b",
+            r"\bcruises? (under|below|less than|cheaper than|between|longer than|shorter than)\b",
+        ]
+    ],
+    "general_node": [
+        re.compile(
+            r"^(hi|hello|hey|thanks|thank you|good (morning|afternoon|evening)|bye|goodbye)[\s!.,]*$"
+        )
+    ],
+}
+
+
+class FastRoute(BaseModel):
+    step: Step
+    source: Literal["rules", "knn"]
+    confidence: float
+
+
+def vote(similarities: np.ndarray, steps: list[str]) -> tuple[str, float] | None:
+    """Similarity-weighted vote of the k nearest examples -> (step, confidence)."""
+    top = np.argsort(-similarities)[:FAST_ROUTER_K]
+    votes = Counter()
+    for i in top:
+        if similarities[i] >= FAST_ROUTER_MIN_SIMILARITY:
+            votes[steps[i]] += float(similarities[i])
+    if not votes:
+        return None
+    step, weight = votes.most_common(1)[0]
+    return step, min(1.0, weight / float(np.clip(similarities[top], 0, None).sum()))
+
+
+def last_user_text(messages: list[AnyMessage]) -> str:
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            return message.content if isinstance(message.content, str) else str(message.content)
+    return ""
+
+
+def text_key(text: str) -> str:
+    """Identifies a message in the log without storing it."""
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def encode_vector(vector: np.ndarray) -> str:
+    return base64.b64encode(vector.astype(np.float16).tobytes()).decode()
+
+
+def decode_vector(data: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype=np.float16).astype(np.float32)
+
+
+def keep_latest(records: list[dict]) -> list[dict]:
+    """The last ROUTING_LOG_MAX_PER_STEP records of each step, in log order."""
+    kept, counts = [], Counter()
+    for record in reversed(records):
+        if counts[record["step"]] < ROUTING_LOG_MAX_PER_STEP:
+            counts[record["step"]] += 1
+            kept.append(record)
+    return kept[::-1]
+
+
+class FastRouter:
+    """Routes a user message to cruise_search, cruise_assistant or general_node
+    without an LLM call: keyword rules first, then a k-nearest-neighbour vote
+    over embeddings of previous LLM routing decisions. Returns None when not
+    confident enough so the caller falls back to its LLM router."""
+
+    def __init__(self, log_path: str = ROUTING_LOG_PATH):
+        self.log_path = log_path
+        self.steps: list[str] = []
+        self.vectors: np.ndarray | None = None
+        self.logged_lines = 0
+        # embeddings of the last routed messages, reused when the LLM decision is logged
+        self.query_vectors: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.loaded = False
+        self.lock = threading.Lock()
+        # route() runs in worker threads, apart from the lock held while embedding
+        self.counts_lock = threading.Lock()
+        self.counts = Counter()
+
+    def _read_log(self) -> tuple[list[dict], int]:
+        """The latest record per message, oldest first, and the lines read."""
+        if not os.path.exists(self.log_path):
+            return [], 0
+        records, lines = {}, 0
+        with open(self.log_path) as f:
+            for line in f:
+                lines += 1
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                # vectors of another embedding model do not compare
+                if "vector" in record and record.get("model") != EMBEDDING_MODEL:
+                    continue
+                # records written before vectors were logged only have the text
+                key = record.get("key") or text_key(record["text"])
+                records.pop(key, None)
+                records[key] = {**record, "key": key}
+        return list(records.values()), lines
+
+    def _write_log(self, records: list[dict]):
+        path = f"{self.log_path}.tmp"
+        with open(path, "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        os.replace(path, self.log_path)
+        self.logged_lines = len(records)
+
+    def _load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        records, lines = self._read_log()
+        records = keep_latest(records)
+        unembedded = [record for record in records if "vector" not in record]
+        if unembedded:
+            vectors = embed([record["text"] for record in unembedded])
+            for record, vector in zip(unembedded, vectors):
+                record.update(vector=encode_vector(vector), model=EMBEDDING_MODEL)
+        with_text = any("text" in record for record in records)
+        if not ROUTING_LOG_TEXT:
+            for record in records:
+                record.pop("text", None)
+        self.logged_lines = lines
+        if lines > len(records) or unembedded or (with_text and not ROUTING_LOG_TEXT):
+            self._write_log(records)
+        records = records[-FAST_ROUTER_MAX_EXAMPLES:]
+        if records:
+            self.steps = [record["step"] for record in records]
+            self.vectors = np.vstack([decode_vector(record["vector"]) for record in records])
+        logger.info(f"Loaded {len(records)} routing examples from {self.log_path}")
+
+    def _add_example(self, step: str, vector: np.ndarray):
+        self.steps.append(step)
+        self.vectors = (
+            vector[None, :] if self.vectors is None else np.vstack([self.vectors, vector])
+        )
+        if len(self.steps) > FAST_ROUTER_MAX_EXAMPLES:
+            self.steps = self.steps[-FAST_ROUTER_MAX_EXAMPLES:]
+            self.vectors = self.vectors[-FAST_ROUTER_MAX_EXAMPLES:]
+
+    def match_rules(self, text: str) -> str | None:
+        text = text.lower().strip()
+        matched = {
+            step for step, patterns in RULES.items() if any(p.search(text) for p in patterns)
+        }
+        return matched.pop() if len(matched) == 1 else None
+
+    def nearest(self, text: str) -> tuple[str, float] | None:
+        with self.lock:
+            self._load()
+            if self.vectors is None or len(self.steps) < FAST_ROUTER_MIN_EXAMPLES:
+                return None
+            vector = embed([text])[0]
+            self.query_vectors[text] = vector
+            while len(self.query_vectors) > 256:
+                self.query_vectors.popitem(last=False)
+            return vote(self.vectors @ vector, self.steps)
+
+    def route(self, text: str) -> FastRoute | None:
+        decision = None
+        step = self.match_rules(text)
+        if step is not None:
+            decision = FastRoute(step=step, source="rules", confidence=1.0)
+        else:
+            neighbour = self.nearest(text)
+            if neighbour is not None and neighbour[1] >= FAST_ROUTER_MIN_CONFIDENCE:
+                decision = FastRoute(step=neighbour[0], source="knn", confidence=neighbour[1])
+        with self.counts_lock:
+            self.counts[decision.source if decision else "llm"] += 1
+        stats = self.stats()
+        logger.info(
+            f"Fast router: {decision or 'fallback to LLM'}, hit rate {stats['hit_rate']:.0%} of {stats['total']}"
+        )
+        return decision
+
+    async def aroute(self, messages: list[AnyMessage]) -> FastRoute | None:
+        """Only routes a message that is the whole window, e.g. the first turn: a
+        follow-up like "yes" or "what about June?" is left to the LLM routers."""
+        if not FAST_ROUTER_ENABLED:
+            return None
+        text = stateless_text(messages)
+        if not text:
+            return None
+        return await asyncio.to_thread(self.route, text)
+
+    def record(self, text: str, step: str):
+        """Log a decision taken by an LLM router as a training example."""
+        with self.lock:
+            self._load()
+            vector = self.query_vectors.pop(text, None)
+            if vector is None:
+                vector = embed([text])[0]
+            self._add_example(step, vector)
+            record = {
+                "key": text_key(text),
+                "step": step,
+                "ts": time.time(),
+                "model": EMBEDDING_MODEL,
+                "vector": encode_vector(vector),
+            }
+            if ROUTING_LOG_TEXT:
+                record["text"] = text
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+            self.logged_lines += 1
+            if self.logged_lines > 2 * ROUTING_LOG_MAX_PER_STEP * len(STEPS):
+                self._write_log(keep_latest(self._read_log()[0]))
+
+    async def arecord(self, messages: list[AnyMessage], step: str):
+        # a decision that depended on earlier turns is no example for the message alone
+        if not FAST_ROUTER_ENABLED:
+            return
+        text = stateless_text(messages)
+        if not text:
+            return
+        try:
+            await asyncio.to_thread(self.record, text, step)
+        except Exception as e:
+            logger.error(f"Failed to log the routing decision: {e}")
+
+    def stats(self) -> dict:
+        with self.counts_lock:
+            counts = dict(self.counts)
+        total = sum(counts.values())
+        hits = counts.get("rules", 0) + counts.get("knn", 0)
+        return {**counts, "total": total, "hit_rate": hits / total if total else 0.0}
+
+
+fast_router = FastRouter()
+
+
+if __name__ == "__main__":
+    # leave-one-out evaluation of the kNN vote on the logged decisions, to tune the thresholds
+    logging.basicConfig(level=logging.INFO)
+    router = FastRouter()
+    router._load()
+    if router.vectors is None:
+        sys.exit(f"No routing decisions in {router.log_path}")
+    similarities = router.vectors @ router.vectors.T
+    np.fill_diagonal(similarities, -1.0)
+    answered = correct = 0
+    for i, step in enumerate(router.steps):
+        neighbour = vote(similarities[i], router.steps)
+        if neighbour is None or neighbour[1] < FAST_ROUTER_MIN_CONFIDENCE:
+            continue
+        answered += 1
+        correct += neighbour[0] == step
+    total = len(router.steps)
+    print(f"examples: {total}")
+    print(f"answered without LLM: {answered / total:.1%}")
+    print(f"accuracy when answered: {correct / answered if answered else 0.0:.1%}")
@@ -0,0 +1,156 @@
+import os
+import logging
+import threading
+from functools import cache
+from urllib.parse import parse_qs, urlsplit
+
+from dotenv import load_dotenv
+from pymongo import AsyncMongoClient, MongoClient, monitoring
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MONGODB_URI = os.getenv("MONGODB_URI")
+DATABASE_NAME = "silversea_cruises"
+# connections per server and per client (one sync and one async client per process)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+# how long a request waits for a free connection before failing
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(
+    os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")
+)
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+# 0 waits forever, as the driver does by default
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+# comma separated, in order of preference; the server picks one it supports
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zlib")
+# where the read-only catalogue queries (cruises, cruise_summaries) go; carts,
+# orders and chat histories always use the primary
+MONGO_CATALOGUE_READ_PREFERENCE = os.getenv(
+    "MONGO_CATALOGUE_READ_PREFERENCE", "secondaryPreferred"
+)
+# secondaries lagging more than this are not read from, -1 means no bound;
+# the server requires at least 90
+MONGO_MAX_STALENESS_SECONDS = int(os.getenv("MONGO_MAX_STALENESS_SECONDS", "120"))
+
+
+class PoolWaitListener(monitoring.ConnectionPoolListener):
+    """Time spent waiting to check a connection out of the pool, the sign
+    that the pool is too small for the concurrent requests."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.failures = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        # callables receiving each wait in seconds, e.g. a histogram
+        self.observers = []
+
+    def connection_checked_out(self, event):
+        self._record(event.duration)
+
+    def connection_check_out_failed(self, event):
+        with self.lock:
+            self.failures += 1
+        logger.warning(f"MongoDB connection check out failed: {event.reason}")
+        self._record(event.duration, checkout=False)
+
+    def _record(self, wait, checkout=True):
+        with self.lock:
+            self.checkouts += checkout
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        for observer in self.observers:
+            observer(wait)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "checkouts": self.checkouts,
+                "failures": self.failures,
+                "wait_seconds": self.wait_seconds,
+                "mean_wait_seconds": (
+                    self.wait_seconds / self.checkouts if self.checkouts else 0.0
+                ),
+                "max_wait_seconds": self.max_wait_seconds,
+            }
+
+    # the other pool events are not needed
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+
+pool_wait = PoolWaitListener()
+
+
+def client_options() -> dict:
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS or None,
+        "event_listeners": [pool_wait],
+        "appname": "cruise-agent",
+    }
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    # options set in the URI win over these defaults
+    in_uri = {key.lower() for key in parse_qs(urlsplit(MONGODB_URI or "").query)}
+    return {key: value for key, value in options.items() if key.lower() not in in_uri}
+
+
+@cache
+def mongo_client() -> MongoClient:
+    """The process-wide sync client, for scripts and __main__ blocks."""
+    return MongoClient(MONGODB_URI, **client_options())
+
+
+@cache
+def async_mongo_client() -> AsyncMongoClient:
+    """The process-wide async client, for the graph nodes."""
+    return AsyncMongoClient(MONGODB_URI, **client_options())
+
+
+def catalogue_read_preference():
+    mode = read_pref_mode_from_name(MONGO_CATALOGUE_READ_PREFERENCE)
+    # mode 0, primary, takes no staleness bound
+    max_staleness = MONGO_MAX_STALENESS_SECONDS if mode else -1
+    return make_read_preference(mode, None, max_staleness=max_staleness)
+
+
+def catalogue_database(client):
+    """The database with reads routed by MONGO_CATALOGUE_READ_PREFERENCE.
+    Only for read-only catalogue queries; writes go to the primary anyway."""
+    return client.get_database(DATABASE_NAME, read_preference=catalogue_read_preference())
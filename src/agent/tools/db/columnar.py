@@ -0,0 +1,397 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../..")))
+import json
+import time
+import fcntl
+import base64
+import bisect
+import shutil
+import logging
+import threading
+from datetime import date, datetime
+
+import numpy as np
+
+from agent.tools.db.cruise_summaries import summarize_cruise
+from agent.tools.db.place_tokens import (
+    ITINERARY_TOKENS_FIELD,
+    PLACE_TOKENS_FIELD,
+    cruise_token_fields,
+    normalize_place,
+)
+
+logger = logging.getLogger(__name__)
+
+COLUMNAR_SNAPSHOT_DIR = os.getenv("COLUMNAR_SNAPSHOT_DIR", "columnar_snapshot")
+COLUMNAR_REFRESH_SECONDS = float(os.getenv("COLUMNAR_REFRESH_SECONDS", "600"))
+# how often a worker checks CURRENT for a snapshot written by the worker that rebuilds
+COLUMNAR_RELOAD_CHECK_SECONDS = float(os.getenv("COLUMNAR_RELOAD_CHECK_SECONDS", "30"))
+COLUMNAR_MMAP = os.getenv("COLUMNAR_MMAP", "true").lower() == "true"
+
+# fields needed to build the columns: the card fields plus every market's prices
+BUILD_PROJECTION = {
+    "title": 1,
+    "destination": 1,
+    "itinerary.portName": 1,
+    "duration": 1,
+    "imagesUrl": 1,
+    "sailStartDate": 1,
+    "sailEndDate": 1,
+    "shipName": 1,
+    "embarkationPortName": 1,
+    "disembarkationPortName": 1,
+    "mapUrl": 1,
+    "prices": 1,
+}
+ARRAYS = [
+    "start_day",
+    "end_day",
+    "duration",
+    "embark",
+    "disembark",
+    "round_trip",
+    "place_bits",
+    "itinerary_bits",
+    "price",
+    "discounted",
+    "card_index",
+]
+
+
+def day_ordinal(value) -> int:
+    if value is None or value == "":
+        return -1
+    if isinstance(value, (date, datetime)):
+        return value.toordinal()
+    return date.fromisoformat(str(value)[:10]).toordinal()
+
+
+def _bitset(token_ids, words: int) -> np.ndarray:
+    bits = np.zeros(words, dtype=np.uint64)
+    for token_id in token_ids:
+        bits[token_id >> 6] |= np.uint64(1) << np.uint64(token_id & 63)
+    return bits
+
+
+def _any_bits(bitsets: np.ndarray, token_ids) -> np.ndarray:
+    mask = np.zeros(len(bitsets), dtype=bool)
+    for token_id in token_ids:
+        column = bitsets[:, token_id >> 6]
+        mask |= (column & (np.uint64(1) << np.uint64(token_id & 63))) != 0
+    return mask
+
+
+class CruiseColumns:
+    """Immutable column snapshot of the catalogue, one row per cruise in
+    (sailStartDate, _id) order; prices are a rows x markets matrix holding the
+    cheapest available fare (NaN where the cruise is not sold)."""
+
+    def __init__(self, arrays: dict, meta: dict, cards: list[dict]):
+        self.arrays = arrays
+        self.meta = meta
+        self.cards = cards
+        self.markets = {market: i for i, market in enumerate(meta["markets"])}
+        self.ports = {port: i for i, port in enumerate(meta["ports"])}
+        self.tokens = {token: i for i, token in enumerate(meta["tokens"])}
+        self.sort_keys = list(zip(meta["start_dates"], meta["ids"]))
+
+    @property
+    def version(self) -> str:
+        return f"{int(self.meta['built_at'] * 1000)}"
+
+    @classmethod
+    def build(cls, cruises) -> "CruiseColumns":
+        rows = []
+        for cruise in cruises:
+            if not cruise.get("sailStartDate"):
+                continue
+            rows.append((str(cruise["sailStartDate"]), str(cruise["_id"]), cruise))
+        rows.sort(key=lambda row: row[:2])
+
+        markets, ports, tokens = {}, {}, {}
+        summaries = []
+        for _, _, cruise in rows:
+            cruise_summaries = summarize_cruise(cruise)
+            summaries.append(cruise_summaries)
+            for summary in cruise_summaries:
+                markets.setdefault(f"{summary['currency']}:{summary['country']}", len(markets))
+            for port in (cruise.get("embarkationPortName"), cruise.get("disembarkationPortName")):
+                ports.setdefault(port or "", len(ports))
+        token_fields = []
+        for _, _, cruise in rows:
+            fields = cruise_token_fields(cruise)
+            token_fields.append(fields)
+            for token in fields[PLACE_TOKENS_FIELD]:
+                tokens.setdefault(token, len(tokens))
+
+        n, m, words = len(rows), max(len(markets), 1), max((len(tokens) + 63) // 64, 1)
+        arrays = {
+            "start_day": np.full(n, -1, dtype=np.int32),
+            "end_day": np.full(n, -1, dtype=np.int32),
+            "duration": np.full(n, -1, dtype=np.int32),
+            "embark": np.zeros(n, dtype=np.int32),
+            "disembark": np.zeros(n, dtype=np.int32),
+            "round_trip": np.zeros(n, dtype=bool),
+            "place_bits": np.zeros((n, words), dtype=np.uint64),
+            "itinerary_bits": np.zeros((n, words), dtype=np.uint64),
+            "price": np.full((n, m), np.nan, dtype=np.float64),
+            "discounted": np.zeros((n, m), dtype=bool),
+            "card_index": np.full((n, m), -1, dtype=np.int32),
+        }
+        cards = []
+        for i, (_, _, cruise) in enumerate(rows):
+            arrays["start_day"][i] = day_ordinal(cruise.get("sailStartDate"))
+            arrays["end_day"][i] = day_ordinal(cruise.get("sailEndDate"))
+            duration = cruise.get("duration")
+            arrays["duration"][i] = int(duration) if duration not in (None, "") else -1
+            embark = cruise.get("embarkationPortName") or ""
+            disembark = cruise.get("disembarkationPortName") or ""
+            arrays["embark"][i] = ports[embark]
+            arrays["disembark"][i] = ports[disembark]
+            arrays["round_trip"][i] = cruise.get("embarkationPortName") == cruise.get(
+                "disembarkationPortName"
+            )
+            fields = token_fields[i]
+            arrays["place_bits"][i] = _bitset(
+                [tokens[t] for t in fields[PLACE_TOKENS_FIELD]], words
+            )
+            arrays["itinerary_bits"][i] = _bitset(
+                [tokens[t] for t in fields[ITINERARY_TOKENS_FIELD]], words
+            )
+            for summary in summaries[i]:
+                market = markets[f"{summary['currency']}:{summary['country']}"]
+                arrays["price"][i, market] = summary["price"]
+                arrays["discounted"][i, market] = summary["discounted"]
+                arrays["card_index"][i, market] = len(cards)
+                cards.append(summary["card"])
+
+        meta = {
+            "ids": [row[1] for row in rows],
+            "start_dates": [row[0] for row in rows],
+            "markets": list(markets),
+            "ports": list(ports),
+            "tokens": list(tokens),
+            "built_at": time.time(),
+        }
+        return cls(arrays, meta, cards)
+
+    def save(self, snapshot_dir: str) -> str:
+        """Write a new snapshot version and point CURRENT at it."""
+        os.makedirs(snapshot_dir, exist_ok=True)
+        version = self.version
+        tmp_path = os.path.join(snapshot_dir, f"tmp-{version}")
+        os.makedirs(tmp_path, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(tmp_path, f"{name}.npy"), self.arrays[name])
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(self.meta, f)
+        with open(os.path.join(tmp_path, "cards.json"), "w") as f:
+            json.dump(self.cards, f, default=str)
+        os.replace(tmp_path, os.path.join(snapshot_dir, version))
+        with open(os.path.join(snapshot_dir, "CURRENT.tmp"), "w") as f:
+            f.write(version)
+        os.replace(os.path.join(snapshot_dir, "CURRENT.tmp"), os.path.join(snapshot_dir, "CURRENT"))
+        # keep the previous version for workers that have not reloaded yet; they
+        # check every COLUMNAR_RELOAD_CHECK_SECONDS, well within a refresh period,
+        # and the files they already mapped stay readable once removed
+        versions = sorted(name for name in os.listdir(snapshot_dir) if name.isdigit())
+        for old in versions[:-2]:
+            shutil.rmtree(os.path.join(snapshot_dir, old), ignore_errors=True)
+        return version
+
+    @staticmethod
+    def current_version(snapshot_dir: str) -> str | None:
+        try:
+            with open(os.path.join(snapshot_dir, "CURRENT")) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def load(cls, snapshot_dir: str, mmap: bool = True) -> "CruiseColumns | None":
+        version = cls.current_version(snapshot_dir)
+        if version is None:
+            return None
+        path = os.path.join(snapshot_dir, version)
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in ARRAYS
+        }
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        with open(os.path.join(path, "cards.json")) as f:
+            cards = json.load(f)
+        return cls(arrays, meta, cards)
+
+    def mask(self, preferences: dict, currency: str, country: str) -> np.ndarray:
+        """Rows matching the CruiseSearchInfo filters, with the semantics of
+        the cruise_summaries search."""
+        a = self.arrays
+        market = self.markets.get(f"{currency}:{country}")
+        if market is None:
+            return np.zeros(len(self.sort_keys), dtype=bool)
+        mask = ~np.isnan(a["price"][:, market])
+
+        min_start = preferences.get("minSailStartDate") or datetime.now().strftime("%Y-%m-%d")
+        mask &= a["start_day"] >= day_ordinal(min_start)
+        if preferences.get("maxSailStartDate") is not None:
+            mask &= a["start_day"] <= day_ordinal(preferences["maxSailStartDate"])
+        if preferences.get("minSailEndDate") is not None:
+            mask &= a["end_day"] >= day_ordinal(preferences["minSailEndDate"])
+        if preferences.get("maxSailEndDate") is not None:
+            mask &= (a["end_day"] >= 0) & (a["end_day"] <= day_ordinal(preferences["maxSailEndDate"]))
+        if preferences.get("minDuration") is not None:
+            mask &= a["duration"] >= int(preferences["minDuration"])
+        if preferences.get("maxDuration") is not None:
+            mask &= (a["duration"] >= 0) & (a["duration"] <= int(preferences["maxDuration"]))
+        for field, column in (("embarkationPort", "embark"), ("disembarkationPort", "disembark")):
+            if preferences.get(field):
+                ids = [self.ports[port] for port in preferences[field] if port in self.ports]
+                mask &= np.isin(a[column], ids)
+        if preferences.get("destinations"):
+            ids = [
+                self.tokens[token]
+                for token in map(normalize_place, preferences["destinations"])
+                if token in self.tokens
+            ]
+            mask &= _any_bits(a["place_bits"], ids)
+        if preferences.get("ignore_destinations"):
+            ids = [
+                self.tokens[token]
+                for token in map(normalize_place, preferences["ignore_destinations"])
+                if token in self.tokens
+            ]
+            mask &= ~_any_bits(a["itinerary_bits"], ids)
+        if preferences.get("round_trip") is True:
+            mask &= a["round_trip"]
+        if preferences.get("minPrice") is not None:
+            mask &= a["price"][:, market] >= preferences["minPrice"]
+        if preferences.get("maxPrice") is not None:
+            mask &= a["price"][:, market] <= preferences["maxPrice"]
+        if preferences.get("price_discount") is True:
+            mask &= a["discounted"][:, market]
+        return mask
+
+    def search(self, preferences, currency="USD", country="US", page_size=5, cursor=None):
+        """Same result shape and cursor semantics as DBTool.get_cruises."""
+        rows = np.flatnonzero(self.mask(preferences, currency, country))
+        total = len(rows)
+        if cursor is not None:
+            key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            start = bisect.bisect_right(self.sort_keys, (key["sailStartDate"], key["_id"]))
+            rows = rows[np.searchsorted(rows, start) :]
+        page = rows[: page_size + 1]
+        next_cursor = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            start_date, cruise_id = self.sort_keys[page[-1]]
+            key = {"sailStartDate": start_date, "_id": cruise_id}
+            next_cursor = base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+        market = self.markets.get(f"{currency}:{country}")
+        cards = [dict(self.cards[self.arrays["card_index"][row, market]]) for row in page]
+        return {"cruises": cards, "total": total, "next_cursor": next_cursor}
+
+
+class ColumnarCruiseSearch:
+    """Serves searches from the latest CruiseColumns snapshot: loads the
+    on-disk snapshot at start (memory-mapped), rebuilds it from MongoDB when
+    missing and every COLUMNAR_REFRESH_SECONDS in a background thread. The
+    workers share the snapshot directory: whichever holds its lock file
+    rebuilds, the others reload when CURRENT points at a new version."""
+
+    def __init__(
+        self,
+        collection,
+        snapshot_dir: str = COLUMNAR_SNAPSHOT_DIR,
+        refresh_seconds: float = COLUMNAR_REFRESH_SECONDS,
+        mmap: bool = COLUMNAR_MMAP,
+    ):
+        self.collection = collection
+        self.snapshot_dir = snapshot_dir
+        self.refresh_seconds = refresh_seconds
+        self.mmap = mmap
+        self.columns: CruiseColumns | None = None
+        self.lock = threading.Lock()
+        self.refresher = None
+
+    def _rebuild_lock(self, blocking: bool):
+        """The open lock file while this process holds the lock, None if another does."""
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        lock_file = open(os.path.join(self.snapshot_dir, "rebuild.lock"), "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def _is_stale(self, version: str | None) -> bool:
+        return version is None or time.time() - int(version) / 1000 >= self.refresh_seconds
+
+    def _build(self) -> CruiseColumns:
+        start = time.perf_counter()
+        columns = CruiseColumns.build(self.collection.find({}, BUILD_PROJECTION))
+        columns.save(self.snapshot_dir)
+        self.columns = CruiseColumns.load(self.snapshot_dir, self.mmap)
+        logger.info(
+            f"Rebuilt columnar snapshot of {len(columns.sort_keys)} cruises in {time.perf_counter() - start:.1f}s"
+        )
+        return self.columns
+
+    def rebuild(self) -> CruiseColumns:
+        with self._rebuild_lock(blocking=True):
+            return self._build()
+
+    def refresh(self):
+        """Rebuild if the snapshot is due and no other worker is at it, else
+        pick up the version another worker wrote."""
+        if self._is_stale(CruiseColumns.current_version(self.snapshot_dir)):
+            lock_file = self._rebuild_lock(blocking=False)
+            if lock_file is not None:
+                with lock_file:
+                    # CURRENT may have moved while waiting for the lock
+                    if self._is_stale(CruiseColumns.current_version(self.snapshot_dir)):
+                        self._build()
+                        return
+        version = CruiseColumns.current_version(self.snapshot_dir)
+        if version is not None and (self.columns is None or version != self.columns.version):
+            self.columns = CruiseColumns.load(self.snapshot_dir, self.mmap)
+            logger.info(f"Reloaded columnar snapshot {version}")
+
+    def _refresh_forever(self):
+        while True:
+            time.sleep(min(self.refresh_seconds, COLUMNAR_RELOAD_CHECK_SECONDS))
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Failed to refresh columnar snapshot: {e}")
+
+    def get_columns(self) -> CruiseColumns:
+        if self.columns is None:
+            with self.lock:
+                if self.columns is None:
+                    self.columns = CruiseColumns.load(self.snapshot_dir, self.mmap)
+                if self.columns is None:
+                    # the first worker builds, the others wait and load its snapshot
+                    with self._rebuild_lock(blocking=True):
+                        self.columns = CruiseColumns.load(self.snapshot_dir, self.mmap)
+                        if self.columns is None:
+                            self._build()
+                if self.refresher is None and self.refresh_seconds > 0:
+                    self.refresher = threading.Thread(target=self._refresh_forever, daemon=True)
+                    self.refresher.start()
+        return self.columns
+
+    def search(self, preferences, currency="USD", country="US", page_size=5, cursor=None):
+        return self.get_columns().search(preferences, currency, country, page_size, cursor)
+
+
+if __name__ == "__main__":
+    from agent.tools.db.db import DBTool
+
+    logging.basicConfig(level=logging.INFO)
+    search = ColumnarCruiseSearch(DBTool().collection)
+    search.rebuild()
+    print({"snapshot": search.snapshot_dir, "cruises": len(search.columns.sort_keys)})
@@ -0,0 +1,141 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../..")))
+import logging
+from datetime import datetime, timezone
+from pymongo import DeleteMany, ReplaceOne, UpdateOne
+
+from agent.tools.utils.utils import enrich_cruise
+from agent.tools.db.place_tokens import cruise_token_fields
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_COLLECTION = "cruise_summaries"
+
+
+def summarize_cruise(cruise: dict) -> list[dict]:
+    """One flat search document per (currency, country) the cruise has an
+    available fare in. `card` is what enrich_cruise returns for that market,
+    the other fields are what get_cruises filters and sorts on."""
+    summaries = []
+    tokens = cruise_token_fields(cruise)
+    round_trip = cruise.get("embarkationPortName") == cruise.get(
+        "disembarkationPortName"
+    )
+    for price in cruise.get("prices", []):
+        currency = price.get("currency", "")
+        rates = [
+            rate
+            for suite_rate in price.get("suiteRates", [])
+            for rate in suite_rate.get("rates", [])
+        ]
+        discounted = any(rate.get("priceStatus") == "D" for rate in rates)
+        for country in price.get("countries", []):
+            card = enrich_cruise({**cruise, "prices": [price]}, currency, country)
+            if card["price"] is None:
+                continue
+            summaries.append(
+                {
+                    "_id": f"{cruise['_id']}:{currency}:{country}",
+                    "cruiseId": cruise["_id"],
+                    "currency": currency,
+                    "country": country,
+                    "sailStartDate": cruise.get("sailStartDate"),
+                    "sailEndDate": cruise.get("sailEndDate"),
+                    "duration": cruise.get("duration"),
+                    "embarkationPortName": cruise.get("embarkationPortName"),
+                    "disembarkationPortName": cruise.get("disembarkationPortName"),
+                    "roundTrip": round_trip,
+                    "price": card["price"],
+                    "originalPrice": card["originalPrice"],
+                    "discounted": discounted,
+                    **tokens,
+                    "card": card,
+                    "updatedAt": datetime.now(timezone.utc),
+                }
+            )
+    return summaries
+
+
+def _summary_operations(cruise: dict) -> list:
+    summaries = summarize_cruise(cruise)
+    return [
+        # markets the cruise is no longer sold in
+        DeleteMany(
+            {
+                "cruiseId": cruise["_id"],
+                "_id": {"$nin": [summary["_id"] for summary in summaries]},
+            }
+        )
+    ] + [ReplaceOne({"_id": s["_id"]}, s, upsert=True) for s in summaries]
+
+
+def _token_operations(cruise: dict) -> list:
+    # only when they changed, the write is seen again by the change stream
+    tokens = cruise_token_fields(cruise)
+    if all(cruise.get(field) == value for field, value in tokens.items()):
+        return []
+    return [UpdateOne({"_id": cruise["_id"]}, {"$set": tokens})]
+
+
+def materialize_summaries(db, query: dict | None = None, batch_size: int = 200):
+    """Rebuild the summaries of the cruises matching `query` (all by default),
+    and the place token fields of the cruises themselves."""
+    operations, token_operations, cruises = [], [], 0
+    for cruise in db["cruises"].find(query or {}):
+        operations += _summary_operations(cruise)
+        token_operations += _token_operations(cruise)
+        cruises += 1
+        if len(operations) >= batch_size:
+            db[SUMMARY_COLLECTION].bulk_write(operations, ordered=False)
+            operations = []
+        if len(token_operations) >= batch_size:
+            db["cruises"].bulk_write(token_operations, ordered=False)
+            token_operations = []
+    if operations:
+        db[SUMMARY_COLLECTION].bulk_write(operations, ordered=False)
+    if token_operations:
+        db["cruises"].bulk_write(token_operations, ordered=False)
+    if query is None:
+        # cruises deleted from the catalogue
+        cruise_ids = db["cruises"].distinct("_id")
+        db[SUMMARY_COLLECTION].delete_many({"cruiseId": {"$nin": cruise_ids}})
+    logger.info(f"Materialized summaries of {cruises} cruises")
+    return cruises
+
+
+def refresh_cruise_summaries(db, cruise_ids: list):
+    """Hook for code that writes to the cruises collection: rebuild the
+    summaries of the given cruises, dropping those of deleted cruises."""
+    existing = db["cruises"].distinct("_id", {"_id": {"$in": cruise_ids}})
+    deleted = [cruise_id for cruise_id in cruise_ids if cruise_id not in existing]
+    if deleted:
+        db[SUMMARY_COLLECTION].delete_many({"cruiseId": {"$in": deleted}})
+    return materialize_summaries(db, {"_id": {"$in": existing}})
+
+
+def watch_cruises(db):
+    """Keep the summaries in sync with a change stream (needs a replica set)."""
+    logger.info("Watching the cruises collection for changes")
+    with db["cruises"].watch() as stream:
+        for change in stream:
+            cruise_id = change.get("documentKey", {}).get("_id")
+            if cruise_id is not None:
+                refresh_cruise_summaries(db, [cruise_id])
+
+
+if __name__ == "__main__":
+    import argparse
+    from agent.tools.db.db import DBTool
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Maintain the cruise_summaries collection")
+    parser.add_argument("command", choices=["materialize", "watch"])
+    args = parser.parse_args()
+
+    db = DBTool().db
+    if args.command == "materialize":
+        print({"cruises": materialize_summaries(db)})
+    else:
+        watch_cruises(db)
@@ -3,7 +3,11 @@ import os
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "../../.."))
 import os
-from pymongo import MongoClient, ReturnDocument
+import asyncio
+import base64
+import copy
+import json
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
 import dotenv
 from datetime import datetime
 import re
@@ -12,19 +16,222 @@ from agent.tools.db.schema.cabin_item import CabinItem
 from agent.tools.db.schema.order_item import ContactInfo, OrderIn
 from datetime import datetime, timezone
 
-from agent.tools.utils.utils import enrich_cruise
+from agent.tools.utils.utils import enrich_cruise, iter_available_rates
+from agent.tools.utils.cache import TTLCache
+from agent.tools.db.cruise_summaries import SUMMARY_COLLECTION
+from agent.tools.db.columnar import ColumnarCruiseSearch
+from agent.retrieval.cruise_vibes import VIBE_RERANK_LIMIT, vibe_index
+from agent.tools.db.history_writer import (
+    HISTORY_FLUSH_TIMEOUT_SECONDS,
+    HISTORY_WRITE_BEHIND,
+    HistoryWriter,
+)
+from metrics import db_timed
+from agent.tools.db.client import (
+    DATABASE_NAME,
+    async_mongo_client,
+    catalogue_database,
+    mongo_client,
+    pool_wait,
+)
+from agent.tools.db.place_tokens import (
+    ITINERARY_TOKENS_FIELD,
+    PLACE_TOKENS_FIELD,
+    normalize_place,
+)
 
 dotenv.load_dotenv()
 
+# keyset order of the cruise search, _id breaks ties between same-day departures
+CRUISE_SORT = [("sailStartDate", ASCENDING), ("_id", ASCENDING)]
+DEFAULT_PAGE_SIZE = 5
+# match places against the normalized token fields (see place_tokens.py) instead
+# of case-insensitive regexes; cruises without the fields still match the regexes
+PLACE_TOKEN_SEARCH = os.getenv("PLACE_TOKEN_SEARCH", "false").lower() == "true"
+# search the materialized cruise_summaries collection (see cruise_summaries.py)
+CRUISE_SUMMARIES = os.getenv("CRUISE_SUMMARIES", "false").lower() == "true"
+# "mongo" queries MongoDB for every search, "columnar" serves searches from an
+# in-memory snapshot of the catalogue (see columnar.py)
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "mongo").lower()
+# cruise_summaries hold one document per market, so the cruise id breaks ties
+SUMMARY_SORT = [("sailStartDate", ASCENDING), ("cruiseId", ASCENDING)]
+
+# fields read by enrich_cruise for the cruise cards and cruise details, and
+# (a subset) by _list_cabin, which shares the same cached fetch
+CRUISE_CARD_FIELDS = [
+    "title",
+    "destination",
+    "itinerary.portName",
+    "duration",
+    "imagesUrl",
+    "sailStartDate",
+    "sailEndDate",
+    "shipName",
+    "embarkationPortName",
+    "disembarkationPortName",
+    "mapUrl",
+]
+# enriched cruise and cabin list per (cruise_id, currency, country)
+CRUISE_CACHE_SIZE = int(os.getenv("CRUISE_CACHE_SIZE", "1024"))
+CRUISE_CACHE_TTL_SECONDS = float(os.getenv("CRUISE_CACHE_TTL_SECONDS", "300"))
+# result cruise ids and totals per canonical search, see search_cache_key
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "2048"))
+SEARCH_CACHE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_TTL_SECONDS", "120"))
+# messages per chathistory_buckets document; 0 appends to the single
+# chathistories document of the session. With buckets, new messages only go to
+# chathistory_buckets and the chathistories messages are read before them.
+# Buckets are numbered per session (unique, see indexes.py): two writers
+# appending at once may overfill a bucket by a few messages, never open two
+HISTORY_BUCKET_SIZE = int(os.getenv("HISTORY_BUCKET_SIZE", "0"))
+HISTORY_BUCKETS_COLLECTION = "chathistory_buckets"
+
+
+def cruise_projection(fields, currency: str = "USD", country: str = "US"):
+    """Project `fields` plus only the price block of the requested currency/country."""
+    projection = {field: 1 for field in fields}
+    projection["prices"] = {"$elemMatch": {"currency": currency, "countries": country}}
+    return projection
+
+
+def search_cache_key(
+    preferences, currency: str, country: str, page_size: int, cursor: str | None
+):
+    """Canonical form of a search, so that equivalent CruiseSearchInfo share
+    a cache entry: unset, empty and false filters dropped, lists sorted,
+    destinations normalized like the search does, whole prices as ints and
+    the default minSailStartDate resolved to today."""
+    canonical = {}
+    for field, value in preferences.items():
+        if value is None or value is False or value == []:
+            continue
+        if field in ("destinations", "ignore_destinations"):
+            value = sorted({normalize_place(place) for place in value})
+        elif field in ("embarkationPort", "disembarkationPort"):
+            # matched exactly by MongoDB, so case is significant
+            value = sorted(set(value))
+        elif isinstance(value, float) and value.is_integer():
+            value = int(value)
+        canonical[field] = value
+    canonical.setdefault("minSailStartDate", datetime.now().strftime("%Y-%m-%d"))
+    return (json.dumps(canonical, sort_keys=True), currency, country, page_size, cursor)
+
 
 class DBTool:
     def __init__(self):
-        self.client = MongoClient(os.getenv("MONGODB_URI"))
-        self.db = self.client["silversea_cruises"]
-        self.collection = self.db["cruises"]
+        # shared by every DBTool of the process, see client.py
+        self.client = mongo_client()
+        self.db = self.client[DATABASE_NAME]
+        # catalogue reads may go to a secondary, carts, orders and histories
+        # read and write on the primary through self.db
+        self.catalogue_db = catalogue_database(self.client)
+        self.collection = self.catalogue_db["cruises"]
         self.history_collection = self.db["chathistories"]
+        self.history_buckets = self.db[HISTORY_BUCKETS_COLLECTION]
+
+        # async client used by the graph nodes so a slow query never blocks
+        # the event loop; the sync client stays for scripts and __main__ blocks
+        self.async_client = async_mongo_client()
+        self.async_db = self.async_client[DATABASE_NAME]
+        self.async_catalogue_db = catalogue_database(self.async_client)
+        self.async_collection = self.async_catalogue_db["cruises"]
+        self.async_history_collection = self.async_db["chathistories"]
+        self.async_history_buckets = self.async_db[HISTORY_BUCKETS_COLLECTION]
+
+        self.columnar = ColumnarCruiseSearch(self.collection)
+        self.cruise_cache = TTLCache(
+            CRUISE_CACHE_SIZE, CRUISE_CACHE_TTL_SECONDS, name="cruise"
+        )
+        self.search_cache = TTLCache(
+            SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL_SECONDS, name="search"
+        )
+        self.history_writer = HistoryWriter(self._write_history)
+
+    # The read paths below are written once, as generators ("steps") that yield
+    # the I/O they need and receive its result: a tuple for one request, a list
+    # of tuples for independent requests. _run executes them with the sync
+    # client, _arun with the async client, concurrently for a list, and with
+    # the blocking "call" requests in a worker thread.
+    #   ("count", db, collection, query)
+    #   ("distinct", db, collection, field, query)
+    #   ("find_one", db, collection, query, projection)
+    #   ("find", db, collection, query, projection, sort, limit)
+    #   ("aggregate", db, collection, pipeline)
+    #   ("bulk_write", db, collection, updates)
+    #   ("call", function, args)
+    # where db is "catalogue" (self.catalogue_db) or "primary" (self.db).
+
+    def _run(self, steps):
+        try:
+            request = next(steps)
+            while True:
+                if isinstance(request, list):
+                    result = [self._execute(item) for item in request]
+                else:
+                    result = self._execute(request)
+                request = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+
+    async def _arun(self, steps):
+        try:
+            request = next(steps)
+            while True:
+                if isinstance(request, list):
+                    result = list(
+                        await asyncio.gather(*(self._aexecute(item) for item in request))
+                    )
+                else:
+                    result = await self._aexecute(request)
+                request = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
 
-    def get_cruises(self, preferences, currency: str = "USD", country: str = "US"):
+    def _execute(self, request):
+        kind, *args = request
+        if kind == "call":
+            function, function_args = args
+            return function(*function_args)
+        database, collection, *args = args
+        database = self.catalogue_db if database == "catalogue" else self.db
+        collection = database[collection]
+        if kind == "find":
+            query, projection, sort, limit = args
+            cursor = collection.find(query, projection)
+            if sort:
+                cursor = cursor.sort(sort)
+            if limit:
+                cursor = cursor.limit(limit)
+            return list(cursor)
+        if kind == "count":
+            return collection.count_documents(*args)
+        if kind == "aggregate":
+            return list(collection.aggregate(*args))
+        return getattr(collection, kind)(*args)
+
+    async def _aexecute(self, request):
+        kind, *args = request
+        if kind == "call":
+            function, function_args = args
+            return await asyncio.to_thread(function, *function_args)
+        database, collection, *args = args
+        database = self.async_catalogue_db if database == "catalogue" else self.async_db
+        collection = database[collection]
+        if kind == "find":
+            query, projection, sort, limit = args
+            cursor = collection.find(query, projection)
+            if sort:
+                cursor = cursor.sort(sort)
+            if limit:
+                cursor = cursor.limit(limit)
+            return await cursor.to_list()
+        if kind == "count":
+            return await collection.count_documents(*args)
+        if kind == "aggregate":
+            return await (await collection.aggregate(*args)).to_list()
+        return await getattr(collection, kind)(*args)
+
+    def _build_schedule_query(self, preferences):
+        """Date, port and duration conditions, shared by both search collections."""
         if preferences.get("minSailStartDate") is None:
             preferences["minSailStartDate"] = datetime.now().strftime("%Y-%m-%d")
             # preferences["minSailStartDate"] = datetime.now().isoformat()
@@ -60,20 +267,6 @@ class DBTool:
         if len(return_date_conditions.keys()) > 0:
             query["sailEndDate"] = return_date_conditions
 
-        # Handle destinations query (unchanged)
-        if (preferences.get("destinations", []) is not None) and len(
-            preferences.get("destinations", [])
-        ) > 0:
-            search_terms = [
-                re.compile(dest.strip(), re.IGNORECASE)
-                for dest in preferences["destinations"]
-            ]
-            query["$or"] = [
-                {"destination": {"$in": search_terms}},
-                {"embarkationPortName": {"$in": search_terms}},
-                {"disembarkationPortName": {"$in": search_terms}},
-                {"itinerary.portName": {"$in": search_terms}},
-            ]
         if (preferences.get("embarkationPort", []) is not None) and len(
             preferences.get("embarkationPort", [])
         ) > 0:
@@ -90,6 +283,43 @@ class DBTool:
             duration_conditions["$lte"] = int(preferences["maxDuration"])
         if duration_conditions:
             query["duration"] = duration_conditions
+
+        return query
+
+    def _build_cruise_query(
+        self, preferences, currency: str = "USD", country: str = "US"
+    ):
+        query = self._build_schedule_query(preferences)
+
+        # Handle destinations query (unchanged)
+        if (preferences.get("destinations", []) is not None) and len(
+            preferences.get("destinations", [])
+        ) > 0:
+            search_terms = [
+                re.compile(dest.strip(), re.IGNORECASE)
+                for dest in preferences["destinations"]
+            ]
+            regex_match = [
+                {"destination": {"$in": search_terms}},
+                {"embarkationPortName": {"$in": search_terms}},
+                {"disembarkationPortName": {"$in": search_terms}},
+                {"itinerary.portName": {"$in": search_terms}},
+            ]
+            if PLACE_TOKEN_SEARCH:
+                # cruises written since the last backfill have no tokens yet
+                query["$or"] = [
+                    {
+                        PLACE_TOKENS_FIELD: {
+                            "$in": [
+                                normalize_place(dest)
+                                for dest in preferences["destinations"]
+                            ]
+                        }
+                    },
+                    {PLACE_TOKENS_FIELD: {"$exists": False}, "$or": regex_match},
+                ]
+            else:
+                query["$or"] = regex_match
         if preferences.get("round_trip") is True:
             query["$expr"] = {
                 "$eq": ["$disembarkationPortName", "$embarkationPortName"]
@@ -104,7 +334,28 @@ class DBTool:
             ]
             # Assuming the field to check is named "destination"
             # query["destination"] = {"$not": {"$in": search_terms}}
-            query["itinerary.portName"] = {"$nin": search_terms}
+            if PLACE_TOKEN_SEARCH:
+                query["$and"] = [
+                    {
+                        "$or": [
+                            {
+                                ITINERARY_TOKENS_FIELD: {
+                                    "$exists": True,
+                                    "$nin": [
+                                        normalize_place(dest)
+                                        for dest in preferences.get("ignore_destinations")
+                                    ],
+                                }
+                            },
+                            {
+                                ITINERARY_TOKENS_FIELD: {"$exists": False},
+                                "itinerary.portName": {"$nin": search_terms},
+                            },
+                        ]
+                    }
+                ]
+            else:
+                query["itinerary.portName"] = {"$nin": search_terms}
         # price conditions
         price_negative_conditions = []
         if preferences.get("minPrice") is not None:
@@ -133,13 +384,114 @@ class DBTool:
                     },
                 }
             }
+        else:
+            # same availability test as enrich_cruise, so that the count matches
+            # the cruises that are actually returned
+            query["prices"] = {
+                "$elemMatch": {
+                    "currency": currency,
+                    "countries": country,
+                    "$or": [
+                        {
+                            "suiteRates.rates": {
+                                "$elemMatch": {
+                                    "status": "A",
+                                    "fare": "P2P",
+                                    "price": {"$ne": None},
+                                }
+                            }
+                        },
+                        {
+                            "suites": {
+                                "$elemMatch": {"status": "A", "price": {"$ne": None}}
+                            }
+                        },
+                    ],
+                }
+            }
         # price discount conditions
         if preferences.get("price_discount") is True:
             query["prices.suiteRates.rates.priceStatus"] = "D"
 
-        # Fix sort syntax
-        cruises = list(self.collection.find(query).sort("sailStartDate", 1))
+        return query
+
+    def _build_summary_query(
+        self, preferences, currency: str = "USD", country: str = "US"
+    ):
+        query = self._build_schedule_query(preferences)
+        query["currency"] = currency
+        query["country"] = country
+        if preferences.get("destinations"):
+            query[PLACE_TOKENS_FIELD] = {
+                "$in": [normalize_place(dest) for dest in preferences["destinations"]]
+            }
+        if preferences.get("ignore_destinations"):
+            query[ITINERARY_TOKENS_FIELD] = {
+                "$nin": [
+                    normalize_place(dest) for dest in preferences["ignore_destinations"]
+                ]
+            }
+        if preferences.get("round_trip") is True:
+            query["roundTrip"] = True
+        price_conditions = {}
+        if preferences.get("minPrice") is not None:
+            price_conditions["$gte"] = preferences["minPrice"]
+        if preferences.get("maxPrice") is not None:
+            price_conditions["$lte"] = preferences["maxPrice"]
+        if price_conditions:
+            query["price"] = price_conditions
+        if preferences.get("price_discount") is True:
+            query["discounted"] = True
+        return query
+
+    def _search(self, preferences, currency: str = "USD", country: str = "US"):
+        """(collection, query, projection, sort) of a cruise search."""
+        if CRUISE_SUMMARIES:
+            return (
+                SUMMARY_COLLECTION,
+                self._build_summary_query(preferences, currency, country),
+                {"card": 1, "sailStartDate": 1, "cruiseId": 1},
+                SUMMARY_SORT,
+            )
+        return (
+            "cruises",
+            self._build_cruise_query(preferences, currency, country),
+            cruise_projection(CRUISE_CARD_FIELDS, currency, country),
+            CRUISE_SORT,
+        )
+
+    def _encode_cursor(self, cruise, tie_field="_id"):
+        key = {"sailStartDate": cruise["sailStartDate"], "_id": str(cruise[tie_field])}
+        return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
 
+    def _page_query(self, query, cursor: str | None = None, tie_field="_id"):
+        if cursor is None:
+            return query
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        after = {
+            "$or": [
+                {"sailStartDate": {"$gt": key["sailStartDate"]}},
+                {
+                    "sailStartDate": key["sailStartDate"],
+                    tie_field: {"$gt": ObjectId(key["_id"])},
+                },
+            ]
+        }
+        return {"$and": [query, after]}
+
+    def _cruise_page(self, cruises, total, page_size, sort, currency, country):
+        tie_field = sort[-1][0]
+        next_cursor = None
+        if len(cruises) > page_size:
+            cruises = cruises[:page_size]
+            next_cursor = self._encode_cursor(cruises[-1], tie_field)
+        if tie_field == "cruiseId":
+            cards = [summary["card"] for summary in cruises]
+        else:
+            cards = self._enrich_cruises(cruises, currency, country)
+        return {"cruises": cards, "total": total, "next_cursor": next_cursor}
+
+    def _enrich_cruises(self, cruises, currency: str = "USD", country: str = "US"):
         enriched_cruises = []
         for cruise in cruises:
             enriched_cruise = enrich_cruise(cruise, currency, country)
@@ -148,67 +500,411 @@ class DBTool:
             enriched_cruises.append(enriched_cruise)
         return enriched_cruises
 
+    @db_timed
+    def get_cruises(
+        self,
+        preferences,
+        currency: str = "USD",
+        country: str = "US",
+        page_size: int = DEFAULT_PAGE_SIZE,
+        cursor: str | None = None,
+    ):
+        """One page of matching cruises ordered by departure.
+
+        Returns {"cruises": [...], "total": int, "next_cursor": str | None}.
+        Pass next_cursor back as `cursor` with the same preferences to get the
+        following page. With a "vibe" the cruises are ordered by how close their
+        descriptions are to it instead (see cruise_vibes.py).
+        """
+        return self._run(
+            self._search_steps(preferences, currency, country, page_size, cursor)
+        )
+
+    @db_timed
+    async def aget_cruises(
+        self,
+        preferences,
+        currency: str = "USD",
+        country: str = "US",
+        page_size: int = DEFAULT_PAGE_SIZE,
+        cursor: str | None = None,
+    ):
+        return await self._arun(
+            self._search_steps(preferences, currency, country, page_size, cursor)
+        )
+
+    def _search_steps(self, preferences, currency, country, page_size, cursor):
+        # load() reads the index files when a new version was built
+        vibe = bool(preferences.get("vibe")) and (yield ("call", vibe_index.load, ()))
+        if SEARCH_BACKEND == "columnar" and not vibe:
+            # the first call may load or build the snapshot
+            return (
+                yield (
+                    "call",
+                    self.columnar.search,
+                    (preferences, currency, country, page_size, cursor),
+                )
+            )
+        key = search_cache_key(preferences, currency, country, page_size, cursor)
+        result = self.search_cache.get(key)
+        if result is not None:
+            entries, missing = self._cached_entries(result["ids"], currency, country)
+            if missing:
+                fetched = yield (
+                    "find",
+                    "catalogue",
+                    "cruises",
+                    {"_id": {"$in": [ObjectId(cruise_id) for cruise_id in missing]}},
+                    cruise_projection(CRUISE_CARD_FIELDS, currency, country),
+                    None,
+                    None,
+                )
+                self._add_entries(entries, fetched, currency, country)
+            return self._cached_page(result, entries)
+        if vibe:
+            page = yield from self._vibe_search_steps(
+                preferences, currency, country, page_size, cursor
+            )
+        else:
+            collection, query, projection, sort = self._search(
+                preferences, currency, country
+            )
+            total, cruises = yield [
+                ("count", "catalogue", collection, query),
+                (
+                    "find",
+                    "catalogue",
+                    collection,
+                    self._page_query(query, cursor, sort[-1][0]),
+                    projection,
+                    sort,
+                    page_size + 1,
+                ),
+            ]
+            page = self._cruise_page(cruises, total, page_size, sort, currency, country)
+        self._cache_page(key, page)
+        return page
+
+    def _vibe_search_steps(self, preferences, currency, country, page_size, cursor):
+        """Matching cruises ranked by vibe: all of them when they are few,
+        otherwise the nearest cruises of the index that match."""
+        collection, query, projection, sort = self._search(
+            preferences, currency, country
+        )
+        tie_field = sort[-1][0]
+        total = yield ("count", "catalogue", collection, query)
+        if total <= VIBE_RERANK_LIMIT:
+            cruise_ids = [
+                str(cruise_id)
+                for cruise_id in (
+                    yield ("distinct", "catalogue", collection, tie_field, query)
+                )
+            ]
+            ranked = self._vibe_ranked(
+                (yield ("call", vibe_index.rank, (preferences["vibe"], cruise_ids))),
+                cruise_ids,
+            )
+        else:
+            nearest = yield ("call", vibe_index.rank, (preferences["vibe"],))
+            ranked = [cruise_id for cruise_id, _ in nearest]
+            matching = yield (
+                "distinct",
+                "catalogue",
+                collection,
+                tie_field,
+                self._ids_query(query, tie_field, ranked),
+            )
+            ranked = self._vibe_ranked_matching(ranked, matching)
+        page_ids, next_cursor = self._vibe_window(ranked, page_size, cursor)
+        cruises = yield (
+            "find",
+            "catalogue",
+            collection,
+            self._ids_query(query, tie_field, page_ids),
+            projection,
+            None,
+            None,
+        )
+        # above VIBE_RERANK_LIMIT only the nearest matches can be paged through,
+        # the total is still every cruise that matches
+        return self._vibe_page(
+            cruises, page_ids, total, next_cursor, tie_field, currency, country
+        )
+
+    def _ids_query(self, query, tie_field, cruise_ids):
+        ids = {tie_field: {"$in": [ObjectId(cruise_id) for cruise_id in cruise_ids]}}
+        return {"$and": [query, ids]}
+
+    def _vibe_ranked(self, ranked, cruise_ids):
+        # cruises added since the vibe index was built come last
+        ranked_ids = [cruise_id for cruise_id, _ in ranked]
+        known = set(ranked_ids)
+        return ranked_ids + [cruise_id for cruise_id in cruise_ids if cruise_id not in known]
+
+    def _vibe_ranked_matching(self, ranked_ids, matching):
+        matching = {str(cruise_id) for cruise_id in matching}
+        return [cruise_id for cruise_id in ranked_ids if cruise_id in matching]
+
+    def _vibe_window(self, ranked_ids, page_size, cursor):
+        """Ids of the page and the cursor of the next one. Vibe results have
+        no departure order to key on, their cursor is an offset."""
+        offset = 0
+        if cursor is not None:
+            offset = json.loads(base64.urlsafe_b64decode(cursor.encode()))["offset"]
+        end = offset + page_size
+        next_cursor = None
+        if end < len(ranked_ids):
+            next_cursor = base64.urlsafe_b64encode(
+                json.dumps({"offset": end}).encode()
+            ).decode()
+        return ranked_ids[offset:end], next_cursor
+
+    def _vibe_page(
+        self, cruises, page_ids, total, next_cursor, tie_field, currency, country
+    ):
+        by_id = {str(cruise[tie_field]): cruise for cruise in cruises}
+        cruises = [by_id[cruise_id] for cruise_id in page_ids if cruise_id in by_id]
+        if tie_field == "cruiseId":
+            cards = [summary["card"] for summary in cruises]
+        else:
+            cards = self._enrich_cruises(cruises, currency, country)
+        return {"cruises": cards, "total": total, "next_cursor": next_cursor}
+
+    def _cache_page(self, key, page):
+        self.search_cache.set(
+            key,
+            {
+                "ids": [cruise["id"] for cruise in page["cruises"]],
+                "total": page["total"],
+                "next_cursor": page["next_cursor"],
+            },
+        )
+
+    def _cached_entries(self, cruise_ids, currency, country):
+        """Cruise cache entries of a cached search result, and the ids missing from it."""
+        entries = {
+            cruise_id: self.cruise_cache.get((cruise_id, currency, country))
+            for cruise_id in cruise_ids
+        }
+        return entries, [cruise_id for cruise_id, entry in entries.items() if entry is None]
+
+    def _add_entries(self, entries, cruises, currency, country):
+        for cruise in cruises:
+            cruise_id = str(cruise["_id"])
+            entries[cruise_id] = self._cruise_entry(cruise, cruise_id, currency, country)
+
+    def _cached_page(self, result, entries):
+        cruises = [
+            copy.deepcopy(entries[cruise_id]["cruise"])
+            for cruise_id in result["ids"]
+            # deleted or sold out since the search ran
+            if entries.get(cruise_id) is not None
+            and entries[cruise_id]["cruise"]["price"] is not None
+        ]
+        return {
+            "cruises": cruises,
+            "total": result["total"],
+            "next_cursor": result["next_cursor"],
+        }
+
+    def cache_stats(self) -> list[dict]:
+        return [self.cruise_cache.stats(), self.search_cache.stats()]
+
+    def pool_stats(self) -> dict:
+        """Connection check out waits of both clients, see PoolWaitListener."""
+        return pool_wait.stats()
+
+    def _cruise_entry(self, cruise, cruise_id, currency, country):
+        entry = {
+            "cruise": enrich_cruise(cruise, currency, country),
+            "cabins": self._list_cabin(cruise, cruise_id, currency, country),
+        }
+        self.cruise_cache.set((str(cruise_id), currency, country), entry)
+        return entry
+
+    def _cached_cruise_steps(self, cruise_id, currency: str = "USD", country: str = "US"):
+        entry = self.cruise_cache.get((str(cruise_id), currency, country))
+        if entry is None:
+            cruise = yield (
+                "find_one",
+                "catalogue",
+                "cruises",
+                {"_id": ObjectId(cruise_id)},
+                cruise_projection(CRUISE_CARD_FIELDS, currency, country),
+            )
+            entry = self._cruise_entry(cruise, cruise_id, currency, country)
+        # callers add keys to the returned dicts
+        return copy.deepcopy(entry)
+
+    def invalidate_cruise(self, cruise_id=None) -> int:
+        """Drop the cached entries of a cruise in every market, or of all cruises.
+        Call after writing to the cruises collection."""
+        # any cached search may include or exclude the changed cruise
+        self.search_cache.invalidate()
+        if cruise_id is None:
+            return self.cruise_cache.invalidate()
+        return self.cruise_cache.invalidate(lambda key: key[0] == str(cruise_id))
+
+    @db_timed
     def get_cruise_infor(self, cruise_id, currency: str = "USD", country: str = "US"):
-        cruise = self.collection.find_one({"_id": ObjectId(cruise_id)})
-        enriched_cruise = enrich_cruise(cruise, currency, country)
-        return enriched_cruise
+        return self._run(self._cached_cruise_steps(cruise_id, currency, country))["cruise"]
+
+    @db_timed
+    async def aget_cruise_infor(
+        self, cruise_id, currency: str = "USD", country: str = "US"
+    ):
+        cruise = await self._arun(self._cached_cruise_steps(cruise_id, currency, country))
+        return cruise["cruise"]
 
+    @db_timed
     def get_list_cabin(self, cruise_id, currency: str = "USD", country: str = "US"):
-        cruise = self.collection.find_one({"_id": ObjectId(cruise_id)})
+        return self._run(self._cached_cruise_steps(cruise_id, currency, country))["cabins"]
+
+    @db_timed
+    async def aget_list_cabin(
+        self, cruise_id, currency: str = "USD", country: str = "US"
+    ):
+        cruise = await self._arun(self._cached_cruise_steps(cruise_id, currency, country))
+        return cruise["cabins"]
+
+    def _list_cabin(self, cruise, cruise_id, currency: str = "USD", country: str = "US"):
         list_cabin = []
-        for price in cruise.get("prices", []):
-            if price.get("currency", "") == currency and (
-                country in price.get("countries", [])
-            ):
-                for suiteRate in price.get("suiteRates", []):
-                    for rate in suiteRate.get("rates", []):
-                        if (
-                            rate.get("status", "") == "A"
-                            and rate.get("fare", "") == "P2P"
-                            and rate.get("price", None) is not None
-                        ):
-                            list_cabin.append(
-                                {
-                                    "cruise_id": cruise_id,
-                                    "title": cruise.get("title", ""),
-                                    "name": suiteRate.get("name", ""),
-                                    "description": suiteRate.get("description", ""),
-                                    "fare": rate.get("fare", ""),
-                                    "price": rate.get("price", None),
-                                    "priceStatus": rate.get("priceStatus", ""),
-                                    "originalPrice": rate.get("originalPrice", None),
-                                    "cabinUrl": suiteRate.get("cabinUrl", ""),
-                                    "imagesUrl": cruise.get("imagesUrl", []),
-                                    "sailEndDate": cruise.get("sailEndDate", None),
-                                    "sailStartDate": cruise.get("sailStartDate", None),
-                                }
-                            )
+        for suiteRate, rate in iter_available_rates(
+            cruise, currency, country, suites=False
+        ):
+            list_cabin.append(
+                {
+                    "cruise_id": cruise_id,
+                    "title": cruise.get("title", ""),
+                    "name": suiteRate.get("name", ""),
+                    "description": suiteRate.get("description", ""),
+                    "fare": rate.get("fare", ""),
+                    "price": rate.get("price", None),
+                    "priceStatus": rate.get("priceStatus", ""),
+                    "originalPrice": rate.get("originalPrice", None),
+                    "cabinUrl": suiteRate.get("cabinUrl", ""),
+                    "imagesUrl": cruise.get("imagesUrl", []),
+                    "sailEndDate": cruise.get("sailEndDate", None),
+                    "sailStartDate": cruise.get("sailStartDate", None),
+                }
+            )
         return list_cabin
 
-    def ingest_history(
-        self, session_id, message, sender, cruise_list=[], list_cabin=[]
-    ):
-        chat_history = self.history_collection.find_one({"sessionId": session_id})
+    def _history_message(self, message, sender, cruise_list=[], list_cabin=[]):
         cruises = []
         for cruise in cruise_list:
             cruises.append(ObjectId(cruise))
-        message = {
+        return {
             "sender": sender,
             "text": message,
             "timestamp": datetime.now(),
             "cruises": cruises,
             "cabins": list_cabin,
         }
-        if chat_history is None:
-            return None
-        chat_history["messages"].append(message)
-        self.history_collection.update_one(
-            {"sessionId": session_id}, {"$set": {"messages": chat_history["messages"]}}
+
+    @db_timed
+    def ingest_history(
+        self, session_id, message, sender, cruise_list=[], list_cabin=[]
+    ):
+        message = self._history_message(message, sender, cruise_list, list_cabin)
+        if HISTORY_WRITE_BEHIND:
+            self.history_writer.put(session_id, message)
+        else:
+            self._write_history({session_id: [message]})
+
+    @db_timed
+    async def aingest_history(
+        self, session_id, message, sender, cruise_list=[], list_cabin=[]
+    ):
+        message = self._history_message(message, sender, cruise_list, list_cabin)
+        if HISTORY_WRITE_BEHIND:
+            self.history_writer.put(session_id, message)
+        else:
+            await self._arun(self._write_history_steps({session_id: [message]}))
+
+    def _write_history(self, messages):
+        self._run(self._write_history_steps(messages))
+
+    def _write_history_steps(self, messages):
+        """Append `messages`, {session_id: [message]}, to the sessions that
+        have a chathistories document; the others are dropped, with or
+        without buckets."""
+        if HISTORY_BUCKET_SIZE <= 0:
+            yield ("bulk_write", "primary", "chathistories", self._history_updates(messages))
+            return
+        session_ids = list(messages)
+        existing, last_buckets = yield [
+            (
+                "distinct",
+                "primary",
+                "chathistories",
+                "sessionId",
+                {"sessionId": {"$in": session_ids}},
+            ),
+            (
+                "aggregate",
+                "primary",
+                HISTORY_BUCKETS_COLLECTION,
+                [
+                    {"$match": {"sessionId": {"$in": session_ids}}},
+                    {"$sort": {"sessionId": ASCENDING, "bucket": DESCENDING}},
+                    {
+                        "$group": {
+                            "_id": "$sessionId",
+                            "bucket": {"$first": "$bucket"},
+                            "count": {"$first": "$count"},
+                        }
+                    },
+                ],
+            ),
+        ]
+        existing = set(existing)
+        updates = self._bucket_updates(
+            {
+                session_id: session_messages
+                for session_id, session_messages in messages.items()
+                if session_id in existing
+            },
+            {bucket["_id"]: (bucket["bucket"], bucket["count"]) for bucket in last_buckets},
         )
+        if updates:
+            yield ("bulk_write", "primary", HISTORY_BUCKETS_COLLECTION, updates)
 
-    def get_history(self, session_id):
-        chat_history = []
-        chat_history = self.history_collection.find_one({"sessionId": session_id})
+    def _history_updates(self, messages):
+        """$push the messages to the existing chathistories document of each session."""
+        return [
+            UpdateOne(
+                {"sessionId": session_id},
+                {"$push": {"messages": {"$each": session_messages}}},
+            )
+            for session_id, session_messages in messages.items()
+        ]
+
+    def _bucket_updates(self, messages, last_buckets):
+        """Fill the last bucket of each session, {session_id: (number, count)},
+        then upsert the following numbers; the whole batch is a single bulk write."""
+        updates = []
+        for session_id, session_messages in messages.items():
+            # a session without buckets starts at bucket 0
+            bucket, count = last_buckets.get(session_id, (-1, HISTORY_BUCKET_SIZE))
+            room = max(HISTORY_BUCKET_SIZE - count, 0)
+            start = 0
+            while start < len(session_messages):
+                if room == 0:
+                    bucket, room = bucket + 1, HISTORY_BUCKET_SIZE
+                chunk = session_messages[start : start + room]
+                updates.append(
+                    UpdateOne(
+                        {"sessionId": session_id, "bucket": bucket},
+                        {"$push": {"messages": {"$each": chunk}}, "$inc": {"count": len(chunk)}},
+                        upsert=True,
+                    )
+                )
+                start += len(chunk)
+                room -= len(chunk)
+        return updates
+
+    def _message_history(self, session_id, chat_history):
         message_history = []
         if chat_history is not None:
             for message in chat_history["messages"]:
@@ -223,6 +919,130 @@ class DBTool:
                 )
             return message_history
 
+    def _history_projection(self, skip, limit):
+        if limit is None:
+            return {"messages": {"$slice": [skip, 2**31 - 1]}} if skip else None
+        return {"messages": {"$slice": [skip, limit]}}
+
+    def _bucket_slices(self, buckets, skip, limit):
+        """(bucket _id, start, end) of the buckets holding messages
+        skip..skip+limit of the session, oldest bucket first."""
+        if skip < 0:
+            skip = max(sum(bucket["count"] for bucket in buckets) + skip, 0)
+        end = None if limit is None else skip + limit
+        slices, offset = [], 0
+        for bucket in buckets:
+            first, last = offset, offset + bucket["count"]
+            offset = last
+            if last <= skip:
+                continue
+            if end is not None and first >= end:
+                break
+            slices.append(
+                (
+                    bucket["_id"],
+                    max(skip - first, 0),
+                    None if end is None else min(end, last) - first,
+                )
+            )
+        return slices
+
+    def _bucket_history(self, session_id, slices, messages_by_bucket):
+        if not slices:
+            return None
+        messages = []
+        for bucket_id, start, end in slices:
+            messages += messages_by_bucket.get(bucket_id, [])[start:end]
+        return self._message_history(session_id, {"messages": messages})
+
+    @db_timed
+    def get_history(
+        self, session_id, skip: int = 0, limit: int | None = None, flush: bool = True
+    ):
+        """Messages skip..skip+limit of the session, oldest first; a negative
+        skip counts from the newest message. None if there is no history.
+        flush=False skips waiting for the messages queued by this process."""
+        return self._run(self._history_steps(session_id, skip, limit, flush))
+
+    @db_timed
+    async def aget_history(
+        self, session_id, skip: int = 0, limit: int | None = None, flush: bool = True
+    ):
+        return await self._arun(self._history_steps(session_id, skip, limit, flush))
+
+    def _history_steps(self, session_id, skip, limit, flush=True):
+        if flush:
+            yield ("call", self.history_writer.flush, (HISTORY_FLUSH_TIMEOUT_SECONDS,))
+        if HISTORY_BUCKET_SIZE <= 0:
+            chat_history = yield (
+                "find_one",
+                "primary",
+                "chathistories",
+                {"sessionId": session_id},
+                self._history_projection(skip, limit),
+            )
+            return self._message_history(session_id, chat_history)
+        # the messages written before buckets come first, as a bucket of their own
+        legacy, buckets = yield [
+            (
+                "aggregate",
+                "primary",
+                "chathistories",
+                [
+                    {"$match": {"sessionId": session_id}},
+                    {"$project": {"count": {"$size": {"$ifNull": ["$messages", []]}}}},
+                ],
+            ),
+            (
+                "find",
+                "primary",
+                HISTORY_BUCKETS_COLLECTION,
+                {"sessionId": session_id},
+                {"count": 1},
+                [("bucket", ASCENDING)],
+                None,
+            ),
+        ]
+        if legacy:
+            buckets = [{"_id": None, "count": legacy[0]["count"]}] + buckets
+        slices = self._bucket_slices(buckets, skip, limit)
+        requests = []
+        if slices and slices[0][0] is None:
+            _, start, end = slices[0]
+            requests.append(
+                (
+                    "find_one",
+                    "primary",
+                    "chathistories",
+                    {"sessionId": session_id},
+                    self._history_projection(start, None if end is None else end - start),
+                )
+            )
+            # the projection already sliced them
+            slices[0] = (None, 0, None)
+        bucket_ids = [bucket_id for bucket_id, _, _ in slices if bucket_id is not None]
+        if bucket_ids:
+            requests.append(
+                (
+                    "find",
+                    "primary",
+                    HISTORY_BUCKETS_COLLECTION,
+                    {"_id": {"$in": bucket_ids}},
+                    {"messages": 1},
+                    None,
+                    None,
+                )
+            )
+        messages_by_bucket = {}
+        for request, result in zip(requests, (yield requests)):
+            if request[0] == "find_one":
+                messages_by_bucket[None] = (result or {}).get("messages", [])
+            else:
+                for bucket in result:
+                    messages_by_bucket[bucket["_id"]] = bucket["messages"]
+        return self._bucket_history(session_id, slices, messages_by_bucket)
+
+    @db_timed
     def save_cabin_to_cart(
         self,
         user_id: ObjectId,
@@ -239,6 +1059,28 @@ class DBTool:
             upsert=True,
             return_document=ReturnDocument.AFTER,
         )
+        return self._cart_item(updated_cart, user_id, new_item)
+
+    @db_timed
+    async def asave_cabin_to_cart(
+        self,
+        user_id: ObjectId,
+        cabin_item: CabinItem,
+    ):
+        new_item = cabin_item.model_dump(by_alias=True)
+
+        updated_cart = await self.async_db["carts"].find_one_and_update(
+            {"user_id": ObjectId(user_id)},
+            {
+                "$push": {"items": new_item},
+                "$set": {"updatedAt": datetime.now(timezone.utc)},
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return self._cart_item(updated_cart, user_id, new_item)
+
+    def _cart_item(self, updated_cart, user_id, new_item):
         out = {
             "cart_id": str(updated_cart["_id"]),
             "user_id": user_id,
@@ -248,8 +1090,8 @@ class DBTool:
 
         return out
 
-    def save_order(self, order: OrderIn):
-        query = [
+    def _order_cart_query(self, order: OrderIn):
+        return [
             {"$match": {"userId": ObjectId(order.userId)}},
             {
                 "$project": {
@@ -269,12 +1111,25 @@ class DBTool:
                 }
             },
         ]
+
+    @db_timed
+    def save_order(self, order: OrderIn):
+        query = self._order_cart_query(order)
         cart = list(self.db["carts"].aggregate(query))
         order_dict = order.model_dump(by_alias=True)
         order_dict["items"] = cart[0]["items"]
         out = self.db["orders"].insert_one(order_dict)
         return out
 
+    @db_timed
+    async def asave_order(self, order: OrderIn):
+        query = self._order_cart_query(order)
+        cursor = await self.async_db["carts"].aggregate(query)
+        cart = await cursor.to_list()
+        order_dict = order.model_dump(by_alias=True)
+        order_dict["items"] = cart[0]["items"]
+        out = await self.async_db["orders"].insert_one(order_dict)
+        return out
 
 if __name__ == "__main__":
 
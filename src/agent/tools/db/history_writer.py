@@ -0,0 +1,112 @@
+import os
+import time
+import queue
+import logging
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# chat history messages are appended by a background thread in batches;
+# "false" writes each message in the caller instead
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "true").lower() == "true"
+# a batch is written once it holds this many messages...
+HISTORY_FLUSH_SIZE = int(os.getenv("HISTORY_FLUSH_SIZE", "100"))
+# ...or this long after its first message
+HISTORY_FLUSH_SECONDS = float(os.getenv("HISTORY_FLUSH_SECONDS", "0.5"))
+# a history read waits at most this long for the queued messages to be written
+HISTORY_FLUSH_TIMEOUT_SECONDS = float(os.getenv("HISTORY_FLUSH_TIMEOUT_SECONDS", "5"))
+
+
+class HistoryWriter:
+    """Write-behind queue of chat history messages.
+
+    `put` returns at once. A daemon thread groups the queued messages per
+    session and hands them to `write({session_id: [message, ...]})`, in
+    order, when the batch is full or old enough.
+    """
+
+    def __init__(
+        self,
+        write,
+        flush_size: int = HISTORY_FLUSH_SIZE,
+        flush_seconds: float = HISTORY_FLUSH_SECONDS,
+    ):
+        self.write = write
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.queue: queue.Queue = queue.Queue()
+        self.thread: threading.Thread | None = None
+        self.lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+
+    def put(self, session_id, message):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._run, name="history-writer", daemon=True
+                )
+                self.thread.start()
+        self.queue.put((session_id, message))
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Block until the messages queued so far are written, or `timeout`
+        passed. Returns False on timeout."""
+        if self.thread is None:
+            return True
+        done = threading.Event()
+        self.queue.put(done)
+        if done.wait(timeout):
+            return True
+        logger.warning(f"Chat history not written after {timeout}s, reading without it")
+        return False
+
+    def close(self, timeout: float | None = None):
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join(timeout)
+        self.thread = None
+
+    def _run(self):
+        batch, size, deadline = {}, 0, None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = "timeout"
+            if isinstance(item, tuple):
+                session_id, message = item
+                batch.setdefault(session_id, []).append(message)
+                size += 1
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_seconds
+                if size < self.flush_size:
+                    continue
+            if batch:
+                self._write(batch, size)
+                batch, size, deadline = {}, 0, None
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is None:
+                return
+
+    def _write(self, batch, size):
+        try:
+            self.write(batch)
+            self.written += size
+        except Exception as e:
+            self.failed += size
+            logger.error(f"Failed to write {size} chat history messages: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "written": self.written,
+            "failed": self.failed,
+        }
@@ -0,0 +1,156 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../..")))
+import logging
+from pymongo import ASCENDING, IndexModel
+
+from agent.tools.db.db import (
+    CRUISE_SORT,
+    DEFAULT_PAGE_SIZE,
+    HISTORY_BUCKETS_COLLECTION,
+    SUMMARY_SORT,
+    DBTool,
+)
+from agent.tools.db.cruise_summaries import SUMMARY_COLLECTION
+from agent.tools.db.place_tokens import ITINERARY_TOKENS_FIELD, PLACE_TOKENS_FIELD
+
+logger = logging.getLogger(__name__)
+
+# indexes for every filter and sort used by DBTool, per collection
+INDEXES = {
+    "cruises": [
+        # sort and keyset paging of get_cruises, also serves the date range
+        IndexModel(CRUISE_SORT, name="sailStartDate_id"),
+        IndexModel(
+            [("prices.currency", ASCENDING), ("sailStartDate", ASCENDING)],
+            name="prices_currency_sailStartDate",
+        ),
+        IndexModel([("sailEndDate", ASCENDING)], name="sailEndDate"),
+        IndexModel([("duration", ASCENDING)], name="duration"),
+        IndexModel([("destination", ASCENDING)], name="destination"),
+        IndexModel([("embarkationPortName", ASCENDING)], name="embarkationPortName"),
+        IndexModel(
+            [("disembarkationPortName", ASCENDING)], name="disembarkationPortName"
+        ),
+        IndexModel([("itinerary.portName", ASCENDING)], name="itinerary_portName"),
+        IndexModel([(PLACE_TOKENS_FIELD, ASCENDING)], name=PLACE_TOKENS_FIELD),
+        IndexModel([(ITINERARY_TOKENS_FIELD, ASCENDING)], name=ITINERARY_TOKENS_FIELD),
+    ],
+    SUMMARY_COLLECTION: [
+        # equality on the market, then the sort/keyset order
+        IndexModel(
+            [("currency", ASCENDING), ("country", ASCENDING), *SUMMARY_SORT],
+            name="market_sailStartDate_cruiseId",
+        ),
+        IndexModel(
+            [("currency", ASCENDING), ("country", ASCENDING), ("price", ASCENDING)],
+            name="market_price",
+        ),
+        IndexModel([(PLACE_TOKENS_FIELD, ASCENDING)], name=PLACE_TOKENS_FIELD),
+        IndexModel([("cruiseId", ASCENDING)], name="cruiseId"),
+    ],
+    # save_cabin_to_cart looks carts up by user_id, save_order by userId
+    "carts": [
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        IndexModel([("userId", ASCENDING)], name="userId"),
+    ],
+    "chathistories": [IndexModel([("sessionId", ASCENDING)], name="sessionId")],
+    # the last bucket of the session for appends, buckets in order for reads;
+    # unique so that concurrent upserts of the next bucket cannot both insert
+    HISTORY_BUCKETS_COLLECTION: [
+        IndexModel(
+            [("sessionId", ASCENDING), ("bucket", ASCENDING)],
+            name="sessionId_bucket",
+            unique=True,
+        )
+    ],
+}
+
+# representative get_cruises preferences, one per query shape
+QUERY_SHAPES = {
+    "upcoming": {},
+    "date_range": {"minSailStartDate": "2025-06-01", "maxSailStartDate": "2025-09-30"},
+    "return_date": {"maxSailEndDate": "2025-12-31"},
+    "destination": {"destinations": ["Lisbon"]},
+    "embarkation_port": {"embarkationPort": ["Lisbon"]},
+    "disembarkation_port": {"disembarkationPort": ["Barcelona"]},
+    "duration": {"minDuration": 7, "maxDuration": 14},
+    "price": {"maxPrice": 5000},
+    "round_trip": {"round_trip": True},
+    "ignore_destination": {"destinations": ["Europe"], "ignore_destinations": ["Venice"]},
+    "discount": {"price_discount": True},
+}
+
+
+def ensure_indexes(db):
+    """Create the missing indexes, existing ones are left untouched."""
+    created = {}
+    for collection, indexes in INDEXES.items():
+        created[collection] = db[collection].create_indexes(indexes)
+    logger.info(f"Ensured indexes: {created}")
+    return created
+
+
+async def aensure_indexes(async_db):
+    created = {}
+    for collection, indexes in INDEXES.items():
+        created[collection] = await async_db[collection].create_indexes(indexes)
+    logger.info(f"Ensured indexes: {created}")
+    return created
+
+
+def _plan_stages(plan):
+    stages = [plan.get("stage")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages += _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += _plan_stages(child)
+    for shard in plan.get("shards", []):
+        stages += _plan_stages(shard["winningPlan"])
+    return stages
+
+
+def check_query_plans(db_tool: DBTool, currency: str = "USD", country: str = "US"):
+    """explain() every query shape of get_cruises (on the collection it currently
+    searches) and return the winning plan
+    stages per shape; shapes whose plan contains a COLLSCAN are logged as errors."""
+    results = {}
+    for name, preferences in QUERY_SHAPES.items():
+        collection, query, projection, sort = db_tool._search(
+            dict(preferences), currency, country
+        )
+        explain = (
+            db_tool.db[collection]
+            .find(query, projection)
+            .sort(sort)
+            .limit(DEFAULT_PAGE_SIZE + 1)
+            .explain()
+        )
+        stages = _plan_stages(explain["queryPlanner"]["winningPlan"])
+        results[name] = stages
+        if "COLLSCAN" in stages:
+            logger.error(f"Query shape {name} does a collection scan: {stages}")
+        else:
+            logger.info(f"Query shape {name}: {stages}")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Manage the MongoDB indexes")
+    parser.add_argument("command", choices=["ensure", "check"])
+    args = parser.parse_args()
+
+    db_tool = DBTool()
+    if args.command == "ensure":
+        ensure_indexes(db_tool.db)
+    else:
+        results = check_query_plans(db_tool)
+        scans = [name for name, stages in results.items() if "COLLSCAN" in stages]
+        if scans:
+            sys.exit(f"Collection scans in: {', '.join(scans)}")
+        print("No collection scans")
@@ -0,0 +1,87 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../..")))
+import re
+import logging
+import unicodedata
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# normalized word n-grams of destination and all port names, matched by search destinations
+PLACE_TOKENS_FIELD = "placeTokens"
+# normalized word n-grams of the itinerary ports only, matched by ignore_destinations
+ITINERARY_TOKENS_FIELD = "itineraryTokens"
+# longest n-gram stored; longer search terms cannot match
+MAX_NGRAM_WORDS = 8
+
+
+def normalize_place(text: str) -> str:
+    """Lowercase, strip accents and punctuation: "Nuku'alofa, Tonga" -> "nuku alofa tonga"."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def place_tokens(names) -> list[str]:
+    """Every run of consecutive words of every name, so that a search term matches
+    like the former case-insensitive substring regex as long as it is whole words:
+    "new york" and "york" both match "New York City"."""
+    tokens = set()
+    for name in names:
+        words = normalize_place(name).split()
+        for start in range(len(words)):
+            for end in range(start + 1, min(start + MAX_NGRAM_WORDS, len(words)) + 1):
+                tokens.add(" ".join(words[start:end]))
+    return sorted(tokens)
+
+
+def cruise_token_fields(cruise: dict) -> dict:
+    """The token fields of a cruise document, to $set whenever a cruise is written."""
+    itinerary_ports = [stop.get("portName", "") for stop in cruise.get("itinerary", [])]
+    return {
+        PLACE_TOKENS_FIELD: place_tokens(
+            [
+                cruise.get("destination", ""),
+                cruise.get("embarkationPortName", ""),
+                cruise.get("disembarkationPortName", ""),
+                *itinerary_ports,
+            ]
+        ),
+        ITINERARY_TOKENS_FIELD: place_tokens(itinerary_ports),
+    }
+
+
+def backfill_place_tokens(collection, only_missing: bool = True, batch_size: int = 500):
+    """(Re)compute the token fields of the cruises, by default only where missing."""
+    query = {PLACE_TOKENS_FIELD: {"$exists": False}} if only_missing else {}
+    projection = {
+        "destination": 1,
+        "embarkationPortName": 1,
+        "disembarkationPortName": 1,
+        "itinerary.portName": 1,
+    }
+    updated, batch = 0, []
+    for cruise in collection.find(query, projection):
+        batch.append(UpdateOne({"_id": cruise["_id"]}, {"$set": cruise_token_fields(cruise)}))
+        if len(batch) >= batch_size:
+            updated += collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        updated += collection.bulk_write(batch, ordered=False).modified_count
+    logger.info(f"Updated place tokens of {updated} cruises")
+    return updated
+
+
+if __name__ == "__main__":
+    import argparse
+    from agent.tools.db.db import DBTool
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Backfill the normalized place token fields")
+    parser.add_argument(
+        "--all", action="store_true", help="recompute every cruise, not only those missing tokens"
+    )
+    args = parser.parse_args()
+    print({"updated": backfill_place_tokens(DBTool().collection, only_missing=not args.all)})
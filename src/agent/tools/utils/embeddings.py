@@ -0,0 +1,36 @@
+import os
+import asyncio
+import threading
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_embedding_model():
+    """Load the sentence embedding model on first use, importing torch takes seconds."""
+    global _model
+    with _model_lock:
+        if _model is None:
+            from sentence_transformers import SentenceTransformer
+
+            _model = SentenceTransformer(EMBEDDING_MODEL)
+    return _model
+
+
+def embed(texts: list[str]) -> np.ndarray:
+    """Unit-length float32 embeddings, so a dot product is the cosine similarity."""
+    vectors = get_embedding_model().encode(
+        texts, normalize_embeddings=True, convert_to_numpy=True
+    )
+    return vectors.astype(np.float32)
+
+
+async def aembed(texts: list[str]) -> np.ndarray:
+    return await asyncio.to_thread(embed, texts)
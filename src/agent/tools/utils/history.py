@@ -0,0 +1,130 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../..")))
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import logging
+from langchain_openai import ChatOpenAI
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, SystemMessage
+from langgraph.constants import TAG_NOSTREAM
+
+from agent.objects.objects import AgentState
+from agent.prompts.agent_main_prompt import history_summary_prompt
+
+logger = logging.getLogger(__name__)
+
+# turns left out of state.summary, older turns are folded into it. No more than
+# the smallest node window (ROUTER_HISTORY_TURNS), as every window holds all
+# the turns not yet summarized
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "2"))
+# fold only once this many turns are pending so the summary is not redone every turn
+HISTORY_SUMMARY_BATCH_TURNS = int(os.getenv("HISTORY_SUMMARY_BATCH_TURNS", "4"))
+# a thread without checkpoint (new worker, restart) is seeded from chathistories
+HISTORY_REHYDRATE = os.getenv("HISTORY_REHYDRATE", "true").lower() == "true"
+# latest turns read back from chathistories when seeding a thread
+HISTORY_REHYDRATE_TURNS = int(os.getenv("HISTORY_REHYDRATE_TURNS", "20"))
+# tool results (cruise and cabin lists) are cut to this size in the summary input
+SUMMARY_MESSAGE_CHARS = 500
+
+summarizer = ChatOpenAI(model="gpt-4o-mini", temperature=0).with_config(
+    tags=[TAG_NOSTREAM]
+)
+
+
+def turn_starts(messages: list[AnyMessage]) -> list[int]:
+    """Indexes of the messages that start a turn. Slicing there never separates
+    a tool call from its tool result."""
+    return [i for i, message in enumerate(messages) if isinstance(message, HumanMessage)]
+
+
+def window_messages(state: AgentState, max_turns: int) -> list[AnyMessage]:
+    """Messages to send to a model: the rolling summary followed by the last
+    `max_turns` turns, or by all the turns not yet part of the summary if there
+    are more, so that no turn is in neither."""
+    starts = turn_starts(state.messages)
+    start = min(state.summarized_until, starts[-max_turns]) if len(starts) > max_turns else 0
+    messages = state.messages[start:]
+    if state.summary:
+        return [
+            SystemMessage(content=f"Summary of the earlier conversation: {state.summary}")
+        ] + messages
+    return messages
+
+
+def _transcript(messages: list[AnyMessage]) -> str:
+    lines = []
+    for message in messages:
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        if not content:
+            continue
+        lines.append(f"{message.type}: {content[:SUMMARY_MESSAGE_CHARS]}")
+    return "\n".join(lines)
+
+
+async def summarize_history(state: AgentState, config: dict):
+    """Fold the turns older than HISTORY_KEEP_TURNS into state.summary."""
+    starts = turn_starts(state.messages)
+    if len(starts) <= HISTORY_KEEP_TURNS:
+        return {}
+    cutoff = starts[-HISTORY_KEEP_TURNS]
+    pending = [i for i in starts if state.summarized_until <= i < cutoff]
+    if len(pending) < HISTORY_SUMMARY_BATCH_TURNS:
+        return {}
+
+    logger.info(f"Summarizing {len(pending)} turns before message {cutoff}")
+    summary = await _summarize(state.messages[state.summarized_until : cutoff], state.summary)
+    return {"summary": summary, "summarized_until": cutoff}
+
+
+async def _summarize(messages: list[AnyMessage], summary: str | None = None) -> str:
+    response = await summarizer.ainvoke(
+        [
+            SystemMessage(content=history_summary_prompt),
+            HumanMessage(
+                content=f"Current summary: {summary or 'None'}\n\n"
+                f"New conversation:\n{_transcript(messages)}"
+            ),
+        ]
+    )
+    return response.content
+
+
+async def rehydrate_history(
+    history: list[dict] | None, pending_text: str | None = None
+) -> dict:
+    """State seeding a thread that has no checkpoint from its chathistories
+    messages (as returned by DBTool.get_history): the stored turns as messages,
+    all but the last HISTORY_KEEP_TURNS also folded into the summary.
+
+    `pending_text` is the message of the current request, dropped from the
+    end of the history if it was stored before the agent runs.
+    """
+    if not history:
+        return {}
+    last = history[-1]
+    if pending_text is not None and last["isUser"] and last["message"] == pending_text:
+        history = history[:-1]
+    messages = [
+        (HumanMessage if message["isUser"] else AIMessage)(content=message["message"])
+        for message in history
+        if message["message"]
+    ]
+    starts = turn_starts(messages)
+    if not starts:
+        return {}
+    messages = messages[starts[-min(len(starts), HISTORY_REHYDRATE_TURNS)] :]
+    starts = turn_starts(messages)
+    cutoff = starts[-HISTORY_KEEP_TURNS] if len(starts) > HISTORY_KEEP_TURNS else 0
+    if not cutoff:
+        return {"messages": messages}
+    logger.info(f"Summarizing {len(starts) - HISTORY_KEEP_TURNS} stored turns")
+    try:
+        summary = await _summarize(messages[:cutoff])
+    except Exception as e:
+        # the recent turns alone still beat an empty thread
+        logger.error(f"Failed to summarize the stored history: {e}")
+        return {"messages": messages[cutoff:]}
+    return {"messages": messages, "summary": summary, "summarized_until": cutoff}
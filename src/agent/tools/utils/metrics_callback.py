@@ -0,0 +1,62 @@
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langgraph.errors import GraphBubbleUp
+
+from metrics import LLM_SECONDS, NODE_SECONDS
+
+
+class GraphMetricsHandler(BaseCallbackHandler):
+    """Times the graph nodes and chat model calls of the runs it is passed to,
+    into the histograms of metrics.py. Child runs inherit it from the config."""
+
+    # only records timings, no need for the thread pool of sync handlers
+    run_inline = True
+
+    def __init__(self):
+        self.nodes = {}
+        self.llm_calls = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        # the node run itself, not the runnables it calls
+        if node is not None and kwargs.get("name") == node:
+            self.nodes[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end_node(run_id, "ok")
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        # interrupt() and Command(graph=PARENT) are control flow, not failures
+        self._end_node(run_id, "interrupt" if isinstance(error, GraphBubbleUp) else "error")
+
+    def _end_node(self, run_id, outcome):
+        started = self.nodes.pop(run_id, None)
+        if started is not None:
+            node, started_at = started
+            NODE_SECONDS.labels(node, outcome).observe(time.perf_counter() - started_at)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        metadata = metadata or {}
+        self.llm_calls[run_id] = (
+            metadata.get("langgraph_node", "none"),
+            metadata.get("ls_model_name", "unknown"),
+            time.perf_counter(),
+        )
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end_llm(run_id, "ok")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end_llm(run_id, "error")
+
+    def _end_llm(self, run_id, outcome):
+        started = self.llm_calls.pop(run_id, None)
+        if started is not None:
+            call_site, model, started_at = started
+            LLM_SECONDS.labels(call_site, model, outcome).observe(
+                time.perf_counter() - started_at
+            )
+
+
+graph_metrics = GraphMetricsHandler()
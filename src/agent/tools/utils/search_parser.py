@@ -0,0 +1,531 @@
+import os
+import re
+import calendar
+import logging
+import unicodedata
+from datetime import date, timedelta
+
+from dotenv import load_dotenv
+
+from agent.objects.objects import CruiseSearchInfo
+from agent.tools.db.place_tokens import normalize_place
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# parse search messages with the rules below before asking the LLM
+SEARCH_PRE_PARSER = os.getenv("SEARCH_PRE_PARSER", "true").lower() == "true"
+
+# catalogue fields whose values are the known places
+PLACE_FIELDS = [
+    "destination",
+    "embarkationPortName",
+    "disembarkationPortName",
+    "itinerary.portName",
+]
+# the fields whose values the embarkation and disembarkation cues accept
+PORT_FIELDS = ["embarkationPortName", "disembarkationPortName"]
+# regions users name that are not necessarily catalogue values
+REGIONS = [
+    "Africa",
+    "Alaska",
+    "Antarctica",
+    "Arctic",
+    "Asia",
+    "Australia",
+    "British Isles",
+    "Canada",
+    "Caribbean",
+    "Central America",
+    "Europe",
+    "Mediterranean",
+    "Middle East",
+    "North America",
+    "Northern Europe",
+    "Oceania",
+    "South America",
+    "South Pacific",
+    "Transoceanic",
+]
+PLACE_ALIASES = {
+    "african": "Africa",
+    "alaskan": "Alaska",
+    "antarctic": "Antarctica",
+    "asian": "Asia",
+    "australian": "Australia",
+    "caribbean": "Caribbean",
+    "european": "Europe",
+    "mediterranean": "Mediterranean",
+    "med": "Mediterranean",
+}
+# place names that are also common words only count after a preposition
+AMBIGUOUS_PLACES = {"bar", "bath", "cork", "male", "mobile", "nice", "sale", "split"}
+PLACE_PREPOSITIONS = {"to", "in", "from", "at", "via", "visit", "visiting", "include", "includes", "and", "or"}
+
+# words that carry no search criterion; any other word left over after the
+# rules ran means the message says something the rules do not understand
+FILLER = set(
+    """
+    a about all also an and any anything are arrive arrives arriving at available be begin begins
+    book booking can cost costs costing could cruise cruises cruising depart departs departing
+    destination destinations do duration end ends ending find finish finishes finishing for from
+    get give go goes going has have hello hi i im in include includes including is itinerary
+    itineraries just know last lasts lasting leave leaves leaving length let like list long look
+    looking me my need of offer offers on one ones only option options or per person please port
+    ports price priced prices pricing provide return returns returning sail sails sailing sailings
+    search searching see show some something start starts starting stop stops tell that the there
+    through to travel travels traveling travelling trip trips upcoming us via visit visits visiting
+    voyage voyages want wanna we what where which with would you your
+    """.split()
+)
+
+MONTHS = {
+    name: number
+    for number in range(1, 13)
+    for name in (calendar.month_name[number].lower(), calendar.month_abbr[number].lower())
+}
+MONTHS["sept"] = 9
+SEASONS = {"spring": 3, "summer": 6, "autumn": 9, "fall": 9, "winter": 12}
+WORD_NUMBERS = {
+    word: number
+    for number, word in enumerate(
+        "zero one two three four five six seven eight nine ten eleven twelve thirteen"
+        " fourteen fifteen sixteen seventeen eighteen nineteen twenty".split()
+    )
+}
+WORD_NUMBERS["a"] = 1
+UNIT_DAYS = {"day": 1, "days": 1, "night": 1, "nights": 1, "week": 7, "weeks": 7}
+
+TOKEN = re.compile(r"[a-z0-9$€£]+(?:[-.,/][0-9]+)*[$€£]?")
+
+MONTH_RE = "(?:" + "|".join(sorted(MONTHS, key=len, reverse=True)) + ")"
+DAY_RE = r"\d{1,2}(?:st|nd|rd|th)?"
+YEAR_RE = r"20\d{2}"
+SEASON_RE = "(?:" + "|".join(SEASONS) + ")"
+DATE_ATOM = re.compile(
+    rf"(?<![\w$€£])(?:\d{{4}}-\d{{1,2}}-\d{{1,2}}"
+    rf"|{MONTH_RE} {DAY_RE}(?: {YEAR_RE})?"
+    rf"|{DAY_RE}(?: of)? {MONTH_RE}(?: {YEAR_RE})?"
+    rf"|{MONTH_RE}(?: {YEAR_RE})?"
+    rf"|(?:this|next) (?:week|month|year|{SEASON_RE})"
+    rf"|{SEASON_RE}(?: {YEAR_RE})?"
+    rf"|today|tomorrow|{YEAR_RE})(?![\w$€£])"
+)
+DATE_RANGE_GAP = re.compile(r" (?:and|to|until|till|through|thru) ")
+DATE_RANGE_PREFIX = re.compile(r"(?:between|from) $")
+DATE_MIN_PREFIX = re.compile(r"(?:on or after|after|later than) $")
+DATE_FROM_PREFIX = re.compile(r"(?:from|starting|starting from|beginning|since|as of) $")
+DATE_MAX_PREFIX = re.compile(r"(?:on or before|before|by|until|till|no later than|prior to|earlier than) $")
+DATE_IN_PREFIX = re.compile(r"(?:in|on|during|for|of|around) $")
+END_WORD = re.compile(r"(?:end|ends|ending|finish\w*|return\w*|back|arriv\w*|disembark\w*)$")
+START_WORD = re.compile(r"(?:depart\w*|start\w*|sail\w*|leav\w*|begin\w*|embark\w*)$")
+
+UNIT_RE = "(" + "|".join(UNIT_DAYS) + ")"
+DURATION_RULES = [
+    (rf"between (\d+) and (\d+) {UNIT_RE}", "range"),
+    (rf"(\d+) (?:to|and) (\d+) {UNIT_RE}", "range"),
+    (rf"(\d+)-(\d+) {UNIT_RE}", "range"),
+    (rf"(?:more|longer|greater) than (\d+) {UNIT_RE}", "above"),
+    (rf"(?:at least|minimum(?: of)?|min) (\d+) {UNIT_RE}", "min"),
+    (rf"(\d+) {UNIT_RE} or (?:more|longer)", "min"),
+    (rf"(?:less|shorter|fewer) than (\d+) {UNIT_RE}", "below"),
+    (rf"under (\d+) {UNIT_RE}", "below"),
+    (rf"(?:at most|up to|no (?:more|longer) than|maximum(?: of)?|max) (\d+) {UNIT_RE}", "max"),
+    (rf"(\d+) {UNIT_RE} or (?:less|fewer|shorter)", "max"),
+    # not "in 3 weeks", which is a date
+    (rf"(?<!in )(?<!within )(?:exactly )?(\d+) {UNIT_RE}", "exact"),
+]
+
+NUMBER_RE = r"\d+(?:,\d{3})*(?:\.\d+)?k?"
+MONEY_RE = (
+    rf"((?:[$€£]{NUMBER_RE}|{NUMBER_RE}(?:[$€£]| (?:dollars?|usd|eur|euros?|gbp|pounds?|aud))?))"
+)
+PRICE_RULES = [
+    (rf"between {MONEY_RE} and {MONEY_RE}", "range"),
+    (rf"from {MONEY_RE} to {MONEY_RE}", "range"),
+    (
+        rf"(?:less than|cheaper than|lower than|under|below|at most|up to|no more than"
+        rf"|not more than|maximum(?: of)?|max|within|budget(?: of| is)?) {MONEY_RE}",
+        "max",
+    ),
+    (rf"(?:more than|higher than|over|above|at least|minimum(?: of)?|min|starting at) {MONEY_RE}", "min"),
+]
+ROUND_TRIP_RE = (
+    r"round ?trips?"
+    r"|(?:start\w*|begin\w*|depart\w*) and (?:end\w*|finish\w*|return\w*) (?:at|in) the same (?:port|place|city)"
+    r"|return\w* to the same (?:port|place|city)"
+)
+DISCOUNT_RE = r"discount\w*|on sale|special offers?|deals?|promotions?|promo"
+
+EMBARK_CUE = (
+    r"(?:(?:depart\w*|leav\w*|sail\w*|start\w*|begin\w*|embark\w*) )?(?:from|out of)"
+    r"|(?:depart\w*|start\w*|begin\w*|embark\w*) (?:in|at)|departing|leaving"
+)
+DISEMBARK_CUE = r"(?:end\w*|finish\w*|arriv\w*|terminat\w*|disembark\w*|return\w*) (?:up )?(?:in|at|to)"
+IGNORE_CUE = (
+    r"(?:don t|do not|doesn t|does not|not|never|won t) "
+    r"(?:pass\w*|go\w*|stop\w*|visit\w*|call\w*|includ\w*|sail\w*|travel\w*)(?: (?:by|through|at|in|to|via))?"
+    r"|avoid\w*|except|excluding|exclude|other than|without(?: stops? (?:in|at))?"
+)
+
+
+def _tokens(message: str) -> list[str]:
+    text = unicodedata.normalize("NFKD", message or "")
+    text = "".join(char for char in text if not unicodedata.combining(char)).lower()
+    tokens = TOKEN.findall(text)
+    # "two weeks" -> "2 weeks", "a week" -> "1 week"
+    return [
+        str(WORD_NUMBERS[token])
+        if token in WORD_NUMBERS and i + 1 < len(tokens) and tokens[i + 1] in UNIT_DAYS
+        else token
+        for i, token in enumerate(tokens)
+    ]
+
+
+def _month_end(year: int, month: int) -> date:
+    return date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _money(text: str) -> float:
+    number = re.search(NUMBER_RE, text).group(0).replace(",", "")
+    value = float(number[:-1]) * 1000 if number.endswith("k") else float(number)
+    return int(value) if value.is_integer() else value
+
+
+class DateAtom:
+    """A date expression as the range of days it covers."""
+
+    def __init__(self, start: date, end: date, has_year: bool, needs_preposition: bool):
+        self.start = start
+        self.end = end
+        self.has_year = has_year
+        # a bare month or year ("may", "2026") is only a date after in/on/before/...
+        self.needs_preposition = needs_preposition
+
+    @property
+    def is_day(self) -> bool:
+        return self.start == self.end
+
+    def with_year(self, year: int) -> "DateAtom":
+        end_year = year + self.end.year - self.start.year
+        if self.end == _month_end(self.end.year, self.end.month):
+            end = _month_end(end_year, self.end.month)
+        else:
+            end = self.end.replace(year=end_year)
+        return DateAtom(self.start.replace(year=year), end, True, self.needs_preposition)
+
+    @classmethod
+    def parse(cls, text: str, today: date) -> "DateAtom | None":
+        words = text.replace(" of ", " ").split()
+        if re.fullmatch(r"\d{4}-\d{1,2}-\d{1,2}", text):
+            try:
+                day = date(*map(int, text.split("-")))
+            except ValueError:
+                return None
+            return cls(day, day, True, False)
+        if text == "today":
+            return cls(today, today, True, False)
+        if text == "tomorrow":
+            day = today + timedelta(days=1)
+            return cls(day, day, True, False)
+        if words[0] in ("this", "next"):
+            return cls._relative(words[0], words[1], today)
+        if words[0] in SEASONS:
+            return cls._season(words[0], today, int(words[1]) if len(words) > 1 else None)
+        if re.fullmatch(YEAR_RE, text):
+            year = int(text)
+            return cls(date(year, 1, 1), date(year, 12, 31), True, True)
+
+        month, day, year = None, None, None
+        for word in words:
+            if word in MONTHS:
+                month = MONTHS[word]
+            elif re.fullmatch(YEAR_RE, word):
+                year = int(word)
+            else:
+                day = int(re.match(r"\d+", word).group(0))
+        if day is not None and day > calendar.monthrange(year or 2000, month)[1]:
+            return None
+        if year is None:
+            # the next occurrence
+            year = today.year
+            last = date(year, month, day) if day else _month_end(year, month)
+            if last < today:
+                year += 1
+        if day is not None:
+            return cls(date(year, month, day), date(year, month, day), len(words) > 2, False)
+        return cls(date(year, month, 1), _month_end(year, month), len(words) > 1, len(words) == 1)
+
+    @classmethod
+    def _relative(cls, which: str, unit: str, today: date) -> "DateAtom":
+        if unit == "week":
+            monday = today - timedelta(days=today.weekday())
+            if which == "next":
+                monday += timedelta(days=7)
+            return cls(max(monday, today), monday + timedelta(days=6), True, False)
+        if unit == "month":
+            if which == "this":
+                return cls(today, _month_end(today.year, today.month), True, False)
+            year, month = (today.year + 1, 1) if today.month == 12 else (today.year, today.month + 1)
+            return cls(date(year, month, 1), _month_end(year, month), True, False)
+        if unit == "year":
+            if which == "this":
+                return cls(today, date(today.year, 12, 31), True, False)
+            return cls(date(today.year + 1, 1, 1), date(today.year + 1, 12, 31), True, False)
+        return cls._season(unit, today, None)
+
+    @classmethod
+    def _season(cls, season: str, today: date, year: int | None) -> "DateAtom":
+        first_month = SEASONS[season]
+        start_year = year if year is not None else today.year
+        start = date(start_year, first_month, 1)
+        end_year, end_month = (start_year + 1, 2) if first_month == 12 else (start_year, first_month + 2)
+        end = _month_end(end_year, end_month)
+        if year is None and end < today:
+            return cls._season(season, today, start_year + 1)
+        return cls(max(start, today) if year is None else start, end, True, False)
+
+
+class SearchCriteriaParser:
+    """Rule-based extraction of CruiseSearchInfo from a search message: dates
+    and relative dates, durations, price bounds, round trip and discount
+    phrases and known place names. Only ports follow the embarkation and
+    disembarkation cues: "from Europe" or "ending in the Caribbean" are left
+    to the LLM.
+
+    parse() returns None unless the rules account for every word of the
+    message, in which case the LLM extraction is needed."""
+
+    def __init__(self, places, ports):
+        self.places = {}
+        for name in list(places) + REGIONS:
+            if name:
+                self.places.setdefault(normalize_place(name), name)
+        for alias, name in PLACE_ALIASES.items():
+            self.places.setdefault(alias, name)
+        self.places.pop("", None)
+        alternatives = "|".join(
+            re.escape(place) for place in sorted(self.places, key=len, reverse=True)
+        )
+        place_re = rf"(?:{alternatives})"
+        self.place = re.compile(rf"(?<![\w$€£]){place_re}(?![\w$€£])")
+        self.ports = {normalize_place(port): port for port in ports if port}
+        self.ports.pop("", None)
+        # without any port the pattern matches nothing and the cues go to the LLM
+        port_alternatives = "|".join(
+            re.escape(port) for port in sorted(self.ports, key=len, reverse=True)
+        )
+        port_re = rf"(?:{port_alternatives or '(?!)'})"
+        self.port = re.compile(rf"(?<![\w$€£]){port_re}(?![\w$€£])")
+
+        def cue_rule(cue, name_re):
+            names_re = rf"(?:the )?{name_re}(?:(?: and| or|) (?:the )?{name_re})*"
+            return re.compile(rf"(?<![\w$€£])(?:{cue}) ({names_re})(?![\w$€£])")
+
+        self.place_rules = [
+            (cue_rule(IGNORE_CUE, place_re), self.place, self.places, "ignore_destinations"),
+            (cue_rule(DISEMBARK_CUE, port_re), self.port, self.ports, "disembarkationPort"),
+            (cue_rule(EMBARK_CUE, port_re), self.port, self.ports, "embarkationPort"),
+        ]
+        # a port cue followed by a place that is not a port, e.g. "from Europe"
+        self.non_port_rules = [cue_rule(cue, place_re) for cue in (DISEMBARK_CUE, EMBARK_CUE)]
+
+    def parse(self, message: str, today: date | None = None) -> CruiseSearchInfo | None:
+        today = today or date.today()
+        tokens = _tokens(message)
+        text = " ".join(tokens)
+        claimed = [False] * len(text)
+        criteria = {}
+
+        def claim(start, end) -> bool:
+            if any(claimed[start:end]):
+                return False
+            claimed[start:end] = [True] * (end - start)
+            return True
+
+        def rule_matches(pattern):
+            for match in re.finditer(rf"(?<![\w$€£])(?:{pattern})(?![\w$€£])", text):
+                if not any(claimed[match.start() : match.end()]):
+                    yield match
+
+        for match in rule_matches(ROUND_TRIP_RE):
+            claim(*match.span())
+            criteria["round_trip"] = True
+        for match in rule_matches(DISCOUNT_RE):
+            claim(*match.span())
+            criteria["price_discount"] = True
+
+        for pattern, kind in DURATION_RULES:
+            for match in rule_matches(pattern):
+                *numbers, unit = match.groups()
+                days = [int(number) * UNIT_DAYS[unit] for number in numbers]
+                if kind == "range":
+                    criteria["minDuration"], criteria["maxDuration"] = days
+                elif kind == "exact":
+                    criteria["minDuration"] = criteria["maxDuration"] = days[0]
+                elif kind in ("min", "above"):
+                    criteria["minDuration"] = days[0] + (1 if kind == "above" else 0)
+                else:
+                    criteria["maxDuration"] = days[0] - (1 if kind == "below" else 0)
+                claim(*match.span())
+
+        self._parse_dates(text, today, criteria, claimed, claim)
+
+        for pattern, kind in PRICE_RULES:
+            for match in rule_matches(pattern):
+                amounts = match.groups()
+                # an amount without a currency must look like a price, not a count
+                if not all(
+                    re.search(r"[$€£a-z]", amount.replace("k", "", 1)) or _money(amount) >= 100
+                    for amount in amounts
+                ):
+                    continue
+                values = [_money(amount) for amount in amounts]
+                if kind == "range":
+                    criteria["minPrice"], criteria["maxPrice"] = values
+                elif kind == "max":
+                    criteria["maxPrice"] = values[0]
+                else:
+                    criteria["minPrice"] = values[0]
+                claim(*match.span())
+
+        for rule, name_pattern, names, field in self.place_rules:
+            for match in rule.finditer(text):
+                if claim(*match.span()):
+                    criteria.setdefault(field, []).extend(
+                        names[m.group(0)] for m in name_pattern.finditer(match.group(1))
+                    )
+        for rule in self.non_port_rules:
+            for match in rule.finditer(text):
+                if not any(claimed[match.start() : match.end()]):
+                    logger.debug(f"Search pre-parser: {match.group(1)!r} is not a port in: {message}")
+                    return None
+        for match in self.place.finditer(text):
+            before = text[: match.start()].split()
+            if match.group(0) in AMBIGUOUS_PLACES and (
+                not before or before[-1] not in PLACE_PREPOSITIONS
+            ):
+                continue
+            if claim(*match.span()):
+                criteria.setdefault("destinations", []).append(self.places[match.group(0)])
+
+        position = 0
+        for token in tokens:
+            start = text.index(token, position)
+            position = start + len(token)
+            if token not in FILLER and not all(claimed[start:position]):
+                logger.debug(f"Search pre-parser does not understand {token!r} in: {message}")
+                return None
+        if not criteria:
+            return None
+        return CruiseSearchInfo(**criteria)
+
+    def _parse_dates(self, text, today, criteria, claimed, claim):
+        atoms = []
+        for match in DATE_ATOM.finditer(text):
+            if any(claimed[match.start() : match.end()]):
+                continue
+            atom = DateAtom.parse(match.group(0), today)
+            if atom is not None:
+                atoms.append((match, atom))
+
+        i = 0
+        while i < len(atoms):
+            match, atom = atoms[i]
+            prefix = text[: match.start()]
+            end = match.end()
+            pair = None
+            if i + 1 < len(atoms) and DATE_RANGE_GAP.fullmatch(
+                text[match.end() : atoms[i + 1][0].start()]
+            ):
+                pair = atoms[i + 1]
+            if pair is not None and (
+                DATE_RANGE_PREFIX.search(prefix) or not atom.needs_preposition
+            ):
+                prefix_match = DATE_RANGE_PREFIX.search(prefix)
+                start = prefix_match.start() if prefix_match else match.start()
+                last_match, last = pair
+                first = atom
+                if last.has_year and not first.has_year:
+                    first = first.with_year(last.start.year)
+                    if first.start > last.end:
+                        first = first.with_year(last.start.year - 1)
+                while last.end < first.start and not last.has_year:
+                    last = last.with_year(last.start.year + 1)
+                field = self._date_field(text[:start])
+                if prefix_match and prefix_match.group(0).startswith("from") and first.is_day and last.is_day:
+                    # "sailing from June 5th to June 20th": the trip itself
+                    criteria["minSailStartDate"] = criteria["maxSailStartDate"] = first.start.isoformat()
+                    criteria["minSailEndDate"] = criteria["maxSailEndDate"] = last.end.isoformat()
+                else:
+                    criteria[f"min{field}"] = first.start.isoformat()
+                    criteria[f"max{field}"] = last.end.isoformat()
+                claim(start, last_match.end())
+                i += 2
+                continue
+
+            for prefix_re, kind in (
+                (DATE_MIN_PREFIX, "min"),
+                (DATE_FROM_PREFIX, "from"),
+                (DATE_MAX_PREFIX, "max"),
+                (DATE_IN_PREFIX, "in"),
+            ):
+                prefix_match = prefix_re.search(prefix)
+                if prefix_match:
+                    break
+            else:
+                kind = None if atom.needs_preposition else "in"
+            if kind is not None:
+                start = prefix_match.start() if prefix_match else match.start()
+                field = self._date_field(text[:start])
+                if kind == "from":
+                    criteria[f"min{field}"] = atom.start.isoformat()
+                elif kind == "min":
+                    first_day = atom.start if atom.is_day else atom.end + timedelta(days=1)
+                    criteria[f"min{field}"] = first_day.isoformat()
+                elif kind == "max":
+                    last_day = atom.start if atom.is_day else atom.start - timedelta(days=1)
+                    criteria[f"max{field}"] = last_day.isoformat()
+                else:
+                    criteria[f"min{field}"] = atom.start.isoformat()
+                    criteria[f"max{field}"] = atom.end.isoformat()
+                claim(start, end)
+            i += 1
+
+    @staticmethod
+    def _date_field(prefix: str) -> str:
+        """SailEndDate when the nearest verb before the date is about the end
+        of the cruise ("finishes before ..."), SailStartDate otherwise."""
+        for word in reversed(prefix.split()[-4:]):
+            if END_WORD.match(word):
+                return "SailEndDate"
+            if START_WORD.match(word):
+                break
+        return "SailStartDate"
+
+
+_parser: SearchCriteriaParser | None = None
+
+
+def catalogue_places(collection) -> tuple[list[str], list[str]]:
+    """The places and the ports of the catalogue, the arguments of SearchCriteriaParser."""
+    values = {field: collection.distinct(field) for field in PLACE_FIELDS}
+    return _places_and_ports(values)
+
+
+def _places_and_ports(values: dict) -> tuple[list[str], list[str]]:
+    places = [place for field in PLACE_FIELDS for place in values[field]]
+    ports = [port for field in PORT_FIELDS for port in values[field]]
+    return places, ports
+
+
+async def aget_search_parser(async_collection) -> SearchCriteriaParser:
+    """The parser over the places of the catalogue, loaded once per process;
+    places added later are not known and send their messages to the LLM."""
+    global _parser
+    if _parser is None:
+        values = {field: await async_collection.distinct(field) for field in PLACE_FIELDS}
+        _parser = SearchCriteriaParser(*_places_and_ports(values))
+        logger.info(f"Search pre-parser loaded {len(_parser.places)} places")
+    return _parser
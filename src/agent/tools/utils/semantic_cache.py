@@ -0,0 +1,111 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.messages import AnyMessage, HumanMessage
+
+from agent.tools.utils.embeddings import aembed
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# per call site switches, see the callers in agent_main.py and cruise_agent.py
+SEMANTIC_CACHE_ROUTER = os.getenv("SEMANTIC_CACHE_ROUTER", "true").lower() == "true"
+SEMANTIC_CACHE_NODE_ROUTER = (
+    os.getenv("SEMANTIC_CACHE_NODE_ROUTER", "true").lower() == "true"
+)
+SEMANTIC_CACHE_GENERAL = os.getenv("SEMANTIC_CACHE_GENERAL", "false").lower() == "true"
+# cosine similarity above which a cached result is reused
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+# entries per call site, the least recently used are evicted first
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "2000"))
+
+
+def stateless_text(messages: list[AnyMessage]) -> str | None:
+    """The user message when it is the whole conversation, e.g. the first turn.
+    With earlier turns the answer depends on them, so the call is not cached."""
+    if len(messages) == 1 and isinstance(messages[0], HumanMessage):
+        content = messages[0].content
+        return content.strip() if isinstance(content, str) else None
+    return None
+
+
+class SemanticCache:
+    """Reuses the result of an LLM call whose input text embeds close to the
+    input of a previous call, looked up in an in-memory FAISS index."""
+
+    def __init__(
+        self,
+        name: str,
+        enabled: bool = True,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        maxsize: int = SEMANTIC_CACHE_SIZE,
+    ):
+        self.name = name
+        self.enabled = enabled and maxsize > 0
+        self.threshold = threshold
+        self.maxsize = maxsize
+        # inner product of unit vectors is the cosine similarity
+        self.index: faiss.IndexIDMap2 | None = None
+        self.values: OrderedDict[int, object] = OrderedDict()
+        self.next_id = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, vector: np.ndarray):
+        with self.lock:
+            if self.index is not None and self.index.ntotal:
+                similarities, ids = self.index.search(vector, 1)
+                if similarities[0][0] >= self.threshold:
+                    entry_id = int(ids[0][0])
+                    self.values.move_to_end(entry_id)
+                    self.hits += 1
+                    return self.values[entry_id]
+            self.misses += 1
+            return None
+
+    def add(self, vector: np.ndarray, value):
+        with self.lock:
+            if self.index is None:
+                self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+            self.index.add_with_ids(vector, np.array([self.next_id], dtype=np.int64))
+            self.values[self.next_id] = value
+            self.next_id += 1
+            if len(self.values) > self.maxsize:
+                evicted_id, _ = self.values.popitem(last=False)
+                self.index.remove_ids(np.array([evicted_id], dtype=np.int64))
+                self.evictions += 1
+
+    async def acached(self, text: str | None, call):
+        """The cached result for `text`, or the result of awaiting `call()`,
+        which is then cached. Without text the call is never cached."""
+        if not self.enabled or not text:
+            return await call()
+        vector = await aembed([text])
+        value = self.lookup(vector)
+        if value is not None:
+            logger.info(f"Semantic cache {self.name} hit for: {text[:80]}")
+            return value
+        value = await call()
+        if value is not None:
+            self.add(vector, value)
+        return value
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self.values),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -1,65 +1,38 @@
-def enrich_cruise(cruise: dict, currency: str = "USD", country: str = "US"):
-    itinerary = []
-    for stop in cruise.get("itinerary", []):
-        itinerary_dict = {}
-        itinerary_dict["portName"] = stop.get("portName", "")
-        itinerary_dict["description"] = stop.get("description", "")
-        itinerary_dict["date"] = stop.get("date", "")
-        itinerary.append(itinerary_dict)
-
-    # get prices for each cruise
-    prices = []
+def iter_available_rates(
+    cruise: dict, currency: str = "USD", country: str = "US", suites: bool = True
+):
+    """Yield (suite, rate) for every bookable fare of the cruise in the given
+    currency and country: available P2P suiteRates, and with `suites` also the
+    available entries of the older flat "suites" price format (suite is rate)."""
     for price in cruise.get("prices", []):
-        if price.get("currency", "") != currency and (
+        if price.get("currency", "") != currency or (
             country not in price.get("countries", [])
         ):
             continue
-        if "suiteRates" in price.keys():
-            for suite_rate in price.get("suiteRates", []):
-                for rate in suite_rate.get("rates", []):
-                    price_dict = {}
-                    price_dict["price"] = rate.get("price", None)
-                    price_dict["suiteName"] = suite_rate.get("name", "")
-                    price_dict["suiteDescription"] = suite_rate.get("description", "")
-                    price_dict["originalPrice"] = rate.get("originalPrice", None)
-                    price_dict["status"] = rate.get("status", "")
-                    price_dict["fare"] = rate.get("fare", "")
-                    prices.append(price_dict)
-                # get available prices and sort by price
-                available_prices = [
-                    price
-                    for price in prices
-                    if (
-                        price["fare"] == "P2P"
-                        and price["status"] == "A"
-                        and price["price"] is not None
-                    )
-                ]
-                available_prices.sort(key=lambda x: x["price"])
+        for suite_rate in price.get("suiteRates", []):
+            for rate in suite_rate.get("rates", []):
+                if (
+                    rate.get("fare", "") == "P2P"
+                    and rate.get("status", "") == "A"
+                    and rate.get("price", None) is not None
+                ):
+                    yield suite_rate, rate
+        if suites:
+            for suite_price in price.get("suites", []):
+                if (
+                    suite_price.get("status", "") == "A"
+                    and suite_price.get("price", None) is not None
+                ):
+                    yield suite_price, suite_price
 
-        elif "suites" in price.keys():
-            if len(price.get("suites", [])) > 0:
-                for suite_price in price.get("suites", []):
-                    price_dict = {}
-                    price_dict["price"] = suite_price.get("price", None)
-                    price_dict["suiteName"] = suite_price.get("name", "")
-                    price_dict["suiteDescription"] = suite_price.get("description", "")
-                    price_dict["originalPrice"] = suite_price.get("originalPrice", None)
-                    price_dict["status"] = suite_price.get("status", "")
-                    prices.append(price_dict)
-                # get available prices and sort by price
-                available_prices = [
-                    price
-                    for price in prices
-                    if (price["status"] == "A" and price["price"] is not None)
-                ]
-                available_prices.sort(key=lambda x: x["price"])
-        else:
-            available_prices = []
-            break
 
-    # get cheapest suite
-    cheapest_suite = available_prices[0] if len(available_prices) > 0 else None
+def enrich_cruise(cruise: dict, currency: str = "USD", country: str = "US"):
+    # cheapest bookable fare, first one wins a tie
+    cheapest_suite, cheapest_rate = None, None
+    for suite, rate in iter_available_rates(cruise, currency, country):
+        if cheapest_rate is None or rate["price"] < cheapest_rate["price"]:
+            cheapest_suite, cheapest_rate = suite, rate
+
     image_url = cruise.get("imagesUrl", "")
     enriched_cruise = {
         "id": str(cruise["_id"]),
@@ -70,13 +43,15 @@ def enrich_cruise(cruise: dict, currency: str = "USD", country: str = "US"):
             [f"{stop.get('portName', '')}" for stop in cruise["itinerary"]]
         ),
         "duration": cruise.get("duration", ""),
-        "price": cheapest_suite["price"] if cheapest_suite else None,
-        "originalPrice": cheapest_suite["originalPrice"] if cheapest_suite else None,
+        "price": cheapest_rate["price"] if cheapest_rate else None,
+        "originalPrice": (
+            cheapest_rate.get("originalPrice", None) if cheapest_rate else None
+        ),
         "suiteName": (
-            cheapest_suite["suiteName"] if cheapest_suite else "Standard Suite"
+            cheapest_suite.get("name", "") if cheapest_suite else "Standard Suite"
         ),
         "suiteDescription": (
-            cheapest_suite["suiteDescription"] if cheapest_suite else None
+            cheapest_suite.get("description", "") if cheapest_suite else None
         ),
         "image": (
             image_url[0]
@@ -100,6 +75,7 @@ from langchain_core.tools import BaseTool
 from langchain_openai import ChatOpenAI
 from typing import Literal, TypedDict
 from langchain_core.language_models.chat_models import BaseChatModel
+from agent.tools.utils.history import window_messages
 
 
 def wrap_model(
@@ -107,9 +83,11 @@ def wrap_model(
     system_prompt: str = "",
     structured_output: TypedDict = None,
     tools: list[BaseTool] = [],
+    history_turns: int = 4,
 ) -> BaseChatModel:
     preprocessor = RunnableLambda(
-        lambda state: [SystemMessage(content=system_prompt)] + state.messages,
+        lambda state: [SystemMessage(content=system_prompt)]
+        + window_messages(state, history_turns),
         name="StateModifier",
     )
     if tools:
@@ -7,20 +7,27 @@ import json
 import logging
 import os
 import sys
+import time
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from pydantic import BaseModel
 from typing import Optional, Dict, Any, List
-import openai
-
-# import HumanMessage and RunnableConfig
-from langchain_core.messages import HumanMessage
-from langgraph.types import Command
-from langchain_core.runnables import RunnableConfig
 
+from readiness import Readiness
+from metrics import (
+    CHECKPOINT_BYTES,
+    HTTP_REQUEST_SECONDS,
+    MONGO_POOL_WAIT_SECONDS,
+    cache_collector,
+    sessions_in_flight,
+)
 
-from agent.agent_main import agent_main
+# The agent stack (LangChain, LangGraph, OpenAI, the MongoDB clients) is not
+# imported here: warm_up loads and builds it in the background once the app
+# has started, so the process answers /health within the FastAPI import time.
 
 # Configure logging
 logging.basicConfig(
@@ -28,6 +35,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# channel under which langgraph reports interrupts in checkpoints and streams
+INTERRUPT = "__interrupt__"
+# nodes whose LLM reply tokens are forwarded by /api/chat/stream
+STREAMED_NODES = {"general_node", "cruise_assistant", "cruise_search"}
+# keys of the custom stream chunks written by the nodes -> SSE event names
+CARD_EVENTS = {"list_cruises": "cruises", "list_cabins": "cabins"}
 
 # Validate OpenAI API key
 api_key = os.getenv("OPENAI_API_KEY")
@@ -35,13 +48,12 @@ if not api_key:
     logger.error("OPENAI_API_KEY environment variable is not set")
     sys.exit(1)
 
-try:
-    # Initialize OpenAI client
-    openai.api_key = api_key
-    logger.info("OpenAI client initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize OpenAI client: {e}")
-    sys.exit(1)
+# the task loading the agent, started by lifespan
+agent_ready: asyncio.Task | None = None
+# dependency checks behind /readyz, refreshed in the background
+readiness = Readiness()
+# a model list lookup is free, unlike a completion
+READINESS_LLM_MODEL = os.getenv("READINESS_LLM_MODEL", "gpt-4o-mini")
 
 
 # Request/Response models
@@ -60,17 +72,140 @@ class ChatResponse(BaseModel):
     cruise: Optional[Dict[str, Any]] = None
 
 
+def load_agent():
+    """Import the agent modules and build what the first chat turn needs: the
+    graph, its models and the DB tool. Runs in a thread during startup."""
+    from agent.agent_main import general_cache, get_agent_main, router_cache
+    from agent.agent_members.cruise_agent import (
+        get_db_tool,
+        node_router_cache,
+        payment_cache,
+    )
+    from agent.retrieval.brochures import BROCHURE_RETRIEVAL, brochure_index
+    from agent.routing.fast_router import fast_router
+    from agent.tools.db.client import pool_wait
+
+    agent = get_agent_main()
+    db_tool = get_db_tool()
+    register_metrics(
+        db_tool,
+        [router_cache, general_cache, node_router_cache, payment_cache],
+        fast_router,
+        pool_wait,
+    )
+    if BROCHURE_RETRIEVAL and not brochure_index.load():
+        logger.warning("No brochure index, general answers are not grounded")
+    return agent
+
+
+def register_metrics(db_tool, caches, fast_router, pool_wait):
+    """Export the stats the agent modules keep on /metrics."""
+
+    def fast_router_stats():
+        # a decision made without the LLM router is a hit
+        stats = fast_router.stats()
+        misses = stats.get("llm", 0)
+        return [{"name": "fast_router", "hits": stats["total"] - misses, "misses": misses}]
+
+    cache_collector.add_source(db_tool.cache_stats)
+    cache_collector.add_source(lambda: [cache.stats() for cache in caches])
+    cache_collector.add_source(fast_router_stats)
+    pool_wait.observers.append(MONGO_POOL_WAIT_SECONDS.observe)
+
+
+async def warm_up():
+    started = time.perf_counter()
+    agent = await asyncio.to_thread(load_agent)
+    if os.getenv("ENSURE_INDEXES", "false").lower() == "true":
+        from agent.agent_members.cruise_agent import get_db_tool
+        from agent.tools.db.indexes import aensure_indexes
+
+        try:
+            await aensure_indexes(get_db_tool().async_db)
+        except Exception as e:
+            logger.error(f"Failed to ensure indexes: {e}")
+    logger.info(f"Agent ready in {time.perf_counter() - started:.2f}s")
+    return agent
+
+
+async def get_agent():
+    """The main graph, once the startup warmup has built it."""
+    global agent_ready
+    if agent_ready is None:
+        # the app is served without its lifespan, e.g. by a test client
+        agent_ready = asyncio.create_task(warm_up())
+    return await asyncio.shield(agent_ready)
+
+
+async def check_readiness():
+    """Register the dependency checks once the agent is loaded, then keep
+    their results fresh."""
+    from openai import AsyncOpenAI
+    from agent.agent_members.cruise_agent import get_db_tool
+
+    try:
+        agent = await get_agent()
+    except Exception as e:
+        logger.error(f"Failed to load the agent: {e}")
+        return
+    db_tool = get_db_tool()
+    openai_client = await asyncio.to_thread(AsyncOpenAI)
+
+    async def mongodb():
+        await db_tool.async_client.admin.command("ping")
+
+    async def checkpointer():
+        await agent.checkpointer.aget_tuple(
+            {"configurable": {"thread_id": "readiness-check", "checkpoint_ns": ""}}
+        )
+
+    async def llm():
+        await openai_client.models.retrieve(READINESS_LLM_MODEL)
+
+    readiness.add_check("mongodb", mongodb)
+    readiness.add_check("checkpointer", checkpointer)
+    readiness.add_check("llm", llm)
+    await readiness.run()
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global agent_ready
     # Startup
     logger.info("Starting up FastAPI server...")
+    agent_ready = asyncio.create_task(warm_up())
+    readiness_task = asyncio.create_task(check_readiness())
     yield
     # Shutdown
     logger.info("Shutting down FastAPI server...")
+    readiness_task.cancel()
+    if agent_ready.done() and agent_ready.exception() is None:
+        from agent.agent_members.cruise_agent import get_db_tool
+
+        # write the chat history messages still queued
+        await asyncio.to_thread(get_db_tool().history_writer.close)
+    else:
+        agent_ready.cancel()
 
 
 app = FastAPI(lifespan=lifespan)
 
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """Latency per route template; for streamed responses this is the time
+    to the response headers, the token stream is not included."""
+    started, status = time.perf_counter(), 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.labels(
+            request.method, route.path if route else "unmatched", str(status)
+        ).observe(time.perf_counter() - started)
+
 # Enable CORS
 app.add_middleware(
     CORSMiddleware,
@@ -81,35 +216,197 @@ app.add_middleware(
 )
 
 
-def chat_response(user_input: dict, config: dict, agent):
-    snapshot = agent.get_state(config, subgraphs=True)
-    if snapshot.next:
+def has_pending_interrupt(checkpoint_tuple) -> bool:
+    """Check whether the thread is paused at an `interrupt()`.
+
+    Looks at the latest parent checkpoint tuple only; an interrupt raised inside the
+    cruise subgraph is recorded as a pending write on the parent checkpoint, so
+    there is no need to build a full state snapshot with subgraphs.
+    """
+    if checkpoint_tuple is None:
+        return False
+    return any(
+        channel == INTERRUPT for _, channel, _ in checkpoint_tuple.pending_writes or []
+    )
+
+
+async def rehydrated_input(user_input: dict, config: dict) -> dict:
+    """`user_input` preceded by the stored conversation of a session whose
+    thread has no checkpoint here, e.g. after a restart or on another worker."""
+    from agent.agent_members.cruise_agent import get_db_tool
+    from agent.tools.utils.history import HISTORY_REHYDRATE_TURNS, rehydrate_history
+
+    db_tool = get_db_tool()
+    session_id = config["configurable"]["thread_id"]
+    try:
+        # two messages per turn, rehydrate_history cuts at turn boundaries. No
+        # flush: without a checkpoint here, this process queued nothing for the
+        # session, so a new session only costs the read
+        history = await db_tool.aget_history(
+            session_id, skip=-2 * HISTORY_REHYDRATE_TURNS, flush=False
+        )
+    except Exception as e:
+        logger.error(f"Failed to read the chat history of {session_id}: {e}")
+        return user_input
+    seed = await rehydrate_history(history, user_input["messages"][-1].content)
+    if not seed:
+        return user_input
+    logger.info(f"Rehydrated session {session_id} with {len(seed['messages'])} messages")
+    return {**user_input, **seed, "messages": seed["messages"] + user_input["messages"]}
+
+
+async def stream_chat(user_input: dict, config: dict, agent, stream_tokens=False):
+    """Run one chat turn and yield `(event, data)` pairs as the graph progresses.
+
+    With `stream_tokens` the reply tokens of `STREAMED_NODES` are yielded as
+    "token" events and the cruise/cabin cards pushed by the nodes as "cruises" and
+    "cabins" events. The last pair is always `("result", (ai_message, state))`.
+    """
+    from langgraph.types import Command
+    from agent.tools.utils.history import HISTORY_REHYDRATE
+
+    checkpoint_tuple = await agent.checkpointer.aget_tuple(config)
+    if has_pending_interrupt(checkpoint_tuple):
         value_from_human = user_input["messages"][-1].content
-        messages = agent.invoke(Command(resume=value_from_human), config=config)
+        graph_input = Command(resume=value_from_human)
+    elif checkpoint_tuple is None and HISTORY_REHYDRATE:
+        graph_input = await rehydrated_input(user_input, config)
+    else:
+        graph_input = user_input
+
+    stream_mode = ["values", "updates"]
+    if stream_tokens:
+        stream_mode += ["messages", "custom"]
+
+    thread_id = config["configurable"]["thread_id"]
+    sessions_in_flight.start(thread_id)
+    try:
+        # the last "values" chunk is the state of whichever graph ran last, i.e. the
+        # cruise subgraph when it stopped at an interrupt, the parent graph otherwise
+        state, interrupt_value = {}, None
+        async for _, mode, chunk in agent.astream(
+            graph_input,
+            config=config,
+            stream_mode=stream_mode,
+            subgraphs=True,
+        ):
+            if mode == "messages":
+                message_chunk, metadata = chunk
+                if (
+                    metadata.get("langgraph_node") in STREAMED_NODES
+                    and isinstance(message_chunk.content, str)
+                    and message_chunk.content
+                ):
+                    yield "token", message_chunk.content
+            elif mode == "custom":
+                for key, event in CARD_EVENTS.items():
+                    if key in chunk:
+                        yield event, chunk[key]
+            elif isinstance(chunk, dict) and INTERRUPT in chunk:
+                interrupt_value = chunk[INTERRUPT][0].value
+            elif mode == "values":
+                state = chunk
+
+        if hasattr(agent.checkpointer, "take_bytes_written"):
+            bytes_written = agent.checkpointer.take_bytes_written(thread_id)
+            CHECKPOINT_BYTES.observe(bytes_written)
+            logger.info(f"Checkpoint bytes written this turn: {bytes_written}")
+    finally:
+        sessions_in_flight.end(thread_id)
+
+    if interrupt_value is not None:
+        yield "result", (interrupt_value, state)
     else:
-        messages = agent.invoke(input=user_input, config=config)
+        yield "result", (state["messages"][-1].content, state)
+
+
+async def chat_response(user_input: dict, config: dict, agent):
+    async for event, data in stream_chat(user_input, config, agent):
+        if event == "result":
+            return data
+
+
+def build_chat_input(request: ChatRequest, session_id: str) -> dict:
+    from langchain_core.messages import HumanMessage
+    from langchain_core.runnables import RunnableConfig
+    from agent.tools.utils.metrics_callback import graph_metrics
+
+    user_id = request.userId
+    # run_id = session_id
+    configurable = {"thread_id": session_id, "user_id": user_id}
+    return {
+        "user_input": {
+            "messages": [HumanMessage(content=request.message)],
+            "cruises": [],
+            # "chat_history": chat_history,
+            "currency": request.currency,
+            "country": request.country,
+            "current_cruise_id": request.currentCruiseId,
+            "current_cabin": request.description,
+            "action": "",
+        },
+        "config": RunnableConfig(
+            configurable=configurable,
+            callbacks=[graph_metrics],
+            # run_id=run_id,
+        ),
+    }
+
+
+def build_chat_output(
+    request: ChatRequest, session_id: str, ai_message: str, state: dict
+) -> dict:
+    output_dict = {
+        "message": ai_message,
+        "cruises": state.get("list_cruises", []),
+        "sessionId": str(session_id),
+        "currency": request.currency,
+        "country": request.country,
+        "currentCruiseId": state.get("current_cruise_id", ""),
+        "description": state.get("current_cabin", ""),
+    }
+    if "action" in state.keys():
+        output_dict["action"] = state["action"]
+    if "list_cabins" in state.keys():
+        output_dict["cabins"] = state["list_cabins"]
+    return output_dict
 
-    snapshot = agent.get_state(config, subgraphs=True)
-    if snapshot.next:
-        ai_message = snapshot.tasks[0].interrupts[0].value
-        return ai_message, snapshot.tasks[0].state.values
-    return messages["messages"][-1].content, snapshot.values
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint, see metrics.py."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/livez")
+async def liveness():
+    """The process serves requests; nothing external is touched."""
+    return {"status": "alive"}
+
+
+@app.get("/readyz")
+async def readiness_check():
+    """MongoDB, checkpointer and LLM reachability as last checked in the
+    background, 503 until the agent is loaded or when a check failed or is
+    older than READINESS_MAX_STALENESS_SECONDS."""
+    ready, report = readiness.status()
+    return JSONResponse(report, status_code=200 if ready else 503)
 
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint to verify server status"""
-    try:
-        # Verify OpenAI connectivity
-        await openai.chat.completions.create(
-            model="gpt-4", messages=[{"role": "user", "content": "test"}], max_tokens=5
-        )
-        return {"status": "healthy", "openai": "connected"}
-    except Exception as e:
-        logger.error(f"Health check failed: {e}")
+    """Health check endpoint to verify server status, from the cached readiness checks"""
+    ready, report = readiness.status()
+    if not ready:
+        logger.error(f"Health check failed: {report}")
         raise HTTPException(
-            status_code=503, detail="Service unhealthy: OpenAI connection failed"
+            status_code=503, detail=f"Service unhealthy: {report['status']}"
         )
+    return {"status": "healthy", "openai": "connected"}
 
 
 @app.post("/api/chat")
@@ -119,40 +416,10 @@ async def chat(request: ChatRequest):
         logger.info(f"Processing chat request: {request}")
         session_id = request.sessionId
         session_id = session_id.replace('"', "")
-        user_id = request.userId
-        # run_id = session_id
-        configurable = {"thread_id": session_id, "user_id": user_id}
-        kwargs = {
-            "user_input": {
-                "messages": [HumanMessage(content=request.message)],
-                "cruises": [],
-                # "chat_history": chat_history,
-                "currency": request.currency,
-                "country": request.country,
-                "current_cruise_id": request.currentCruiseId,
-                "current_cabin": request.description,
-                "action": "",
-            },
-            "config": RunnableConfig(
-                configurable=configurable,
-                # run_id=run_id,
-            ),
-        }
-        ai_message, state = chat_response(**kwargs, agent=agent_main)
-
-        output_dict = {
-            "message": ai_message,
-            "cruises": state.get("list_cruises", []),
-            "sessionId": str(session_id),
-            "currency": request.currency,
-            "country": request.country,
-            "currentCruiseId": state.get("current_cruise_id", ""),
-            "description": state.get("current_cabin", ""),
-        }
-        if "action" in state.keys():
-            output_dict["action"] = state["action"]
-        if "list_cabins" in state.keys():
-            output_dict["cabins"] = state["list_cabins"]
+        kwargs = build_chat_input(request, session_id)
+        ai_message, state = await chat_response(**kwargs, agent=await get_agent())
+
+        output_dict = build_chat_output(request, session_id, ai_message, state)
         logger.info(f"Output dictionary: {output_dict}")
         return output_dict
 
@@ -162,6 +429,45 @@ async def chat(request: ChatRequest):
         raise HTTPException(status_code=500, detail="Failed to process chat request")
 
 
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Server-sent-events version of /api/chat.
+
+    Emits "token" events with reply tokens as the model produces them, "cruises"
+    and "cabins" events as soon as the cards are fetched, and a final "done"
+    event carrying the same payload /api/chat returns.
+    """
+    logger.info(f"Processing chat stream request: {request}")
+    session_id = request.sessionId
+    session_id = session_id.replace('"', "")
+    kwargs = build_chat_input(request, session_id)
+
+    async def event_stream():
+        try:
+            agent = await get_agent()
+            async for event, data in stream_chat(
+                **kwargs, agent=agent, stream_tokens=True
+            ):
+                if event == "result":
+                    ai_message, state = data
+                    output_dict = build_chat_output(
+                        request, session_id, ai_message, state
+                    )
+                    logger.info(f"Output dictionary: {output_dict}")
+                    yield sse_event("done", output_dict)
+                else:
+                    yield sse_event(event, data)
+        except Exception as e:
+            logger.error(f"Error in chat stream endpoint: {str(e)}")
+            yield sse_event("error", {"detail": "Failed to process chat request"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,149 @@
+import time
+import inspect
+import functools
+import threading
+
+from prometheus_client import Gauge, Histogram
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily, REGISTRY
+
+# Prometheus metrics of the server, scraped from /metrics. Kept free of the
+# agent imports so agent_server can load it at startup.
+
+# seconds, from sub-millisecond cache hits to slow LLM calls
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60
+)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+NODE_SECONDS = Histogram(
+    "graph_node_duration_seconds",
+    "LangGraph node latency, nested LLM and DB calls included",
+    ["node", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_SECONDS = Histogram(
+    "llm_call_duration_seconds",
+    "Chat model call latency by calling node and model",
+    ["call_site", "model", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_SECONDS = Histogram(
+    "db_operation_duration_seconds",
+    "DBTool method latency",
+    ["method", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+MONGO_POOL_WAIT_SECONDS = Histogram(
+    "mongodb_pool_wait_seconds",
+    "Time waiting to check a connection out of the MongoDB pool",
+    buckets=LATENCY_BUCKETS,
+)
+SESSIONS_IN_FLIGHT = Gauge(
+    "chat_sessions_in_flight", "Sessions with a chat turn being processed"
+)
+CHECKPOINT_BYTES = Histogram(
+    "checkpoint_bytes_per_turn",
+    "Checkpoint bytes written by one chat turn",
+    buckets=(1e3, 4e3, 16e3, 64e3, 256e3, 1e6, 4e6),
+)
+
+
+def db_timed(method):
+    """Record the latency of a DBTool method, sync or async, under its name."""
+    if inspect.iscoroutinefunction(method):
+
+        @functools.wraps(method)
+        async def timed(*args, **kwargs):
+            started, outcome = time.perf_counter(), "error"
+            try:
+                result = await method(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                DB_SECONDS.labels(method.__name__, outcome).observe(
+                    time.perf_counter() - started
+                )
+
+        return timed
+
+    @functools.wraps(method)
+    def timed(*args, **kwargs):
+        started, outcome = time.perf_counter(), "error"
+        try:
+            result = method(*args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            DB_SECONDS.labels(method.__name__, outcome).observe(
+                time.perf_counter() - started
+            )
+
+    return timed
+
+
+class SessionsInFlight:
+    """Counts sessions, not requests: two turns of one session count once."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.turns: dict[str, int] = {}
+
+    def start(self, session_id: str):
+        with self.lock:
+            self.turns[session_id] = self.turns.get(session_id, 0) + 1
+            SESSIONS_IN_FLIGHT.set(len(self.turns))
+
+    def end(self, session_id: str):
+        with self.lock:
+            if self.turns.get(session_id, 0) <= 1:
+                self.turns.pop(session_id, None)
+            else:
+                self.turns[session_id] -= 1
+            SESSIONS_IN_FLIGHT.set(len(self.turns))
+
+
+sessions_in_flight = SessionsInFlight()
+
+
+class CacheCollector:
+    """Exports the stats() of the registered caches (TTLCache, SemanticCache,
+    the fast router as a cache of routing decisions) when scraped, so the
+    caches keep no Prometheus code."""
+
+    def __init__(self):
+        self.sources = []
+
+    def add_source(self, stats):
+        """`stats` returns a list of cache stats dicts with name, size, hits,
+        misses and evictions."""
+        self.sources.append(stats)
+
+    def collect(self):
+        hits = CounterMetricFamily("cache_hits", "Cache hits", labels=["cache"])
+        misses = CounterMetricFamily("cache_misses", "Cache misses", labels=["cache"])
+        evictions = CounterMetricFamily(
+            "cache_evictions", "Cache evictions", labels=["cache"]
+        )
+        size = GaugeMetricFamily("cache_entries", "Cached entries", labels=["cache"])
+        hit_ratio = GaugeMetricFamily(
+            "cache_hit_ratio", "Hits over lookups since start", labels=["cache"]
+        )
+        for source in self.sources:
+            for stats in source():
+                name = stats["name"]
+                hits.add_metric([name], stats["hits"])
+                misses.add_metric([name], stats["misses"])
+                evictions.add_metric([name], stats.get("evictions", 0))
+                size.add_metric([name], stats.get("size", 0))
+                lookups = stats["hits"] + stats["misses"]
+                hit_ratio.add_metric([name], stats["hits"] / lookups if lookups else 0.0)
+        return [hits, misses, evictions, size, hit_ratio]
+
+
+cache_collector = CacheCollector()
+REGISTRY.register(cache_collector)
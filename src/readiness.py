@@ -0,0 +1,78 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# how often the dependencies are checked in the background
+READINESS_REFRESH_SECONDS = float(os.getenv("READINESS_REFRESH_SECONDS", "15"))
+# a check taking longer than this fails
+READINESS_CHECK_TIMEOUT_SECONDS = float(os.getenv("READINESS_CHECK_TIMEOUT_SECONDS", "3"))
+# results older than this no longer count, /readyz reports not ready
+READINESS_MAX_STALENESS_SECONDS = float(os.getenv("READINESS_MAX_STALENESS_SECONDS", "60"))
+
+
+class Readiness:
+    """Results of the dependency checks, refreshed by a background task so a
+    probe only reads them. Each check is an async callable that raises when
+    the dependency is unusable."""
+
+    def __init__(
+        self,
+        refresh_seconds: float = READINESS_REFRESH_SECONDS,
+        timeout_seconds: float = READINESS_CHECK_TIMEOUT_SECONDS,
+        max_staleness_seconds: float = READINESS_MAX_STALENESS_SECONDS,
+    ):
+        self.refresh_seconds = refresh_seconds
+        self.timeout_seconds = timeout_seconds
+        self.max_staleness_seconds = max_staleness_seconds
+        self.checks = {}
+        self.results: dict[str, dict] = {}
+        self.refreshed_at: float | None = None
+
+    def add_check(self, name: str, check):
+        self.checks[name] = check
+
+    async def _run_check(self, name, check) -> dict:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(check(), self.timeout_seconds)
+            error = None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            logger.warning(f"Readiness check {name} failed: {error}")
+        return {
+            "ok": error is None,
+            "error": error,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            "checked_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+    async def refresh(self):
+        names = list(self.checks)
+        results = await asyncio.gather(
+            *(self._run_check(name, self.checks[name]) for name in names)
+        )
+        self.results = dict(zip(names, results))
+        self.refreshed_at = time.monotonic()
+
+    async def run(self):
+        """Refresh forever, as a background task."""
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_seconds)
+
+    def status(self) -> tuple[bool, dict]:
+        """(ready, report) from the last refresh, without checking anything."""
+        if self.refreshed_at is None:
+            return False, {"status": "starting", "checks": {}}
+        age = time.monotonic() - self.refreshed_at
+        stale = age > self.max_staleness_seconds
+        ready = not stale and all(result["ok"] for result in self.results.values())
+        return ready, {
+            "status": "ready" if ready else ("stale" if stale else "not ready"),
+            "age_seconds": round(age, 1),
+            "checks": self.results,
+        }
@@ -0,0 +1,82 @@
+"""Parity check of the columnar search backend against the MongoDB search.
+
+Pages through every result of each query shape with both backends and reports
+the shapes whose totals, order or cards differ. Price ranges only agree with
+CRUISE_SUMMARIES=true, since both filter on the cheapest available fare.
+    python tests/columnar_parity.py [number_of_random_queries]
+"""
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from agent.tools.db.db import DBTool
+from agent.tools.db.indexes import QUERY_SHAPES
+
+MARKETS = [("USD", "US"), ("EUR", "FR"), ("GBP", "GB"), ("AUD", "AU")]
+
+
+def all_pages(search, preferences, currency, country, page_size=25):
+    cruises, cursor, total, seconds = [], None, None, 0.0
+    while True:
+        start = time.perf_counter()
+        page = search(dict(preferences), currency, country, page_size, cursor)
+        seconds += time.perf_counter() - start
+        total = page["total"] if total is None else total
+        cruises += page["cruises"]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return total, cruises, seconds
+
+
+def random_preferences(rng: random.Random, ports: list[str]) -> dict:
+    preferences = {}
+    if rng.random() < 0.5:
+        preferences["destinations"] = rng.sample(ports, 1)
+    if rng.random() < 0.3:
+        preferences["minDuration"] = rng.randint(3, 10)
+    if rng.random() < 0.3:
+        preferences["maxDuration"] = rng.randint(7, 30)
+    if rng.random() < 0.2:
+        preferences["round_trip"] = True
+    if rng.random() < 0.2:
+        preferences["maxPrice"] = rng.choice([3000, 6000, 12000])
+    return preferences
+
+
+if __name__ == "__main__":
+    random_queries = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    db_tool = DBTool()
+    columns = db_tool.columnar.rebuild()
+    rng = random.Random(0)
+    shapes = dict(QUERY_SHAPES)
+    ports = [port for port in columns.meta["ports"] if port]
+    for i in range(random_queries):
+        shapes[f"random_{i}"] = random_preferences(rng, ports)
+
+    failures, mongo_seconds, columnar_seconds = 0, 0.0, 0.0
+    for name, preferences in shapes.items():
+        for currency, country in MARKETS:
+            mongo = all_pages(db_tool.get_cruises, preferences, currency, country)
+            columnar = all_pages(db_tool.columnar.search, preferences, currency, country)
+            mongo_seconds += mongo[2]
+            columnar_seconds += columnar[2]
+            mongo_ids = [cruise["id"] for cruise in mongo[1]]
+            columnar_ids = [cruise["id"] for cruise in columnar[1]]
+            if mongo[0] != columnar[0] or mongo_ids != columnar_ids:
+                failures += 1
+                print(
+                    f"MISMATCH {name} {currency}/{country}: totals {mongo[0]} vs {columnar[0]},"
+                    f" only in mongo {sorted(set(mongo_ids) - set(columnar_ids))[:5]},"
+                    f" only in columnar {sorted(set(columnar_ids) - set(mongo_ids))[:5]}"
+                )
+            elif [c["price"] for c in mongo[1]] != [c["price"] for c in columnar[1]]:
+                failures += 1
+                print(f"MISMATCH {name} {currency}/{country}: card prices differ")
+
+    checks = len(shapes) * len(MARKETS)
+    print(f"{checks - failures}/{checks} query shapes match")
+    print(f"mongo {mongo_seconds * 1000:.0f} ms, columnar {columnar_seconds * 1000:.0f} ms")
+    sys.exit(1 if failures else 0)
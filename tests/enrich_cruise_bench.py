@@ -0,0 +1,176 @@
+"""Microbenchmark of enrich_cruise against the implementation it replaced.
+
+Synthetic cruises with many currencies, countries and suites; run with
+    python tests/enrich_cruise_bench.py [number_of_cruises]
+"""
+
+import os
+import sys
+import random
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from bson import ObjectId
+
+from agent.tools.utils.utils import enrich_cruise
+
+CURRENCIES = ["USD", "EUR", "GBP", "AUD", "CAD", "CHF", "JPY", "SGD"]
+COUNTRIES = ["US", "FR", "DE", "GB", "AU", "CA", "CH", "JP", "SG", "IT"]
+SUITES_PER_PRICE = 20
+RATES_PER_SUITE = 4
+
+
+# copied from agent/tools/utils/utils.py before the single-pass rewrite
+def legacy_enrich_cruise(cruise: dict, currency: str = "USD", country: str = "US"):
+    itinerary = []
+    for stop in cruise.get("itinerary", []):
+        itinerary_dict = {}
+        itinerary_dict["portName"] = stop.get("portName", "")
+        itinerary_dict["description"] = stop.get("description", "")
+        itinerary_dict["date"] = stop.get("date", "")
+        itinerary.append(itinerary_dict)
+
+    # get prices for each cruise
+    prices = []
+    for price in cruise.get("prices", []):
+        if price.get("currency", "") != currency and (
+            country not in price.get("countries", [])
+        ):
+            continue
+        if "suiteRates" in price.keys():
+            for suite_rate in price.get("suiteRates", []):
+                for rate in suite_rate.get("rates", []):
+                    price_dict = {}
+                    price_dict["price"] = rate.get("price", None)
+                    price_dict["suiteName"] = suite_rate.get("name", "")
+                    price_dict["suiteDescription"] = suite_rate.get("description", "")
+                    price_dict["originalPrice"] = rate.get("originalPrice", None)
+                    price_dict["status"] = rate.get("status", "")
+                    price_dict["fare"] = rate.get("fare", "")
+                    prices.append(price_dict)
+                # get available prices and sort by price
+                available_prices = [
+                    price
+                    for price in prices
+                    if (
+                        price["fare"] == "P2P"
+                        and price["status"] == "A"
+                        and price["price"] is not None
+                    )
+                ]
+                available_prices.sort(key=lambda x: x["price"])
+
+        elif "suites" in price.keys():
+            if len(price.get("suites", [])) > 0:
+                for suite_price in price.get("suites", []):
+                    price_dict = {}
+                    price_dict["price"] = suite_price.get("price", None)
+                    price_dict["suiteName"] = suite_price.get("name", "")
+                    price_dict["suiteDescription"] = suite_price.get("description", "")
+                    price_dict["originalPrice"] = suite_price.get("originalPrice", None)
+                    price_dict["status"] = suite_price.get("status", "")
+                    prices.append(price_dict)
+                # get available prices and sort by price
+                available_prices = [
+                    price
+                    for price in prices
+                    if (price["status"] == "A" and price["price"] is not None)
+                ]
+                available_prices.sort(key=lambda x: x["price"])
+        else:
+            available_prices = []
+            break
+
+    # get cheapest suite
+    cheapest_suite = available_prices[0] if len(available_prices) > 0 else None
+    image_url = cruise.get("imagesUrl", "")
+    enriched_cruise = {
+        "id": str(cruise["_id"]),
+        "name": cruise.get("title", ""),
+        "destination": cruise.get("destination", ""),
+        # "itinerary": " → ".join([f"{stop.get('portName', '')} - {stop.get('description', '')}" for stop in cruise["itinerary"]]),
+        "itinerary": " → ".join(
+            [f"{stop.get('portName', '')}" for stop in cruise["itinerary"]]
+        ),
+        "duration": cruise.get("duration", ""),
+        "price": cheapest_suite["price"] if cheapest_suite else None,
+        "originalPrice": cheapest_suite["originalPrice"] if cheapest_suite else None,
+        "suiteName": (
+            cheapest_suite["suiteName"] if cheapest_suite else "Standard Suite"
+        ),
+        "suiteDescription": (
+            cheapest_suite["suiteDescription"] if cheapest_suite else None
+        ),
+        "image": (
+            image_url[0]
+            if isinstance(image_url, list) and len(image_url) > 0
+            else image_url
+        ),
+        "departureDate": cruise.get("sailStartDate", ""),
+        "returnDate": cruise.get("sailEndDate", ""),
+        "shipName": cruise.get("shipName", ""),
+        "embarkationPort": cruise.get("embarkationPortName", ""),
+        "disembarkationPort": cruise.get("disembarkationPortName", ""),
+        "mapUrl": cruise.get("mapUrl", ""),
+    }
+    return enriched_cruise
+
+
+def synthetic_cruise(rng: random.Random) -> dict:
+    prices = []
+    for currency in CURRENCIES:
+        prices.append(
+            {
+                "currency": currency,
+                "countries": rng.sample(COUNTRIES, 3),
+                "suiteRates": [
+                    {
+                        "name": f"Suite {suite}",
+                        "description": f"Suite {suite} description",
+                        "rates": [
+                            {
+                                "fare": rng.choice(["P2P", "P2P", "CRUISE_ONLY"]),
+                                "status": rng.choice(["A", "A", "W"]),
+                                "price": rng.randint(2000, 40000),
+                                "originalPrice": 45000,
+                            }
+                            for _ in range(RATES_PER_SUITE)
+                        ],
+                    }
+                    for suite in range(SUITES_PER_PRICE)
+                ],
+            }
+        )
+    return {
+        "_id": ObjectId(),
+        "title": "Synthetic cruise",
+        "itinerary": [{"portName": f"Port {i}", "description": "x" * 200} for i in range(12)],
+        "prices": prices,
+    }
+
+
+if __name__ == "__main__":
+    number_of_cruises = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rng = random.Random(0)
+    cruises = [synthetic_cruise(rng) for _ in range(number_of_cruises)]
+    markets = [("USD", "US"), ("EUR", "FR"), ("JPY", "JP")]
+
+    for name, function in [("legacy", legacy_enrich_cruise), ("single pass", enrich_cruise)]:
+        seconds = min(
+            timeit.repeat(
+                lambda: [function(c, cur, ctry) for c in cruises for cur, ctry in markets],
+                number=1,
+                repeat=5,
+            )
+        )
+        calls = number_of_cruises * len(markets)
+        print(f"{name:<12} {seconds / calls * 1e6:>9.1f} us per cruise")
+
+    # the legacy guard also scanned blocks of other currencies for the same country
+    # (and other countries for the same currency), so its "cheapest" can differ
+    differ = sum(
+        legacy_enrich_cruise(c, cur, ctry)["price"] != enrich_cruise(c, cur, ctry)["price"]
+        for c in cruises
+        for cur, ctry in markets
+    )
+    print(f"different cheapest price: {differ} of {number_of_cruises * len(markets)}")
@@ -0,0 +1,94 @@
+"""Bytes transferred per DBTool read, whole documents vs. per-path projections.
+
+Run against the database configured in .env:
+    python tests/projection_bench.py [number_of_cruises]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from bson import ObjectId
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+
+from agent.tools.db.db import (
+    CRUISE_CARD_FIELDS,
+    CRUISE_SORT,
+    DEFAULT_PAGE_SIZE,
+    DBTool,
+    cruise_projection,
+)
+
+CURRENCY = "USD"
+COUNTRY = "US"
+
+
+def measure(fetch, repeat=3):
+    """Smallest wall time over `repeat` runs and the BSON bytes returned."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        docs = fetch()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return sum(len(doc.raw) for doc in docs), best
+
+
+def projected_page(collection, query):
+    collection.count_documents(query)
+    return list(
+        collection.find(query, cruise_projection(CRUISE_CARD_FIELDS, CURRENCY, COUNTRY))
+        .sort(CRUISE_SORT)
+        .limit(DEFAULT_PAGE_SIZE + 1)
+    )
+
+
+def report(name, before, after):
+    (bytes_before, time_before), (bytes_after, time_after) = before, after
+    print(
+        f"{name:<18} {bytes_before:>12,} B {time_before * 1000:>9.1f} ms"
+        f" {bytes_after:>12,} B {time_after * 1000:>9.1f} ms"
+        f" {bytes_before / max(bytes_after, 1):>7.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    sample_size = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    db_tool = DBTool()
+    # raw documents give the exact size received from the server
+    collection = db_tool.collection.with_options(
+        codec_options=CodecOptions(document_class=RawBSONDocument)
+    )
+    query = db_tool._build_cruise_query({}, CURRENCY, COUNTRY)
+    ids = [
+        doc["_id"]
+        for doc in db_tool.collection.find(query, {"_id": 1}).limit(sample_size)
+    ]
+    if not ids:
+        sys.exit("No upcoming cruises found")
+
+    print(f"{len(ids)} cruises, {CURRENCY}/{COUNTRY}")
+    print(f"{'read path':<18} {'before':>14} {'':>12} {'after':>14} {'':>12} {'ratio':>8}")
+
+    # search: the whole matching catalogue vs. a count plus one projected page
+    report(
+        "get_cruises",
+        measure(lambda: list(collection.find(query).sort("sailStartDate", 1))),
+        measure(lambda: projected_page(collection, query)),
+    )
+    # get_cruise_infor and get_list_cabin share one cached fetch per cruise
+    report(
+        "get_cruise_infor",
+        measure(lambda: [collection.find_one({"_id": ObjectId(_id)}) for _id in ids]),
+        measure(
+            lambda: [
+                collection.find_one(
+                    {"_id": ObjectId(_id)},
+                    cruise_projection(CRUISE_CARD_FIELDS, CURRENCY, COUNTRY),
+                )
+                for _id in ids
+            ]
+        ),
+    )
@@ -0,0 +1,106 @@
+"""Coverage and accuracy of the rule-based search pre-parser on the
+sample_data of input_test.py.
+
+Coverage is the share of messages the parser answers without the LLM,
+accuracy is measured on those. The dates of the dataset without a year were
+written against 2024, hence the default --today.
+    python tests/search_parser_score.py [--today 2024-01-01] [--verbose]
+"""
+
+import os
+import sys
+import ast
+import json
+import argparse
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+from agent.tools.utils.search_parser import SearchCriteriaParser, catalogue_places
+
+ATTRIBUTES = [
+    "embarkationPort",
+    "disembarkationPort",
+    "destinations",
+    "minDuration",
+    "maxDuration",
+    "minSailStartDate",
+    "maxSailStartDate",
+    "minSailEndDate",
+    "maxSailEndDate",
+    "maxPrice",
+    "minPrice",
+    "round_trip",
+    "ignore_destinations",
+    "price_discount",
+]
+
+
+def load_sample_data() -> list[dict]:
+    """sample_data of input_test.py, without importing its dependencies."""
+    with open(os.path.join(os.path.dirname(__file__), "input_test.py")) as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and getattr(node.targets[0], "id", None) == "sample_data":
+            return ast.literal_eval(node.value)
+    raise ValueError("sample_data not found in input_test.py")
+
+
+def normalize(value):
+    """None, [] and false all mean "not asked for"."""
+    if value in (None, [], False):
+        return None
+    if isinstance(value, list):
+        return sorted(str(item).casefold() for item in value)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def score(parser: SearchCriteriaParser, samples: list[dict], today: date, verbose=False):
+    parsed, exact = 0, 0
+    field_hits = dict.fromkeys(ATTRIBUTES, 0)
+    for sample in samples:
+        message = sample["User Message"]
+        expected = json.loads(sample["Expected Features Extraction"])[0]
+        result = parser.parse(message, today)
+        if result is None:
+            if verbose:
+                print(f"LLM      {message}")
+            continue
+        parsed += 1
+        actual = result.model_dump()
+        wrong = [
+            attribute
+            for attribute in ATTRIBUTES
+            if normalize(actual.get(attribute)) != normalize(expected.get(attribute))
+        ]
+        for attribute in ATTRIBUTES:
+            field_hits[attribute] += attribute not in wrong
+        exact += not wrong
+        if wrong:
+            details = ", ".join(
+                f"{attribute}: {actual.get(attribute)!r} expected {expected.get(attribute)!r}"
+                for attribute in wrong
+            )
+            print(f"WRONG    {message}\n         {details}")
+        elif verbose:
+            print(f"OK       {message}")
+
+    print(f"coverage {parsed}/{len(samples)} ({parsed / len(samples):.0%}) answered without the LLM")
+    if parsed:
+        print(f"accuracy {exact}/{parsed} ({exact / parsed:.0%}) parsed messages fully correct")
+        fields = sum(field_hits.values()) / (parsed * len(ATTRIBUTES))
+        print(f"field accuracy {fields:.1%}")
+    return parsed, exact
+
+
+if __name__ == "__main__":
+    from agent.tools.db.db import DBTool
+
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--today", default="2024-01-01", type=date.fromisoformat)
+    arg_parser.add_argument("--verbose", action="store_true")
+    args = arg_parser.parse_args()
+
+    parser = SearchCriteriaParser(*catalogue_places(DBTool().collection))
+    score(parser, load_sample_data(), args.today, args.verbose)
@@ -0,0 +1,64 @@
+"""Server startup time: importing agent_server, then the lifespan warmup
+until the agent can take the first chat turn.
+
+Each run is a fresh interpreter, so imports are cold as on a new worker.
+Run from the repository root with the .env of the server:
+    python tests/startup_bench.py [--runs 5]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+
+def child():
+    started = time.perf_counter()
+    sys.path.insert(0, SRC)
+    import asyncio
+    import agent_server
+
+    imported = time.perf_counter()
+
+    async def start():
+        async with agent_server.lifespan(agent_server.app):
+            await agent_server.get_agent()
+            return time.perf_counter()
+
+    ready = asyncio.run(start())
+    print(json.dumps({"import": imported - started, "ready": ready - started}))
+
+
+def main(runs: int):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, __file__, "--child"],
+            cwd=SRC,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    for key, label in (("import", "import agent_server"), ("ready", "agent ready")):
+        times = [result[key] for result in results]
+        print(
+            f"{label:20} median {statistics.median(times):.2f}s "
+            f"min {min(times):.2f}s max {max(times):.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child()
+    else:
+        main(args.runs)
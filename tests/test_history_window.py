@@ -0,0 +1,79 @@
+"""Every turn of a conversation reaches each node, either in the rolling
+summary or verbatim in its window.
+    python -m pytest tests/test_history_window.py
+"""
+
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+# the summarizer model is created at import but never called here
+os.environ.setdefault("OPENAI_API_KEY", "unused")
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from agent.objects.objects import AgentState
+from agent.tools.utils import history
+
+# the window budgets of the nodes in agent_main.py and cruise_agent.py
+NODE_HISTORY_TURNS = [2, 3, 4, 6]
+
+
+async def fake_summarize(messages, summary=None):
+    return " ".join(
+        message.content for message in messages if isinstance(message, HumanMessage)
+    )
+
+
+def covered_turns(state: AgentState, max_turns: int) -> set[str]:
+    window = history.window_messages(state, max_turns)
+    summarized = {
+        message.content
+        for message in state.messages[: state.summarized_until]
+        if isinstance(message, HumanMessage)
+    }
+    verbatim = {message.content for message in window if isinstance(message, HumanMessage)}
+    return summarized | verbatim
+
+
+def test_every_turn_is_summarized_or_in_the_window(monkeypatch):
+    monkeypatch.setattr(history, "_summarize", fake_summarize)
+    state = AgentState(messages=[])
+    turns = []
+    for turn in range(10):
+        turns.append(f"turn {turn}")
+        state.messages += [HumanMessage(content=turns[-1]), AIMessage(content="ok")]
+        # summarize_history runs at the start of every turn
+        update = asyncio.run(history.summarize_history(state, {}))
+        state = state.model_copy(update=update)
+        for max_turns in NODE_HISTORY_TURNS:
+            assert covered_turns(state, max_turns) == set(turns), (turn, max_turns)
+    assert state.summarized_until > 0
+
+
+def test_window_keeps_its_budget_of_turns(monkeypatch):
+    monkeypatch.setattr(history, "_summarize", fake_summarize)
+    messages = []
+    for turn in range(10):
+        messages += [HumanMessage(content=f"turn {turn}"), AIMessage(content="ok")]
+    state = AgentState(messages=messages, summary="earlier", summarized_until=16)
+    window = history.window_messages(state, 6)
+    assert isinstance(window[0], SystemMessage)
+    assert [m.content for m in window[1:] if isinstance(m, HumanMessage)] == [
+        f"turn {turn}" for turn in range(4, 10)
+    ]
+
+
+def test_rehydrated_turns_are_summarized_or_kept(monkeypatch):
+    monkeypatch.setattr(history, "_summarize", fake_summarize)
+    stored = []
+    for turn in range(10):
+        stored += [
+            {"isUser": True, "message": f"turn {turn}"},
+            {"isUser": False, "message": "ok"},
+        ]
+    seed = asyncio.run(history.rehydrate_history(stored))
+    state = AgentState(**seed)
+    for max_turns in NODE_HISTORY_TURNS:
+        assert covered_turns(state, max_turns) == {f"turn {turn}" for turn in range(10)}
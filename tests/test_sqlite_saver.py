@@ -0,0 +1,201 @@
+"""SqliteSaver against the reference MemorySaver: the same graph run on both
+must leave the same states, history and pending writes, also after a
+compaction and a reload from the file.
+    python -m pytest tests/test_sqlite_saver.py
+"""
+
+import os
+import sys
+from typing import Annotated
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph import END, START, StateGraph
+from langgraph.graph.message import add_messages
+from langgraph.types import Command, interrupt
+from pydantic import BaseModel
+
+from agent.checkpoint.sqlite_saver import SqliteSaver
+
+
+class State(BaseModel):
+    messages: Annotated[list[AnyMessage], add_messages]
+    list_cruises: list[dict] = []
+    confirmed: str | None = None
+
+
+def search(state: State):
+    turn = len(state.messages)
+    return {
+        "messages": [AIMessage(content=f"cruises {turn}", id=f"ai-{turn}")],
+        "list_cruises": [{"id": str(i), "desc": "x" * 200} for i in range(3)],
+    }
+
+
+def confirm(state: State):
+    if state.messages[-2].content != "pay":
+        return {}
+    answer = interrupt("confirm the payment?")
+    return {"confirmed": answer}
+
+
+def build(checkpointer):
+    # the subgraph gets the whole parent state as input, as the cruise agent does
+    sub = StateGraph(State)
+    sub.add_node("search", search)
+    sub.add_edge(START, "search")
+    sub.add_edge("search", END)
+
+    graph = StateGraph(State)
+    graph.add_node("cruise", sub.compile())
+    graph.add_node("confirm", confirm)
+    graph.add_edge(START, "cruise")
+    graph.add_edge("cruise", "confirm")
+    graph.add_edge("confirm", END)
+    return graph.compile(checkpointer=checkpointer)
+
+
+def run_conversation(graph, thread_id="t1"):
+    config = {"configurable": {"thread_id": thread_id}}
+    for turn, text in enumerate(["cruises to Lisbon", "cheaper", "pay"]):
+        graph.invoke(
+            {"messages": [HumanMessage(content=text, id=f"human-{turn}")]}, config
+        )
+    return config
+
+
+def graph_values(graph, config) -> dict:
+    return graph.get_state(config).values
+
+
+def snapshot(graph, config) -> dict:
+    state = graph.get_state(config)
+    return {
+        "values": state.values,
+        "next": state.next,
+        "interrupts": [i.value for task in state.tasks for i in task.interrupts],
+        "history": [
+            (s.values, s.next, s.metadata["step"])
+            for s in graph.get_state_history(config)
+        ],
+    }
+
+
+def pending_writes(checkpointer, config) -> list:
+    # interrupt ids hash the checkpoint id, so only their values compare
+    checkpoint_tuple = checkpointer.get_tuple(config)
+    return sorted(
+        (channel, repr([i.value for i in value] if channel == "__interrupt__" else value))
+        for _, channel, value in checkpoint_tuple.pending_writes
+    )
+
+
+def test_matches_memory_saver(tmp_path):
+    memory = build(MemorySaver())
+    sqlite = build(SqliteSaver(str(tmp_path / "checkpoints.sqlite")))
+    memory_config = run_conversation(memory)
+    sqlite_config = run_conversation(sqlite)
+
+    assert snapshot(sqlite, sqlite_config) == snapshot(memory, memory_config)
+    assert snapshot(sqlite, sqlite_config)["interrupts"] == ["confirm the payment?"]
+    assert pending_writes(sqlite.checkpointer, sqlite_config) == pending_writes(
+        memory.checkpointer, memory_config
+    )
+
+    memory.invoke(Command(resume="yes"), memory_config)
+    sqlite.invoke(Command(resume="yes"), sqlite_config)
+    assert snapshot(sqlite, sqlite_config) == snapshot(memory, memory_config)
+    assert graph_values(sqlite, sqlite_config)["confirmed"] == "yes"
+
+
+def test_list_filters_like_memory_saver(tmp_path):
+    memory = build(MemorySaver())
+    sqlite = build(SqliteSaver(str(tmp_path / "checkpoints.sqlite")))
+    run_conversation(memory)
+    run_conversation(sqlite)
+    # the parent graph only, MemorySaver orders the subgraph namespaces apart
+    config = {"configurable": {"thread_id": "t1", "checkpoint_ns": ""}}
+
+    def ids(checkpointer, **kwargs):
+        return [
+            (t.metadata["step"], t.metadata["source"], t.parent_config is None)
+            for t in checkpointer.list(config, **kwargs)
+        ]
+
+    assert ids(sqlite.checkpointer) == ids(memory.checkpointer)
+    assert ids(sqlite.checkpointer, limit=2) == ids(memory.checkpointer, limit=2)
+    assert ids(sqlite.checkpointer, filter={"source": "input"}) == ids(
+        memory.checkpointer, filter={"source": "input"}
+    )
+    before = list(sqlite.checkpointer.list(config))[2].config
+    memory_before = list(memory.checkpointer.list(config))[2].config
+    assert ids(sqlite.checkpointer, before=before) == ids(
+        memory.checkpointer, before=memory_before
+    )
+
+
+def test_compact_then_reload(tmp_path):
+    path = str(tmp_path / "checkpoints.sqlite")
+    sqlite = build(SqliteSaver(path))
+    config = run_conversation(sqlite)
+    before = graph_values(sqlite, config)
+
+    stats = sqlite.checkpointer.compact()
+    assert stats["deleted_checkpoints"] > 0
+    # a fresh process: nothing cached, everything read back from the file
+    reloaded = build(SqliteSaver(path))
+    assert graph_values(reloaded, config) == before
+    assert len(list(reloaded.get_state_history(config))) == 1
+    assert [i.value for task in reloaded.get_state(config).tasks for i in task.interrupts] == [
+        "confirm the payment?"
+    ]
+
+    reloaded.invoke(Command(resume="yes"), config)
+    reloaded.invoke({"messages": [HumanMessage(content="thanks", id="human-3")]}, config)
+    values = graph_values(build(SqliteSaver(path)), config)
+    assert values["confirmed"] == "yes"
+    assert [m.content for m in values["messages"]] == [
+        m.content for m in before["messages"]
+    ] + ["thanks", "cruises 7"]
+
+
+def test_expire_deletes_idle_threads(tmp_path):
+    saver = SqliteSaver(str(tmp_path / "checkpoints.sqlite"), ttl_seconds=3600)
+    sqlite = build(saver)
+    config = run_conversation(sqlite)
+    assert saver.expire() == 0
+    assert saver.expire(ttl_seconds=0) == 1
+    assert saver.get_tuple(config) is None
+
+
+
+def test_writers_sharing_the_file(tmp_path):
+    # two workers serving one thread in turn, the compact CLI running alongside
+    def build_flat(checkpointer):
+        graph = StateGraph(State)
+        graph.add_node("search", search)
+        graph.add_edge(START, "search")
+        graph.add_edge("search", END)
+        return graph.compile(checkpointer=checkpointer)
+
+    path = str(tmp_path / "checkpoints.sqlite")
+    worker_a = build_flat(SqliteSaver(path))
+    worker_b = build_flat(SqliteSaver(path, snapshot_every=0))
+    config = {"configurable": {"thread_id": "t1"}}
+    for turn, (worker, text) in enumerate(
+        [(worker_a, "one"), (worker_b, "two"), (worker_a, "three"), (worker_b, "four")]
+    ):
+        worker.invoke({"messages": [HumanMessage(content=text, id=f"human-{turn}")]}, config)
+        SqliteSaver(path).compact()
+    worker_a.invoke({"messages": [HumanMessage(content="five", id="human-4")]}, config)
+
+    values = graph_values(build_flat(SqliteSaver(path)), config)
+    assert [m.content for m in values["messages"] if isinstance(m, HumanMessage)] == [
+        "one",
+        "two",
+        "three",
+        "four",
+        "five",
+    ]